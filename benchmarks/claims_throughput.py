@@ -0,0 +1,121 @@
+"""
+Throughput of the offline processing of claims (lambdas/update/
+batch_processing.py) in records per minute, at several concurrency levels.
+
+OpenAI is the fake server of benchmarks/fake_openai.py with injectable
+latency and 429s; DynamoDB is moto. --complete is the fraction of claims
+that state every answer, the others are reported for a follow-up question.
+
+Usage:
+    python benchmarks/claims_throughput.py --records 200 --latency-ms 500
+    python benchmarks/claims_throughput.py --concurrency 1,8,16 --error-rate 0.05
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+
+import boto3
+
+from fake_openai import start_server
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.append(os.path.join(ROOT, "lambdas/shared/python"))
+sys.path.append(os.path.join(ROOT, "lambdas/update"))
+
+REGION_NAME = "us-east-1"
+FILLED_FORMS_TABLE_NAME = "ClaimsFilledForms"
+
+COMPLETE_CLAIM = (
+    "Hello, I just bought a house and need to insure it.\n"
+    "first_name: John\nlast_name: Doe\ntype_of_insurance: Home\n"
+    "phone_number: 4165550123\nage: 33"
+)
+PARTIAL_CLAIM = (
+    "Caller wants car insurance for a new car.\n"
+    "first_name: Jane\nlast_name: Roe\ntype_of_insurance: Car"
+)
+
+
+def make_records(count: int, complete: float) -> list:
+    return [
+        {
+            "id": f"claim-{index}",
+            "text": COMPLETE_CLAIM if random.random() < complete else PARTIAL_CLAIM,
+        }
+        for index in range(count)
+    ]
+
+
+def start_backend(args):
+    os.environ.setdefault("AWS_DEFAULT_REGION", REGION_NAME)
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+    os.environ["METRICS_ENABLED"] = "false"
+    os.environ["WARM_UP_ON_INIT"] = "false"
+
+    from moto import mock_aws
+
+    mock = mock_aws()
+    mock.start()
+    boto3.client("secretsmanager", region_name=REGION_NAME).create_secret(
+        Name="insurance_fills_secrets",
+        SecretString=json.dumps({"open_ai_key": "fake-key"}),
+    )
+    boto3.client("dynamodb", region_name=REGION_NAME).create_table(
+        TableName=FILLED_FORMS_TABLE_NAME,
+        KeySchema=[{"AttributeName": "conversation_id", "KeyType": "HASH"}],
+        AttributeDefinitions=[
+            {"AttributeName": "conversation_id", "AttributeType": "S"}
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    _, base_url = start_server(
+        latency_ms=args.latency_ms,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+    )
+    os.environ["OPENAI_API_BASE"] = base_url
+    return mock
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=100)
+    parser.add_argument(
+        "--concurrency", default="1,4,8", help="comma separated levels to compare"
+    )
+    parser.add_argument("--complete", type=float, default=0.8)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    args = parser.parse_args()
+
+    mock = start_backend(args)
+    try:
+        from batch_processing import BatchProcessor
+
+        records = make_records(args.records, args.complete)
+        print(
+            f"{'concurrency':>11} {'records/min':>12} {'seconds':>8} {'filled':>7} "
+            f"{'follow-up':>9} {'failed':>7} {'429s':>5}"
+        )
+        for concurrency in [int(level) for level in args.concurrency.split(",")]:
+            report_path = os.path.join(tempfile.mkdtemp(), "report.jsonl")
+            summary = BatchProcessor(
+                FILLED_FORMS_TABLE_NAME, report_path, concurrency
+            ).run(records)
+            print(
+                f"{concurrency:>11} {summary['records_per_minute']:>12.0f} "
+                f"{summary['seconds']:>8.2f} {summary.get('filled', 0):>7} "
+                f"{summary.get('follow_up', 0):>9} {summary.get('failed', 0):>7} "
+                f"{summary.get('rate_limited', 0):>5}"
+            )
+    finally:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Cold start of the update lambda: import time of its modules, measured with
+`python -X importtime`, and the latency of the first and second invocation,
+each in a fresh process against moto and the fake OpenAI server.
+
+With --baseline the same measurements are made on the lambdas/ directory of
+another git revision, e.g. the one before a startup optimization:
+    python benchmarks/cold_start.py --baseline HEAD~1
+
+Python keeps the compiled bytecode in __pycache__, which the read-only
+Lambda task root does not allow; --no-bytecode measures that case by
+importing from sources only.
+
+Usage:
+    python benchmarks/cold_start.py --runs 5
+    python benchmarks/cold_start.py --runs 5 --baseline HEAD~1 --top 15
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCHMARKS_DIR, "..")
+
+REGION_NAME = "us-east-1"
+DESCRIPTION = "Hello, I just bought a house and need to insure it."
+
+
+def probe_environment(lambdas_dir: str, no_bytecode: bool) -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [
+            os.path.join(lambdas_dir, "shared/python"),
+            os.path.join(lambdas_dir, "update"),
+            BENCHMARKS_DIR,
+        ]
+    )
+    env.setdefault("AWS_DEFAULT_REGION", REGION_NAME)
+    env.setdefault("AWS_ACCESS_KEY_ID", "local")
+    env.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+    env["METRICS_ENABLED"] = "false"
+    if no_bytecode:
+        env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def import_times(lambdas_dir: str, no_bytecode: bool) -> dict:
+    """
+    Cumulative import time in ms of every module imported by update_lambda
+    """
+    command = [sys.executable, "-X", "importtime"]
+    if no_bytecode:
+        # -B alone still reads existing bytecode, a new cache prefix does not
+        command += ["-X", f"pycache_prefix={tempfile.mkdtemp()}"]
+    command += ["-c", "import cold_start_setup; import update_lambda"]
+    stderr = subprocess.run(
+        command,
+        capture_output=True,
+        text=True,
+        check=True,
+        env=probe_environment(lambdas_dir, no_bytecode),
+        cwd=BENCHMARKS_DIR,
+    ).stderr
+
+    times = {}
+    measuring = False
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if name.strip() == "cold_start_setup":
+            # everything imported before is moto and the fake server
+            measuring = True
+            continue
+        if measuring and cumulative.strip().isdigit():
+            times[name.rstrip()] = int(cumulative) / 1000
+    return times
+
+
+def first_invocations(lambdas_dir: str, no_bytecode: bool) -> dict:
+    """
+    Import, first and second invocation time in ms, from a fresh process
+    """
+    command = [sys.executable]
+    if no_bytecode:
+        command += ["-X", f"pycache_prefix={tempfile.mkdtemp()}"]
+    command += [os.path.abspath(__file__), "--probe"]
+    stdout = subprocess.run(
+        command,
+        capture_output=True,
+        text=True,
+        check=True,
+        env=probe_environment(lambdas_dir, no_bytecode),
+        cwd=BENCHMARKS_DIR,
+    ).stdout
+    return json.loads(stdout.splitlines()[-1])
+
+
+def run_probe():
+    """
+    Runs in the fresh process started by first_invocations
+    """
+    import cold_start_setup
+
+    conversation_id = cold_start_setup.create_conversation()
+
+    start = perf_counter()
+    import update_lambda
+
+    timings = {"import": (perf_counter() - start) * 1000}
+    for name in ("first", "second"):
+        event = {
+            "pathParameters": {"conversation_id": conversation_id},
+            "body": json.dumps([{"role": "user", "content": DESCRIPTION}]),
+        }
+        start = perf_counter()
+        response = update_lambda.lambda_update(event, cold_start_setup.LambdaContext())
+        timings[name] = (perf_counter() - start) * 1000
+        if response["statusCode"] != 200:
+            raise RuntimeError(f"lambda_update failed: {response['body']}")
+    print(json.dumps(timings))
+
+
+def checkout(revision: str) -> str:
+    """
+    Extracts lambdas/ of a git revision to a temporary directory
+    """
+    target = tempfile.mkdtemp()
+    archive = subprocess.run(
+        ["git", "archive", revision, "lambdas"],
+        capture_output=True,
+        check=True,
+        cwd=ROOT,
+    ).stdout
+    subprocess.run(["tar", "-x", "-C", target], input=archive, check=True)
+    return os.path.join(target, "lambdas")
+
+
+def measure(lambdas_dir: str, runs: int, no_bytecode: bool) -> dict:
+    imports = [import_times(lambdas_dir, no_bytecode) for _ in range(runs)]
+    invocations = [first_invocations(lambdas_dir, no_bytecode) for _ in range(runs)]
+    modules = set().union(*imports)
+    return {
+        "modules": {
+            name: statistics.median(times.get(name, 0) for times in imports)
+            for name in modules
+        },
+        "invocations": {
+            name: statistics.median(timing[name] for timing in invocations)
+            for name in invocations[0]
+        },
+    }
+
+
+def report(label: str, result: dict, top: int):
+    print(f"{label}:")
+    modules = sorted(result["modules"].items(), key=lambda item: -item[1])
+    for name, ms in modules[:top]:
+        print(f"  {ms:>8.1f} ms  {name}")
+    invocations = result["invocations"]
+    print(
+        f"  import {invocations['import']:.1f} ms, first invocation "
+        f"{invocations['first']:.1f} ms, second {invocations['second']:.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports shown")
+    parser.add_argument("--baseline", help="git revision to compare with")
+    parser.add_argument("--no-bytecode", action="store_true")
+    parser.add_argument("--probe", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        run_probe()
+        return
+
+    current = measure(os.path.join(ROOT, "lambdas"), args.runs, args.no_bytecode)
+    if args.baseline:
+        baseline_dir = checkout(args.baseline)
+        baseline = measure(baseline_dir, args.runs, args.no_bytecode)
+        report(f"Baseline ({args.baseline})", baseline, args.top)
+    report("Working tree", current, args.top)
+
+
+if __name__ == "__main__":
+    main()
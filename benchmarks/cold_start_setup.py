@@ -0,0 +1,60 @@
+"""
+Backend of the processes started by cold_start.py. Importing it starts moto
+with the tables and the secret, and the fake OpenAI server, so everything
+imported after it belongs to the lambda.
+"""
+import json
+import os
+import time
+import uuid
+
+import boto3
+from moto import mock_aws
+
+from fake_openai import start_server
+
+REGION_NAME = "us-east-1"
+CONVERSATION_TABLE_NAME = "ColdStartConversations"
+FILLED_FORMS_TABLE_NAME = "ColdStartFilledForms"
+
+
+class LambdaContext:
+    def __init__(self, timeout_seconds: float = 30):
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int((self._deadline - time.monotonic()) * 1000)
+
+
+def create_conversation() -> str:
+    conversation_id = uuid.uuid4().hex[:10]
+    boto3.resource("dynamodb", region_name=REGION_NAME).Table(
+        CONVERSATION_TABLE_NAME
+    ).put_item(
+        Item={
+            "conversation_id": conversation_id,
+            "conversation": [{"role": "system", "content": "Fill the form."}],
+        }
+    )
+    return conversation_id
+
+
+mock = mock_aws()
+mock.start()
+for table_name in (CONVERSATION_TABLE_NAME, FILLED_FORMS_TABLE_NAME):
+    boto3.client("dynamodb", region_name=REGION_NAME).create_table(
+        TableName=table_name,
+        KeySchema=[{"AttributeName": "conversation_id", "KeyType": "HASH"}],
+        AttributeDefinitions=[
+            {"AttributeName": "conversation_id", "AttributeType": "S"}
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+boto3.client("secretsmanager", region_name=REGION_NAME).create_secret(
+    Name="insurance_fills_secrets",
+    SecretString=json.dumps({"open_ai_key": "fake-key"}),
+)
+_, base_url = start_server()
+os.environ["OPENAI_API_BASE"] = base_url
+os.environ["CONVERSATION_TABLE_NAME"] = CONVERSATION_TABLE_NAME
+os.environ["FILLED_FORMS_TABLE_NAME"] = FILLED_FORMS_TABLE_NAME
@@ -0,0 +1,181 @@
+"""
+Item size and capacity units per turn of the ConversationsTable, for the
+plain storage ({"role", "content"} maps, system prompt text in every item)
+and the compact one of conversation_codec (role codes, system prompt
+version, zlib compressed past COMPRESS_THRESHOLD_BYTES).
+
+A turn is one consistent read of the conversation and one write of the
+user message and the question; the write is billed on the larger of the
+item before and after. Only the messages are compared, the form state and
+token usage are stored the same way in both.
+
+Without --endpoint-url the units are estimated from item sizes. With
+--endpoint-url (e.g. DynamoDB Local) the turn is run against a temporary
+table and the ConsumedCapacity reported by DynamoDB is used.
+
+Usage:
+    python benchmarks/conversation_storage.py
+    python benchmarks/conversation_storage.py --endpoint-url http://localhost:8000
+"""
+import argparse
+import os
+import random
+import sys
+import uuid
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lambdas/shared/python"))
+
+from conversation_codec import (  # noqa: E402
+    COMPRESS_THRESHOLD_BYTES,
+    SYSTEM_PROMPTS,
+    compress_messages,
+    encode_messages,
+    encoded_size,
+)
+from conversation_store import append_update_params  # noqa: E402
+from conversation_write_units import create_table  # noqa: E402
+from dynamodb_size import item_size, read_units, write_units  # noqa: E402
+from form_schema import FIELD_QUESTIONS  # noqa: E402
+
+DESCRIPTION = (
+    "Hello, I just bought a house in Toronto with my partner and we need "
+    "home insurance before the closing date next month."
+)
+ANSWERS = [
+    "Anna",
+    "My last name is Kowalski",
+    "Home",
+    "416 555 0123",
+    "Sorry, it is 4165550123",
+    "I am 34 years old",
+    "Can you repeat the question?",
+    "Yes, that is correct",
+]
+QUESTIONS = list(FIELD_QUESTIONS.values()) + [
+    "Could you give your phone number as 10 digits?",
+    "Thank you! Is there anything else about the house I should know?",
+]
+
+
+def build_history(turns: int) -> list:
+    """
+    System prompt, the description and `turns` question and answer pairs
+    """
+    choice = random.Random(turns).choice
+    history = [
+        {"role": "system", "content": SYSTEM_PROMPTS[max(SYSTEM_PROMPTS)]},
+        {"role": "user", "content": DESCRIPTION},
+    ]
+    for _ in range(turns):
+        history.append({"role": "assistant", "content": choice(QUESTIONS)})
+        history.append({"role": "user", "content": choice(ANSWERS)})
+    return history
+
+
+def plain_item(history: list) -> dict:
+    return {"conversation_id": "a" * 10, "conversation": history, "version": 0}
+
+
+def compact_item(history: list) -> dict:
+    item = {"conversation_id": "a" * 10, "version": 0}
+    encoded = encode_messages(history)
+    if encoded_size(encoded) >= COMPRESS_THRESHOLD_BYTES:
+        item["conversation_archive"] = compress_messages(history)
+        item["conversation"] = []
+    else:
+        item["conversation"] = encoded
+    return item
+
+
+def new_messages(turns: int) -> list:
+    return [
+        {"role": "assistant", "content": QUESTIONS[turns % len(QUESTIONS)]},
+        {"role": "user", "content": ANSWERS[turns % len(ANSWERS)]},
+    ]
+
+
+def estimate_turn(turns: int) -> dict:
+    """
+    Estimates one more turn on a conversation that already has `turns` turns
+    """
+    before = build_history(turns)
+    after = before + new_messages(turns)
+    result = {}
+    for name, build in (("plain", plain_item), ("compact", compact_item)):
+        size_before = item_size(build(before))
+        size_after = item_size(build(after))
+        result[f"{name}_bytes"] = size_after
+        result[f"{name}_rcu"] = read_units(size_before)
+        result[f"{name}_wcu"] = write_units(max(size_before, size_after))
+    return result
+
+
+def units(response: dict, kind: str) -> float:
+    return response.get("ConsumedCapacity", {}).get(kind, 0)
+
+
+def measure_turn(table, turns: int) -> dict:
+    """
+    Runs one more turn against DynamoDB for both storages
+    """
+    before = build_history(turns)
+    messages = new_messages(turns)
+    result = {}
+    for name, build in (("plain", plain_item), ("compact", compact_item)):
+        conversation_id = uuid.uuid4().hex
+        table.put_item(Item=dict(build(before), conversation_id=conversation_id))
+        response = table.get_item(
+            Key={"conversation_id": conversation_id},
+            ConsistentRead=True,
+            ReturnConsumedCapacity="TOTAL",
+        )
+        result[f"{name}_rcu"] = units(response, "ReadCapacityUnits")
+        if name == "plain":
+            params = {
+                "Key": {"conversation_id": conversation_id},
+                "UpdateExpression": (
+                    "SET conversation = list_append(conversation, :new)"
+                ),
+                "ExpressionAttributeValues": {":new": messages},
+            }
+        else:
+            params = append_update_params(
+                conversation_id, messages, expected_version=0, history=before
+            )
+        response = table.update_item(ReturnConsumedCapacity="TOTAL", **params)
+        result[f"{name}_wcu"] = units(response, "WriteCapacityUnits")
+        result[f"{name}_bytes"] = item_size(build(before + messages))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--endpoint-url", help="DynamoDB endpoint to measure against")
+    parser.add_argument("--max-turns", type=int, default=40)
+    parser.add_argument("--step", type=int, default=5)
+    args = parser.parse_args()
+
+    table = create_table(args.endpoint_url) if args.endpoint_url else None
+
+    columns = [
+        "turns",
+        "plain_bytes",
+        "plain_rcu",
+        "plain_wcu",
+        "compact_bytes",
+        "compact_rcu",
+        "compact_wcu",
+    ]
+    print(" ".join(f"{column:>13}" for column in columns))
+    try:
+        for turns in range(0, args.max_turns + 1, args.step):
+            row = measure_turn(table, turns) if table else estimate_turn(turns)
+            row["turns"] = turns
+            print(" ".join(f"{row[column]:>13}" for column in columns))
+    finally:
+        if table is not None:
+            table.delete()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Capacity units consumed per turn versus transcript length, for the legacy
+read-modify-write storage, the append-only storage with one append per
+message, and the turn pipeline (one read, one append per turn).
+
+Without --endpoint-url the units are estimated from item sizes. With
+--endpoint-url (e.g. DynamoDB Local) every call is made against a temporary
+table and the ConsumedCapacity reported by DynamoDB is summed.
+
+Usage:
+    python benchmarks/conversation_write_units.py
+    python benchmarks/conversation_write_units.py --endpoint-url http://localhost:8000
+"""
+import argparse
+import os
+import sys
+import uuid
+
+import boto3
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lambdas/shared/python"))
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lambdas/create_get"))
+
+from constants import SYSTEM_SETUP_PROMPT  # noqa: E402
+from conversation_store import append_update_params  # noqa: E402
+from dynamodb_size import item_size, read_units, write_units  # noqa: E402
+
+USER_MESSAGE = {"role": "user", "content": "My phone number is 4165550123"}
+ASSISTANT_MESSAGE = {"role": "assistant", "content": "Thank you! What is your age?"}
+
+
+def build_item(turns: int) -> dict:
+    conversation = [{"role": "system", "content": SYSTEM_SETUP_PROMPT}]
+    conversation += [USER_MESSAGE, ASSISTANT_MESSAGE] * turns
+    return {"conversation_id": "a" * 10, "conversation": conversation, "version": turns}
+
+
+def estimate_turn(turns: int) -> dict:
+    """
+    Estimates one more turn on a conversation that already has `turns` turns
+    """
+    before = build_item(turns)
+    with_user = dict(before, conversation=before["conversation"] + [USER_MESSAGE])
+    after = build_item(turns + 1)
+
+    # get + put, then get + put again with the assistant question
+    legacy_rcu = read_units(item_size(before)) + read_units(item_size(with_user))
+    legacy_wcu = write_units(item_size(with_user)) + write_units(item_size(after))
+
+    # two appends, each billed on the larger of the item before and after
+    append_wcu = write_units(item_size(with_user)) + write_units(item_size(after))
+
+    # one consistent read, then one append of both messages
+    pipeline_rcu = read_units(item_size(before))
+    pipeline_wcu = write_units(item_size(after))
+
+    return {
+        "item_bytes": item_size(after),
+        "legacy_rcu": legacy_rcu,
+        "legacy_wcu": legacy_wcu,
+        "append_rcu": 0,
+        "append_wcu": append_wcu,
+        "pipeline_rcu": pipeline_rcu,
+        "pipeline_wcu": pipeline_wcu,
+    }
+
+
+def measure_turn(table, turns: int) -> dict:
+    """
+    Runs one more turn against a real table and sums the consumed capacity
+    """
+
+    def units(response: dict, kind: str) -> float:
+        return response.get("ConsumedCapacity", {}).get(kind, 0)
+
+    result = {"item_bytes": item_size(build_item(turns + 1))}
+
+    conversation_id = uuid.uuid4().hex
+    table.put_item(Item=dict(build_item(turns), conversation_id=conversation_id))
+    rcu = wcu = 0
+    for message in (USER_MESSAGE, ASSISTANT_MESSAGE):
+        response = table.get_item(
+            Key={"conversation_id": conversation_id},
+            ConsistentRead=True,
+            ReturnConsumedCapacity="TOTAL",
+        )
+        rcu += units(response, "ReadCapacityUnits")
+        item = response["Item"]
+        item["conversation"].append(message)
+        response = table.put_item(Item=item, ReturnConsumedCapacity="TOTAL")
+        wcu += units(response, "WriteCapacityUnits")
+    result.update(legacy_rcu=rcu, legacy_wcu=wcu)
+
+    conversation_id = uuid.uuid4().hex
+    table.put_item(Item=dict(build_item(turns), conversation_id=conversation_id))
+    wcu = 0
+    for message in (USER_MESSAGE, ASSISTANT_MESSAGE):
+        params = append_update_params(conversation_id, [message])
+        response = table.update_item(ReturnConsumedCapacity="TOTAL", **params)
+        wcu += units(response, "WriteCapacityUnits")
+    result.update(append_rcu=0, append_wcu=wcu)
+
+    conversation_id = uuid.uuid4().hex
+    table.put_item(Item=dict(build_item(turns), conversation_id=conversation_id))
+    response = table.get_item(
+        Key={"conversation_id": conversation_id},
+        ConsistentRead=True,
+        ReturnConsumedCapacity="TOTAL",
+    )
+    rcu = units(response, "ReadCapacityUnits")
+    params = append_update_params(
+        conversation_id, [USER_MESSAGE, ASSISTANT_MESSAGE], expected_version=turns
+    )
+    response = table.update_item(ReturnConsumedCapacity="TOTAL", **params)
+    wcu = units(response, "WriteCapacityUnits")
+    result.update(pipeline_rcu=rcu, pipeline_wcu=wcu)
+
+    return result
+
+
+def create_table(endpoint_url: str):
+    dynamodb = boto3.resource("dynamodb", endpoint_url=endpoint_url)
+    table = dynamodb.create_table(
+        TableName=f"bench-conversations-{uuid.uuid4().hex[:8]}",
+        KeySchema=[{"AttributeName": "conversation_id", "KeyType": "HASH"}],
+        AttributeDefinitions=[
+            {"AttributeName": "conversation_id", "AttributeType": "S"}
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    table.wait_until_exists()
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--endpoint-url", help="DynamoDB endpoint to measure against")
+    parser.add_argument("--max-turns", type=int, default=40)
+    parser.add_argument("--step", type=int, default=5)
+    args = parser.parse_args()
+
+    table = create_table(args.endpoint_url) if args.endpoint_url else None
+
+    columns = [
+        "turns",
+        "item_bytes",
+        "legacy_rcu",
+        "legacy_wcu",
+        "append_rcu",
+        "append_wcu",
+        "pipeline_rcu",
+        "pipeline_wcu",
+    ]
+    print(" ".join(f"{column:>11}" for column in columns))
+    try:
+        for turns in range(0, args.max_turns + 1, args.step):
+            row = measure_turn(table, turns) if table else estimate_turn(turns)
+            row["turns"] = turns
+            print(" ".join(f"{row[column]:>11}" for column in columns))
+    finally:
+        if table is not None:
+            table.delete()
+
+
+if __name__ == "__main__":
+    main()
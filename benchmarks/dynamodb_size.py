@@ -0,0 +1,45 @@
+"""
+DynamoDB item size and capacity unit estimates.
+
+Follows the sizing rules from the DynamoDB developer guide: attribute names
+and string values count their UTF-8 length, numbers roughly one byte per two
+significant digits plus one, binary values their length, and lists and maps
+three bytes plus one byte per element.
+"""
+import math
+from decimal import Decimal
+
+
+def value_size(value) -> int:
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, (int, float, Decimal)):
+        digits = len(str(abs(value)).replace(".", "").lstrip("0")) or 1
+        return math.ceil(digits / 2) + 1
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return 3 + sum(
+            len(key.encode("utf-8")) + value_size(item) + 1
+            for key, item in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return 3 + sum(value_size(item) + 1 for item in value)
+    raise TypeError(f"Unsupported type: {type(value)}")
+
+
+def item_size(item: dict) -> int:
+    return sum(
+        len(key.encode("utf-8")) + value_size(value) for key, value in item.items()
+    )
+
+
+def write_units(size: int) -> int:
+    return max(1, math.ceil(size / 1024))
+
+
+def read_units(size: int, consistent: bool = True) -> float:
+    units = max(1, math.ceil(size / 4096))
+    return units if consistent else units / 2
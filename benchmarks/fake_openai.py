@@ -0,0 +1,351 @@
+"""
+Local stand-in for the OpenAI chat completions API.
+
+It plays a scripted questionnaire: every user message moves it to the next
+question through `ask_follow_up_question`, and once all questions were
+answered it calls `save_users_questionnaire` with the collected answers.
+Answers can also be given upfront as `field: value` lines of the first
+message, as in the claims of benchmarks/batch_processing.py.
+Both plain and streamed (`"stream": true`) requests are supported; both
+wait the latency and then the chunk delay for every chunk of the answer,
+so they take as long to generate. Audio transcriptions return TRANSCRIPT
+after the same latency. Latency, with an optional slow tail, and 429 rate
+limit responses can be injected, at random or by enforcing a requests per
+minute limit reported in `x-ratelimit-*` headers like OpenAI.
+
+Point the update lambda to it with:
+    python benchmarks/fake_openai.py --port 8089
+    export OPENAI_API_BASE=http://localhost:8089/v1
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUESTIONS = [
+    ("first_name", "Thank you! What is your first name?"),
+    ("last_name", "What is your last name?"),
+    ("type_of_insurance", "What is the type of insurance you need?"),
+    ("phone_number", "What is your phone number?"),
+    ("age", "What is your age?"),
+]
+
+TRANSCRIPT = "Hello, I just bought a house and need to insure it."
+
+
+def stated_answers(text: str) -> dict:
+    """
+    Returns the answers written as `field: value` lines of a message
+    """
+    fields = {field for field, _ in QUESTIONS}
+    answers = {}
+    for line in text.splitlines():
+        field, _, answer = line.partition(":")
+        answer = answer.strip()
+        if field.strip() in fields and answer:
+            answers[field.strip()] = int(answer) if answer.isdigit() else answer
+    return answers
+
+
+def scripted_function_call(messages: list) -> dict:
+    """
+    Returns the function call the fake model makes for a conversation
+    """
+    user_messages = [m["content"] for m in messages if m["role"] == "user"]
+    # the first user message describes the situation and may already state
+    # answers as `field: value` lines, the next ones answer in order
+    answers = stated_answers(user_messages[0]) if user_messages else {}
+    remaining = [(field, q) for field, q in QUESTIONS if field not in answers]
+    for (field, _), answer in zip(remaining, user_messages[1:]):
+        answers[field] = int(answer) if answer.isdigit() else answer
+
+    answered = len(user_messages) - 1
+    if answered < len(remaining):
+        field, question = remaining[answered]
+        arguments = {
+            "next_question": question,
+            "pending_field": field,
+            "collected_answers": answers,
+        }
+        return {"name": "ask_follow_up_question", "arguments": json.dumps(arguments)}
+
+    return {"name": "save_users_questionnaire", "arguments": json.dumps(answers)}
+
+
+class RequestBucket:
+    """
+    Token bucket of the requests per minute allowed by the fake server
+    """
+
+    def __init__(self, requests_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self._available = float(requests_per_minute)
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> (bool, int, float):
+        """
+        Returns if the request is allowed, the requests left and the seconds
+        until the next one is available
+        """
+        with self._lock:
+            now = time.monotonic()
+            rate = self.requests_per_minute / 60
+            self._available = min(
+                self.requests_per_minute,
+                self._available + (now - self._refilled_at) * rate,
+            )
+            self._refilled_at = now
+            allowed = self._available >= 1
+            if allowed:
+                self._available -= 1
+            reset = max(0.0, (1 - self._available) / rate)
+            return allowed, int(self._available), reset
+
+
+def generation_ms(function_call: dict, options: dict) -> float:
+    """
+    Function to get the time taken to generate the chunks of an answer
+    """
+    chunks = -(-len(function_call["arguments"]) // options["chunk_size"])
+    return chunks * options["chunk_delay_ms"]
+
+
+def rate_limit_headers(bucket: RequestBucket, remaining: int, reset: float) -> dict:
+    return {
+        "x-ratelimit-limit-requests": str(bucket.requests_per_minute),
+        "x-ratelimit-remaining-requests": str(remaining),
+        "x-ratelimit-reset-requests": f"{int(reset * 1000)}ms",
+    }
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:
+            # clients close idle keep-alive connections without notice
+            pass
+
+    def _send_json(self, status: int, body: dict, headers: dict = None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_rate_limited(self, retry_after: float, headers: dict = None):
+        self.server.stats["rate_limited"] += 1
+        payload = json.dumps(
+            {"error": {"message": "Rate limit reached", "type": "requests"}}
+        ).encode()
+        self.send_response(429)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("retry-after-ms", str(int(retry_after * 1000)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        options = self.server.options
+        self.server.stats["requests"] += 1
+
+        if self.path.endswith("/audio/transcriptions"):
+            time.sleep(options["latency_ms"] / 1000)
+            self._send_json(200, {"text": TRANSCRIPT})
+            return
+        request = json.loads(body)
+
+        if random.random() < options["error_rate"]:
+            self._send_rate_limited(options["retry_after"])
+            return
+
+        headers = {}
+        bucket = self.server.bucket
+        if bucket is not None:
+            allowed, remaining, reset = bucket.take()
+            headers = rate_limit_headers(bucket, remaining, reset)
+            if not allowed:
+                self._send_rate_limited(reset, headers)
+                return
+
+        function_call = scripted_function_call(request["messages"])
+        latency_ms = options["latency_ms"]
+        if random.random() < options["slow_rate"]:
+            latency_ms += options["slow_ms"]
+        if request.get("stream"):
+            self._stream(request, function_call, options, headers, latency_ms)
+            return
+
+        time.sleep((latency_ms + generation_ms(function_call, options)) / 1000)
+        prompt_tokens = sum(len(m["content"] or "") for m in request["messages"]) // 4
+        completion_tokens = len(function_call["arguments"]) // 4
+        self._send_json(
+            200,
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "model": request["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": None,
+                            "function_call": function_call,
+                        },
+                        "finish_reason": "function_call",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+            headers,
+        )
+
+    def _stream(
+        self,
+        request: dict,
+        function_call: dict,
+        options: dict,
+        headers: dict,
+        latency_ms: float,
+    ):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        def send(data: str):
+            payload = f"data: {data}\n\n".encode()
+            self.wfile.write(f"{len(payload):X}\r\n".encode() + payload + b"\r\n")
+            self.wfile.flush()
+
+        def chunk(delta: dict, finish_reason: str = None) -> str:
+            return json.dumps(
+                {
+                    "object": "chat.completion.chunk",
+                    "model": request["model"],
+                    "choices": [
+                        {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                    ],
+                }
+            )
+
+        time.sleep(latency_ms / 1000)
+        send(
+            chunk(
+                {
+                    "role": "assistant",
+                    "content": None,
+                    "function_call": {"name": function_call["name"], "arguments": ""},
+                }
+            )
+        )
+        arguments = function_call["arguments"]
+        size = options["chunk_size"]
+        for start in range(0, len(arguments), size):
+            time.sleep(options["chunk_delay_ms"] / 1000)
+            piece = arguments[start : start + size]
+            send(chunk({"function_call": {"arguments": piece}}))
+        send(chunk({}, finish_reason="function_call"))
+        send("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def start_server(
+    port: int = 0,
+    latency_ms: float = 0,
+    chunk_size: int = 4,
+    chunk_delay_ms: float = 0,
+    error_rate: float = 0,
+    retry_after: float = 0.1,
+    requests_per_minute: int = 0,
+    slow_rate: float = 0,
+    slow_ms: float = 0,
+) -> (ThreadingHTTPServer, str):
+    """
+    Starts the fake server in a background thread, returns it and its base url
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.options = {
+        "latency_ms": latency_ms,
+        "chunk_size": chunk_size,
+        "chunk_delay_ms": chunk_delay_ms,
+        "error_rate": error_rate,
+        "retry_after": retry_after,
+        "slow_rate": slow_rate,
+        "slow_ms": slow_ms,
+    }
+    server.bucket = RequestBucket(requests_per_minute) if requests_per_minute else None
+    # requests received and answered with 429
+    server.stats = Counter()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--chunk-size", type=int, default=4)
+    parser.add_argument("--chunk-delay-ms", type=float, default=0)
+    parser.add_argument(
+        "--error-rate", type=float, default=0, help="fraction of 429 responses"
+    )
+    parser.add_argument(
+        "--retry-after", type=float, default=0.1, help="seconds asked by a 429"
+    )
+    parser.add_argument(
+        "--rpm", type=int, default=0, help="requests per minute before 429s"
+    )
+    parser.add_argument(
+        "--slow-rate", type=float, default=0, help="fraction of slow responses"
+    )
+    parser.add_argument(
+        "--slow-ms", type=float, default=0, help="extra latency of slow responses"
+    )
+    args = parser.parse_args()
+
+    server, base_url = start_server(
+        args.port,
+        args.latency_ms,
+        args.chunk_size,
+        args.chunk_delay_ms,
+        args.error_rate,
+        args.retry_after,
+        args.rpm,
+        args.slow_rate,
+        args.slow_ms,
+    )
+    print(f"Fake OpenAI API listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
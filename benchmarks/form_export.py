@@ -0,0 +1,127 @@
+"""
+Throughput of bulk form reads: one GetItem per form (what clients of
+GET /form/{conversation_id} do) against BatchGetItem, and the NDJSON export
+with 1 to --max-segments parallel scan segments.
+
+Runs against moto by default, or DynamoDB Local with --endpoint-url, on a
+temporary table filled with --forms synthetic forms.
+
+Usage:
+    python benchmarks/form_export.py --forms 2000
+    python benchmarks/form_export.py --forms 20000 --endpoint-url http://localhost:8000
+"""
+import argparse
+import os
+import sys
+import uuid
+from time import perf_counter
+
+import boto3
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.append(os.path.join(ROOT, "lambdas/shared/python"))
+
+REGION_NAME = "us-east-1"
+
+
+def create_table(table_name: str, forms: int) -> list:
+    """
+    Creates the table with `forms` filled forms, returns their ids
+    """
+    dynamodb = boto3.resource("dynamodb", region_name=REGION_NAME)
+    table = dynamodb.create_table(
+        TableName=table_name,
+        KeySchema=[{"AttributeName": "conversation_id", "KeyType": "HASH"}],
+        AttributeDefinitions=[
+            {"AttributeName": "conversation_id", "AttributeType": "S"}
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    table.wait_until_exists()
+
+    conversation_ids = [uuid.uuid4().hex[:10] for _ in range(forms)]
+    with table.batch_writer() as batch:
+        for index, conversation_id in enumerate(conversation_ids):
+            batch.put_item(
+                Item={
+                    "conversation_id": conversation_id,
+                    "first_name": "John",
+                    "last_name": "Doe",
+                    "type_of_insurance": "Home",
+                    "phone_number": 4165550000 + index,
+                    "age": 20 + index % 60,
+                    "create_time": "2026-10-18 12:00:00",
+                }
+            )
+    return conversation_ids
+
+
+def rate(count: int, seconds: float) -> str:
+    return f"{count / seconds:>10.0f} forms/s ({seconds:.2f}s)"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--forms", type=int, default=2000)
+    parser.add_argument("--max-segments", type=int, default=8)
+    parser.add_argument("--endpoint-url", help="DynamoDB Local, moto if not set")
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", REGION_NAME)
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+    os.environ["METRICS_ENABLED"] = "false"
+    mock = None
+    if args.endpoint_url:
+        os.environ["AWS_ENDPOINT_URL_DYNAMODB"] = args.endpoint_url
+    else:
+        from moto import mock_aws
+
+        mock = mock_aws()
+        mock.start()
+
+    from aws_resources import get_dynamodb_table
+    from filled_forms import batch_get_forms, export_page, to_ndjson
+
+    table_name = f"FormExportBenchmark{uuid.uuid4().hex[:8]}"
+    conversation_ids = create_table(table_name, args.forms)
+    try:
+        table = get_dynamodb_table(table_name)
+        start = perf_counter()
+        for conversation_id in conversation_ids:
+            table.get_item(Key={"conversation_id": conversation_id})
+        print(f"GetItem per form:      {rate(args.forms, perf_counter() - start)}")
+
+        start = perf_counter()
+        forms = batch_get_forms(table_name, conversation_ids)
+        assert len(forms) == args.forms
+        print(f"BatchGetItem:          {rate(args.forms, perf_counter() - start)}")
+
+        segments = 1
+        while segments <= args.max_segments:
+            start = perf_counter()
+            exported = pages = 0
+            cursor = None
+            while True:
+                forms, cursor = export_page(table_name, cursor, segments)
+                to_ndjson(forms)
+                exported += len(forms)
+                pages += 1
+                if cursor is None:
+                    break
+            assert exported == args.forms
+            print(
+                f"Export, {segments} segment(s): "
+                f"{rate(exported, perf_counter() - start)}, {pages} pages"
+            )
+            segments *= 2
+    finally:
+        boto3.client("dynamodb", region_name=REGION_NAME).delete_table(
+            TableName=table_name
+        )
+        if mock is not None:
+            mock.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Tail latency of chat completion requests with and without hedging.
+
+Two fake OpenAI servers (benchmarks/fake_openai.py) answer after --latency-ms,
+and a fraction --slow-rate of their answers takes --slow-ms longer. Requests
+go either to the first server only, or to both as providers "openai,local":
+when the first has not answered within its p95 latency, the same request is
+sent to the second one and the first answer is used.
+
+Each configuration runs in a fresh process, the first --warmup requests
+fill the latency histogram and are not measured. Reported: p50/p95/p99/max
+latency and the extra requests sent because of hedging.
+
+Usage:
+    python benchmarks/hedged_requests.py --requests 300 --slow-rate 0.03 --slow-ms 2000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCHMARKS_DIR, "..")
+
+MESSAGES = [
+    {"role": "system", "content": "Fill the form."},
+    {"role": "user", "content": "Hello, I just bought a house and need to insure it."},
+]
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_probe(config: dict):
+    """
+    Runs in the fresh process started by run_configuration
+    """
+    from fake_openai import start_server
+
+    servers = []
+    for variable in ("OPENAI_API_BASE", "LOCAL_OPENAI_BASE"):
+        server, base_url = start_server(
+            latency_ms=config["latency_ms"],
+            slow_rate=config["slow_rate"],
+            slow_ms=config["slow_ms"],
+        )
+        os.environ[variable] = base_url
+        servers.append(server)
+    os.environ["OPENAI_PROVIDERS"] = config["providers"]
+
+    from openai_client import chat_completion_request
+
+    def request(_) -> float:
+        start = perf_counter()
+        chat_completion_request(MESSAGES, "fake-key").json()
+        return (perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(config["concurrency"]) as executor:
+        list(executor.map(request, range(config["warmup"])))
+        sent = sum(server.stats["requests"] for server in servers)
+        latencies = list(executor.map(request, range(config["requests"])))
+    extra = sum(server.stats["requests"] for server in servers) - sent
+    extra -= config["requests"]
+
+    print(
+        json.dumps(
+            {
+                "p50": percentile(latencies, 0.5),
+                "p95": percentile(latencies, 0.95),
+                "p99": percentile(latencies, 0.99),
+                "max": max(latencies),
+                "extra_requests": extra,
+            }
+        )
+    )
+
+
+def run_configuration(providers: str, args) -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [
+            os.path.join(ROOT, "lambdas/shared/python"),
+            os.path.join(ROOT, "lambdas/update"),
+            BENCHMARKS_DIR,
+        ]
+    )
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    env["METRICS_ENABLED"] = "false"
+    config = {
+        "providers": providers,
+        "requests": args.requests,
+        "warmup": args.warmup,
+        "concurrency": args.concurrency,
+        "latency_ms": args.latency_ms,
+        "slow_rate": args.slow_rate,
+        "slow_ms": args.slow_ms,
+    }
+    stdout = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--probe", json.dumps(config)],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+        cwd=BENCHMARKS_DIR,
+    ).stdout
+    return json.loads(stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--slow-rate", type=float, default=0.03)
+    parser.add_argument("--slow-ms", type=float, default=2000)
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        run_probe(json.loads(args.probe))
+        return
+
+    print(
+        f"{'providers':>14} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+        f"{'max ms':>8} {'extra requests':>15}"
+    )
+    for providers in ("openai", "openai,local"):
+        result = run_configuration(providers, args)
+        extra = result["extra_requests"] / args.requests
+        print(
+            f"{providers:>14} {result['p50']:>8.0f} {result['p95']:>8.0f} "
+            f"{result['p99']:>8.0f} {result['max']:>8.0f} {extra:>14.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
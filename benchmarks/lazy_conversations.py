@@ -0,0 +1,173 @@
+"""
+POST /form with conversations created eagerly (one PutItem per call) and
+lazily (a signed conversation_id, the item written by the first turn).
+
+The frontends create a conversation on every page load and every reset,
+and most of them are never answered. Each mode runs in a fresh process
+against moto and the fake OpenAI server: --page-loads calls of
+lambda_create_form, then one turn on --answer-rate of the conversations.
+Reported per mode: p50/p95 latency of create and of the first turn, the
+DynamoDB writes of create, the write units they cost (estimated from the
+item size, moto does not report consumed capacity) and the items left in
+the ConversationsTable.
+
+Latencies are those of moto in process, they compare the work done by the
+handlers rather than predict the deployed numbers.
+
+Usage:
+    python benchmarks/lazy_conversations.py --page-loads 200 --answer-rate 0.2
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+from time import perf_counter
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCHMARKS_DIR, "..")
+
+CONVERSATION_ID_SECRET_NAME = "LazyConversationsIdKey"
+FIRST_MESSAGE = "Hello, I just bought a house and need to insure it."
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_probe(config: dict):
+    """
+    Runs in the fresh process started by run_mode
+    """
+    import boto3
+    import cold_start_setup as setup
+
+    if config["lazy"]:
+        boto3.client("secretsmanager", region_name=setup.REGION_NAME).create_secret(
+            Name=CONVERSATION_ID_SECRET_NAME,
+            SecretString=json.dumps({"key": os.urandom(32).hex()}),
+        )
+    table = boto3.resource("dynamodb", region_name=setup.REGION_NAME).Table(
+        setup.CONVERSATION_TABLE_NAME
+    )
+
+    from create_get_lambda import lambda_create_form
+    from dynamodb_size import item_size, write_units
+    from update_lambda import lambda_update
+
+    create_ms = []
+    conversation_ids = []
+    for _ in range(config["page_loads"]):
+        start = perf_counter()
+        response = lambda_create_form({"body": json.dumps([])}, None)
+        create_ms.append((perf_counter() - start) * 1000)
+        conversation_ids.append(json.loads(response["body"])["conversation_id"])
+    # every item stored so far was written by lambda_create_form
+    created = table.scan()["Items"]
+    create_wcu = sum(write_units(item_size(item)) for item in created)
+
+    answered = random.Random(0).sample(
+        conversation_ids, int(len(conversation_ids) * config["answer_rate"])
+    )
+    turn_ms = []
+    for conversation_id in answered:
+        event = {
+            "pathParameters": {"conversation_id": conversation_id},
+            "body": json.dumps([{"role": "user", "content": FIRST_MESSAGE}]),
+        }
+        start = perf_counter()
+        response = lambda_update(event, setup.LambdaContext())
+        turn_ms.append((perf_counter() - start) * 1000)
+        assert response["statusCode"] == 200, response["body"]
+
+    print(
+        json.dumps(
+            {
+                "create_p50_ms": percentile(create_ms, 0.5),
+                "create_p95_ms": percentile(create_ms, 0.95),
+                "turn_p50_ms": percentile(turn_ms, 0.5),
+                "turn_p95_ms": percentile(turn_ms, 0.95),
+                "create_writes": len(created),
+                "create_wcu": create_wcu,
+                "items": table.scan(Select="COUNT")["Count"],
+            }
+        )
+    )
+
+
+def run_mode(lazy: bool, args) -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [
+            os.path.join(ROOT, "lambdas/shared/python"),
+            os.path.join(ROOT, "lambdas/create_get"),
+            os.path.join(ROOT, "lambdas/update"),
+            BENCHMARKS_DIR,
+        ]
+    )
+    env.update(
+        AWS_DEFAULT_REGION="us-east-1",
+        AWS_ACCESS_KEY_ID="testing",
+        AWS_SECRET_ACCESS_KEY="testing",
+        METRICS_ENABLED="false",
+        WARM_UP_ON_INIT="false",
+    )
+    env.pop("CONVERSATION_ID_SECRET_NAME", None)
+    if lazy:
+        env["CONVERSATION_ID_SECRET_NAME"] = CONVERSATION_ID_SECRET_NAME
+    config = {
+        "lazy": lazy,
+        "page_loads": args.page_loads,
+        "answer_rate": args.answer_rate,
+    }
+    stdout = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--probe", json.dumps(config)],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+        cwd=BENCHMARKS_DIR,
+    ).stdout
+    return json.loads(stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--page-loads", type=int, default=200)
+    parser.add_argument(
+        "--answer-rate",
+        type=float,
+        default=0.2,
+        help="share of the conversations that get a first turn",
+    )
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        run_probe(json.loads(args.probe))
+        return
+
+    print(
+        f"{args.page_loads} page loads, "
+        f"{args.answer_rate:.0%} of the conversations answered"
+    )
+    print(
+        f"{'mode':>6} {'create p50':>11} {'create p95':>11} {'turn p50':>9} "
+        f"{'turn p95':>9} {'writes':>7} {'WCU':>5} {'items':>6}"
+    )
+    for name, lazy in (("eager", False), ("lazy", True)):
+        result = run_mode(lazy, args)
+        print(
+            f"{name:>6} {result['create_p50_ms']:>11.2f} "
+            f"{result['create_p95_ms']:>11.2f} {result['turn_p50_ms']:>9.1f} "
+            f"{result['turn_p95_ms']:>9.1f} {result['create_writes']:>7} "
+            f"{result['create_wcu']:>5} {result['items']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""
+Load test of lambda_create_form, lambda_update and lambda_get_form.
+
+The handlers are called in process with synthetic API Gateway events. Each
+virtual user creates a form, answers the questionnaire turn by turn and
+reads the filled form; --concurrency users run at the same time. DynamoDB is
+moto (default) or DynamoDB Local (--endpoint-url), and OpenAI is the fake
+server of benchmarks/fake_openai.py with injectable latency and 429s.
+
+Reported per handler: p50/p95/p99 latency, invocations per second, errors,
+and the DynamoDB read/write capacity units consumed (ReturnConsumedCapacity
+is added to every data call; moto does not report it for every operation,
+DynamoDB Local does). Cold starts are measured in fresh processes:
+module import, first invocation and the next (warm) invocation.
+
+In Lambda every concurrent invocation has its own container. Here the users
+share one process, so the numbers compare revisions of the hot path rather
+than predict the deployed throughput.
+
+Usage:
+    python benchmarks/load_test.py --users 50 --concurrency 10 --latency-ms 300
+    python benchmarks/load_test.py --error-rate 0.1 --endpoint-url http://localhost:8000
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import boto3
+
+from fake_openai import start_server
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.append(os.path.join(ROOT, "lambdas/shared/python"))
+sys.path.append(os.path.join(ROOT, "lambdas/create_get"))
+sys.path.append(os.path.join(ROOT, "lambdas/update"))
+
+REGION_NAME = "us-east-1"
+CONVERSATION_TABLE_NAME = "LoadTestConversations"
+FILLED_FORMS_TABLE_NAME = "LoadTestFilledForms"
+SECRET = {"open_ai_key": "fake-key"}
+# Timeout of the handlers in the CDK stack
+LAMBDA_TIMEOUT_SECONDS = 30
+
+DESCRIPTION = "Hello, I just bought a house and need to insure it."
+ANSWERS = ["John", "Doe", "Home", "4165550123", "33"]
+
+READ_OPERATIONS = ("GetItem", "BatchGetItem", "Query", "Scan")
+DATA_OPERATIONS = READ_OPERATIONS + (
+    "PutItem",
+    "UpdateItem",
+    "DeleteItem",
+    "BatchWriteItem",
+    "TransactWriteItems",
+)
+
+_current = threading.local()
+
+
+class LambdaContext:
+    """
+    The part of the Lambda context object used by the handlers
+    """
+
+    def __init__(self, timeout_seconds: float = LAMBDA_TIMEOUT_SECONDS):
+        self.aws_request_id = uuid.uuid4().hex
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int((self._deadline - time.monotonic()) * 1000)
+
+
+class CapacityMeter:
+    """
+    Sums the consumed capacity of DynamoDB calls per handler
+    """
+
+    def __init__(self):
+        self.units = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def register(self, session: boto3.Session):
+        for operation in DATA_OPERATIONS:
+            session.events.register(
+                f"provide-client-params.dynamodb.{operation}", self._request_capacity
+            )
+            session.events.register(
+                f"after-call.dynamodb.{operation}", self._add_capacity
+            )
+
+    def _request_capacity(self, params: dict, **kwargs):
+        params.setdefault("ReturnConsumedCapacity", "TOTAL")
+
+    def _add_capacity(self, parsed: dict, model, **kwargs):
+        consumed = parsed.get("ConsumedCapacity") or []
+        if isinstance(consumed, dict):
+            consumed = [consumed]
+        kind = "rcu" if model.name in READ_OPERATIONS else "wcu"
+        handler = getattr(_current, "handler", "setup")
+        with self._lock:
+            for capacity in consumed:
+                self.units[handler][kind] += capacity.get("CapacityUnits", 0)
+
+
+def api_event(conversation_id: str = None, body=None) -> dict:
+    """
+    Builds an API Gateway HTTP API (payload 2.0) event
+    """
+    event = {
+        "version": "2.0",
+        "headers": {"content-type": "application/json"},
+        "requestContext": {"http": {"method": "POST"}},
+        "isBase64Encoded": False,
+    }
+    if conversation_id is not None:
+        event["pathParameters"] = {"conversation_id": conversation_id}
+    if body is not None:
+        event["body"] = json.dumps(body)
+    return event
+
+
+def create_tables(endpoint_url: str = None):
+    dynamodb = boto3.resource(
+        "dynamodb", region_name=REGION_NAME, endpoint_url=endpoint_url
+    )
+    existing = [table.name for table in dynamodb.tables.all()]
+    for table_name in (CONVERSATION_TABLE_NAME, FILLED_FORMS_TABLE_NAME):
+        if table_name in existing:
+            continue
+        dynamodb.create_table(
+            TableName=table_name,
+            KeySchema=[{"AttributeName": "conversation_id", "KeyType": "HASH"}],
+            AttributeDefinitions=[
+                {"AttributeName": "conversation_id", "AttributeType": "S"}
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        ).wait_until_exists()
+
+
+def start_backend(args) -> object:
+    """
+    Starts moto or points boto3 to DynamoDB Local, creates the tables and
+    starts the fake OpenAI server. Returns the moto mock to stop, if any.
+    """
+    os.environ.setdefault("AWS_DEFAULT_REGION", REGION_NAME)
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+    os.environ["CONVERSATION_TABLE_NAME"] = CONVERSATION_TABLE_NAME
+    os.environ["FILLED_FORMS_TABLE_NAME"] = FILLED_FORMS_TABLE_NAME
+
+    mock = None
+    if args.endpoint_url:
+        os.environ["AWS_ENDPOINT_URL_DYNAMODB"] = args.endpoint_url
+    else:
+        from moto import mock_aws
+
+        mock = mock_aws()
+        mock.start()
+        boto3.client("secretsmanager", region_name=REGION_NAME).create_secret(
+            Name="insurance_fills_secrets", SecretString=json.dumps(SECRET)
+        )
+    create_tables(args.endpoint_url)
+
+    _, base_url = start_server(
+        latency_ms=args.latency_ms,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+    )
+    os.environ["OPENAI_API_BASE"] = base_url
+    return mock
+
+
+def use_local_secret(args):
+    """
+    DynamoDB Local has no Secrets Manager, the handlers get the key directly
+    """
+    if args.endpoint_url:
+        from aws_resources import secret_cache
+
+        secret_cache.set(SECRET)
+
+
+def invoke(handler_name: str, handler, event: dict, results: dict) -> dict:
+    """
+    Calls a handler and records its latency and status code
+    """
+    _current.handler = handler_name
+    start = perf_counter()
+    response = handler(event, LambdaContext())
+    elapsed_ms = (perf_counter() - start) * 1000
+    results[handler_name].append((elapsed_ms, response["statusCode"]))
+    _current.handler = None
+    return response
+
+
+def run_user(handlers: dict, results: dict):
+    """
+    One conversation: create, answer every question, get the filled form
+    """
+    response = invoke("create", handlers["create"], api_event(), results)
+    if response["statusCode"] != 200:
+        return
+    conversation_id = json.loads(response["body"])["conversation_id"]
+
+    for answer in [DESCRIPTION] + ANSWERS:
+        event = api_event(conversation_id, [{"role": "user", "content": answer}])
+        response = invoke("update", handlers["update"], event, results)
+        if response["statusCode"] != 200:
+            return
+        if json.loads(response["body"])["is_finished"]:
+            break
+
+    invoke("get", handlers["get"], api_event(conversation_id), results)
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def report_load(results: dict, meter: CapacityMeter, wall_seconds: float):
+    print(
+        f"{'handler':>8} {'calls':>6} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'p99 ms':>8} {'calls/s':>8} {'RCU':>8} {'WCU':>8}"
+    )
+    for handler_name in ("create", "update", "get"):
+        calls = results[handler_name]
+        if not calls:
+            continue
+        latencies = [elapsed_ms for elapsed_ms, _ in calls]
+        errors = sum(1 for _, status in calls if status >= 400)
+        units = meter.units[handler_name]
+        print(
+            f"{handler_name:>8} {len(calls):>6} {errors:>6} "
+            f"{percentile(latencies, 0.5):>8.1f} {percentile(latencies, 0.95):>8.1f} "
+            f"{percentile(latencies, 0.99):>8.1f} {len(calls) / wall_seconds:>8.1f} "
+            f"{units['rcu']:>8.1f} {units['wcu']:>8.1f}"
+        )
+    total = sum(len(calls) for calls in results.values())
+    print(
+        f"Total: {total} invocations in {wall_seconds:.1f}s, {total / wall_seconds:.1f}/s"
+    )
+
+
+def run_load(args):
+    mock = start_backend(args)
+    try:
+        # hooks must be on the default session before the handlers create
+        # clients, and after moto started as it replaces the default session
+        boto3.setup_default_session(region_name=REGION_NAME)
+        meter = CapacityMeter()
+        meter.register(boto3.DEFAULT_SESSION)
+        use_local_secret(args)
+        from create_get_lambda import lambda_create_form, lambda_get_form
+        from update_lambda import lambda_update
+
+        handlers = {
+            "create": lambda_create_form,
+            "update": lambda_update,
+            "get": lambda_get_form,
+        }
+        # warm the modules so the load phase only measures warm invocations
+        run_user(handlers, defaultdict(list))
+        meter.units.clear()
+
+        results = defaultdict(list)
+        start = perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            futures = [
+                executor.submit(run_user, handlers, results) for _ in range(args.users)
+            ]
+            for future in futures:
+                future.result()
+        report_load(results, meter, perf_counter() - start)
+    finally:
+        if mock is not None:
+            mock.stop()
+
+
+def run_cold_probe(args):
+    """
+    Runs in a fresh process: times the handler module imports, the first
+    and the second invocation of each handler, prints them as JSON
+    """
+    mock = start_backend(args)
+    try:
+        use_local_secret(args)
+        timings = {}
+
+        start = perf_counter()
+        import create_get_lambda
+
+        timings["create_get_import"] = (perf_counter() - start) * 1000
+        start = perf_counter()
+        import update_lambda
+
+        timings["update_import"] = (perf_counter() - start) * 1000
+
+        handlers = {
+            "create": create_get_lambda.lambda_create_form,
+            "update": update_lambda.lambda_update,
+            "get": create_get_lambda.lambda_get_form,
+        }
+        results = defaultdict(list)
+        run_user(handlers, results)
+        run_user(handlers, results)
+        for handler_name, calls in results.items():
+            timings[f"{handler_name}_first"] = calls[0][0]
+            # the first call of the second user
+            timings[f"{handler_name}_warm"] = calls[len(calls) // 2][0]
+        print(json.dumps(timings))
+    finally:
+        if mock is not None:
+            mock.stop()
+
+
+def run_cold_starts(args):
+    command = [sys.executable, __file__, "--cold-probe"]
+    command += ["--latency-ms", str(args.latency_ms)]
+    if args.metrics:
+        command += ["--metrics"]
+    if args.endpoint_url:
+        command += ["--endpoint-url", args.endpoint_url]
+
+    samples = defaultdict(list)
+    for _ in range(args.cold_starts):
+        output = subprocess.run(
+            command, capture_output=True, text=True, check=True
+        ).stdout
+        for name, value in json.loads(output.splitlines()[-1]).items():
+            samples[name].append(value)
+
+    print(f"Cold start, median of {args.cold_starts} fresh processes (ms):")
+    print(
+        f"  create_get_lambda import: {statistics.median(samples['create_get_import']):.1f}"
+    )
+    print(
+        f"  update_lambda import:     {statistics.median(samples['update_import']):.1f}"
+    )
+    for handler_name in ("create", "update", "get"):
+        first = statistics.median(samples[f"{handler_name}_first"])
+        warm = statistics.median(samples[f"{handler_name}_warm"])
+        print(f"  {handler_name:>6}: first call {first:.1f}, warm call {warm:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument(
+        "--error-rate", type=float, default=0, help="fraction of OpenAI 429s"
+    )
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    parser.add_argument("--endpoint-url", help="DynamoDB Local, moto if not set")
+    parser.add_argument("--cold-starts", type=int, default=3)
+    parser.add_argument(
+        "--metrics", action="store_true", help="print the handlers' EMF records"
+    )
+    parser.add_argument("--cold-probe", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    os.environ["METRICS_ENABLED"] = "true" if args.metrics else "false"
+
+    if args.cold_probe:
+        run_cold_probe(args)
+        return
+    run_load(args)
+    if args.cold_starts:
+        run_cold_starts(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Fraction of turns answered by the local fast path and the latency it saves,
+on synthetic conversations played against the fake OpenAI server.
+
+Each conversation starts with a free-text description (always sent to the
+model) and then answers the five questions, each answer being clean or, with
+probability --messy-fraction, phrased so that only the model can parse it.
+
+Usage:
+    python benchmarks/local_fast_path.py --conversations 50 --latency-ms 800
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+from time import perf_counter
+
+from fake_openai import start_server
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.append(os.path.join(ROOT, "lambdas/shared/python"))
+sys.path.append(os.path.join(ROOT, "lambdas/update"))
+
+SYSTEM_PROMPT = {"role": "system", "content": "Fill the insurance questionnaire."}
+DESCRIPTION = "Hello, I just bought a house and need to insure it."
+
+CLEAN_ANSWERS = {
+    "first_name": ["John", "Maria", "Li"],
+    "last_name": ["Doe", "O'Neil", "Smith-Jones"],
+    "type_of_insurance": ["Home", "auto", "Life insurance"],
+    "phone_number": ["4165550123", "(416) 555-0123", "+1 416 555 0123"],
+    "age": ["33", "41", "67"],
+}
+MESSY_ANSWERS = {
+    "first_name": ["My first name is John", "john, thanks"],
+    "last_name": ["It's Doe", "Doe is my last name"],
+    "type_of_insurance": ["I need it for my car", "the house one"],
+    "phone_number": ["call me at 416 555 0123", "555-0123"],
+    "age": ["thirty three", "I am 41 years old"],
+}
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def play_conversation(rng: random.Random, messy_fraction: float) -> list:
+    """
+    Plays one conversation, returns (served locally, latency in ms) per turn
+    """
+    from local_extractor import FIELD_QUESTIONS, try_local_turn
+    from update_lambda import generate_assistant_response, merge_model_state
+
+    history = [SYSTEM_PROMPT]
+    state = {}
+    replies = [DESCRIPTION]
+    for field in FIELD_QUESTIONS:
+        answers = MESSY_ANSWERS if rng.random() < messy_fraction else CLEAN_ANSWERS
+        replies.append(rng.choice(answers[field]))
+
+    turns = []
+    for reply in replies:
+        user_message = [{"role": "user", "content": reply}]
+        start = perf_counter()
+        local_turn = try_local_turn(state, user_message)
+        if local_turn is not None:
+            is_finished, value, state = local_turn
+        else:
+            is_finished, value, _, model_state = generate_assistant_response(
+                history + user_message, "fake-key"
+            )
+            state = merge_model_state(state, model_state)
+        turns.append((local_turn is not None, (perf_counter() - start) * 1000))
+
+        history += user_message
+        if is_finished:
+            break
+        history.append({"role": "assistant", "content": value})
+    return turns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--messy-fraction", type=float, default=0.2)
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server, base_url = start_server(latency_ms=args.latency_ms)
+    os.environ["OPENAI_API_BASE"] = base_url
+
+    rng = random.Random(args.seed)
+    turns = []
+    for _ in range(args.conversations):
+        turns += play_conversation(rng, args.messy_fraction)
+    server.shutdown()
+
+    local = [ms for served_locally, ms in turns if served_locally]
+    model = [ms for served_locally, ms in turns if not served_locally]
+    print(f"turns: {len(turns)}, served locally: {len(local) / len(turns):.1%}")
+    for name, values in (("model turns", model), ("local turns", local)):
+        print(
+            f"{name:<12} p50 {percentile(values, 0.5):8.2f} ms"
+            f"   p95 {percentile(values, 0.95):8.2f} ms"
+        )
+    print(
+        f"saved per local turn: p50 "
+        f"{percentile(model, 0.5) - percentile(local, 0.5):.0f} ms, p95 "
+        f"{percentile(model, 0.95) - percentile(local, 0.95):.0f} ms"
+    )
+    print(f"median turn latency: {statistics.median(ms for _, ms in turns):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Prompt tokens sent with every turn: the hand written system prompt and the
+untyped `user_answers` function schema the service used before, against the
+prompt and the strict function schema generated from `form_schema.py`.
+
+Malformed function calls and forms rejected by validation are counted in
+production by the update lambda (`malformed_function_call` and
+`form_validation_failed` EMF metrics).
+
+Usage:
+    python benchmarks/prompt_size.py
+"""
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.append(os.path.join(ROOT, "lambdas/shared/python"))
+sys.path.append(os.path.join(ROOT, "lambdas/update"))
+
+from context_window import count_prompt_tokens  # noqa: E402
+from form_schema import (  # noqa: E402
+    FIELD_QUESTIONS,
+    build_functions,
+    build_system_prompt,
+)
+from openai_client import GPT_MODEL  # noqa: E402
+
+LEGACY_SYSTEM_PROMPT = """
+    You are a polite and smart AI assistant that helps people fill questionnaire to apply for an insurance.
+    Behave formal and with respect to the user.
+    We need to fill all next questions:
+    1) What is your first name?
+    2) What is your last name?
+    3) What is the type of insurance you need?
+    4) What is your phone number?
+    5) What is your age?
+
+    We expect final response in json with keys: "first_name", "last_name", "age", "type_of_insurance", "phone_number".
+
+    Allowed types of insurance are: "Auto", "Home", "Condo", "Tenant", "Farm", "Commercial", "Life".
+
+    Make sure that the phone number either has 10 digits or (11 digits and starts with +1).
+    Don't save +1 for the phone number, we need only next 10 digits. Store as int.
+    Don't ask a user details (10 digits or (11 digits and starts with +1)), just ask about their phone number \n
+    If the phone number is given in wrong format first time, then ask one more time with details
+
+    Age should be int value with year granularity, don't accept a string.
+
+    Please ask one question at a time.
+    """
+
+LEGACY_FUNCTIONS = [
+    {
+        "name": "save_users_questionnaire",
+        "description": "If user responded all questions, store fully filled questionnaire to the database",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "user_answers": {
+                    "type": "object",
+                    "description": "Keys of the dict are questions to the user and "
+                    "values are user's responses in strings to the corresponding questions",
+                },
+            },
+            "required": ["user_answers"],
+        },
+    },
+    {
+        "name": "ask_follow_up_question",
+        "description": "If the user didn't answer all the questions, "
+        "generates an additional question to ask user.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "next_question": {
+                    "type": "string",
+                    "description": "Next question which we will ask user to clarify their response",
+                },
+                "pending_field": {
+                    "type": "string",
+                    "enum": list(FIELD_QUESTIONS),
+                    "description": "Field of the questionnaire the next question asks about",
+                },
+                "collected_answers": {
+                    "type": "object",
+                    "description": "Answers the user gave so far, keyed by field name",
+                },
+            },
+            "required": ["next_question"],
+        },
+    },
+]
+
+
+def prompt_tokens(system_prompt: str, functions: list) -> (int, int):
+    """
+    Returns the tokens of the system message alone and with the functions
+    """
+    messages = [{"role": "system", "content": system_prompt}]
+    return (
+        count_prompt_tokens(messages, GPT_MODEL),
+        count_prompt_tokens(messages, GPT_MODEL, functions),
+    )
+
+
+def main():
+    legacy = prompt_tokens(LEGACY_SYSTEM_PROMPT, LEGACY_FUNCTIONS)
+    generated = prompt_tokens(build_system_prompt(), build_functions())
+
+    print(f"{'':>10} {'system':>8} {'with functions':>15}")
+    print(f"{'legacy':>10} {legacy[0]:>8} {legacy[1]:>15}")
+    print(f"{'schema':>10} {generated[0]:>8} {generated[1]:>15}")
+    saved = legacy[1] - generated[1]
+    print(f"Saved per model call: {saved} tokens ({saved / legacy[1]:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Burst of concurrent lambda_update invocations against the fake OpenAI server
+enforcing a requests per minute limit (429s with `x-ratelimit-*` headers).
+
+Each configuration runs in a fresh process, like a new set of containers:
+- "headers only": no client-side limit, only the blocks set from 429s and
+  `x-ratelimit-remaining-*` headers
+- "shared limit": OPENAI_RPM_LIMIT set to the limit of the server, counted
+  in a DynamoDB table (moto) by every invocation
+- with --baseline, the lambdas/ directory of another git revision
+
+Reported: turns answered, 503s (retry later), other errors, latency of the
+answered and of the rejected invocations, and the requests and 429s seen by
+the server. A 503 returned at once is cheaper than one returned at the
+deadline after retrying against OpenAI.
+
+Usage:
+    python benchmarks/rate_limit_burst.py --burst 100 --server-rpm 60
+    python benchmarks/rate_limit_burst.py --burst 100 --baseline HEAD~1
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from cold_start import checkout
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCHMARKS_DIR, "..")
+
+REGION_NAME = "us-east-1"
+RATE_LIMIT_TABLE_NAME = "BurstRateLimit"
+DESCRIPTION = "Hello, I just bought a house and need to insure it."
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_probe(config: dict):
+    """
+    Runs in the fresh process started by run_configuration
+    """
+    import boto3
+    import cold_start_setup
+    from fake_openai import start_server
+
+    boto3.client("dynamodb", region_name=REGION_NAME).create_table(
+        TableName=RATE_LIMIT_TABLE_NAME,
+        KeySchema=[{"AttributeName": "limiter_key", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "limiter_key", "AttributeType": "S"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    server, base_url = start_server(
+        latency_ms=config["latency_ms"], requests_per_minute=config["server_rpm"]
+    )
+    os.environ["OPENAI_API_BASE"] = base_url
+
+    import update_lambda
+
+    conversation_ids = [
+        cold_start_setup.create_conversation() for _ in range(config["burst"])
+    ]
+
+    def invoke(conversation_id: str) -> (int, float):
+        event = {
+            "pathParameters": {"conversation_id": conversation_id},
+            "body": json.dumps([{"role": "user", "content": DESCRIPTION}]),
+        }
+        context = cold_start_setup.LambdaContext(config["timeout"])
+        start = perf_counter()
+        response = update_lambda.lambda_update(event, context)
+        return response["statusCode"], (perf_counter() - start) * 1000
+
+    start = perf_counter()
+    with ThreadPoolExecutor(config["burst"]) as executor:
+        results = list(executor.map(invoke, conversation_ids))
+    wall_seconds = perf_counter() - start
+
+    answered = [ms for status, ms in results if status == 200]
+    rejected = [ms for status, ms in results if status == 503]
+    print(
+        json.dumps(
+            {
+                "answered": len(answered),
+                "rejected": len(rejected),
+                "errors": len(results) - len(answered) - len(rejected),
+                "answered_p95": percentile(answered, 0.95),
+                "rejected_p50": percentile(rejected, 0.5),
+                "rejected_p95": percentile(rejected, 0.95),
+                "server_requests": server.stats["requests"],
+                "server_429s": server.stats["rate_limited"],
+                "wall_seconds": wall_seconds,
+            }
+        )
+    )
+
+
+def run_configuration(lambdas_dir: str, environment: dict, args) -> dict:
+    env = dict(os.environ)
+    env.update(environment)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [
+            os.path.join(lambdas_dir, "shared/python"),
+            os.path.join(lambdas_dir, "update"),
+            BENCHMARKS_DIR,
+        ]
+    )
+    env.setdefault("AWS_DEFAULT_REGION", REGION_NAME)
+    env.setdefault("AWS_ACCESS_KEY_ID", "local")
+    env.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+    env["METRICS_ENABLED"] = "false"
+    env["WARM_UP_ON_INIT"] = "false"
+    config = {
+        "burst": args.burst,
+        "server_rpm": args.server_rpm,
+        "latency_ms": args.latency_ms,
+        "timeout": args.timeout,
+    }
+    stdout = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--probe", json.dumps(config)],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+        cwd=BENCHMARKS_DIR,
+    ).stdout
+    return json.loads(stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--burst", type=int, default=100, help="concurrent turns")
+    parser.add_argument("--server-rpm", type=int, default=60)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument(
+        "--timeout", type=float, default=10, help="Lambda timeout in seconds"
+    )
+    parser.add_argument("--baseline", help="git revision to compare with")
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        run_probe(json.loads(args.probe))
+        return
+
+    lambdas_dir = os.path.join(ROOT, "lambdas")
+    shared_limit = {
+        "OPENAI_RPM_LIMIT": str(args.server_rpm),
+        "RATE_LIMIT_TABLE_NAME": RATE_LIMIT_TABLE_NAME,
+    }
+    configurations = [
+        ("headers only", lambdas_dir, {}),
+        ("shared limit", lambdas_dir, shared_limit),
+    ]
+    if args.baseline:
+        configurations.insert(
+            0, (f"baseline {args.baseline}", checkout(args.baseline), shared_limit)
+        )
+
+    print(
+        f"{'configuration':>16} {'answered':>8} {'503s':>5} {'errors':>6} "
+        f"{'ok p95 ms':>10} {'503 p50 ms':>10} {'503 p95 ms':>10} "
+        f"{'server reqs':>11} {'server 429s':>11} {'wall s':>7}"
+    )
+    for label, directory, environment in configurations:
+        result = run_configuration(directory, environment, args)
+        print(
+            f"{label:>16} {result['answered']:>8} {result['rejected']:>5} "
+            f"{result['errors']:>6} {result['answered_p95']:>10.0f} "
+            f"{result['rejected_p50']:>10.0f} {result['rejected_p95']:>10.0f} "
+            f"{result['server_requests']:>11} {result['server_429s']:>11} "
+            f"{result['wall_seconds']:>7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Time to first token of the streamed response versus the plain response,
+measured against the fake OpenAI server.
+
+Usage:
+    python benchmarks/time_to_first_token.py --latency-ms 300 --chunk-delay-ms 30
+"""
+import argparse
+import os
+import statistics
+import sys
+from time import perf_counter
+
+from fake_openai import start_server
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.append(os.path.join(ROOT, "lambdas/shared/python"))
+sys.path.append(os.path.join(ROOT, "lambdas/update"))
+
+HISTORY = [
+    {"role": "system", "content": "Fill the insurance questionnaire."},
+    {"role": "user", "content": "I need insurance for my new car."},
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--chunk-delay-ms", type=float, default=30)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    server, base_url = start_server(
+        latency_ms=args.latency_ms, chunk_delay_ms=args.chunk_delay_ms
+    )
+    os.environ["OPENAI_API_BASE"] = base_url
+    from update_lambda import generate_assistant_response
+
+    plain, first_token, streamed = [], [], []
+    for _ in range(args.runs):
+        start = perf_counter()
+        generate_assistant_response(list(HISTORY), "fake-key")
+        plain.append((perf_counter() - start) * 1000)
+
+        start = perf_counter()
+        first = []
+
+        def on_token(text):
+            if not first:
+                first.append((perf_counter() - start) * 1000)
+
+        generate_assistant_response(list(HISTORY), "fake-key", on_token)
+        streamed.append((perf_counter() - start) * 1000)
+        first_token.append(first[0])
+
+    server.shutdown()
+    print(f"plain response:        median {statistics.median(plain):.0f} ms")
+    print(f"streamed first token:  median {statistics.median(first_token):.0f} ms")
+    print(f"streamed full response: median {statistics.median(streamed):.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Latency of the transcription engines of lambdas/transcribe per second of audio.
+
+Each engine runs in a fresh process, like a new container: the time to load
+the engine (the faster-whisper model for "local") is reported separately,
+then every recording is transcribed once to warm up and --repeat times
+measured. Reported: load time, p50 latency per recording, milliseconds per
+second of audio and real-time factor (processing time / audio duration).
+
+- "openai" needs OPENAI_API_KEY, or --fake to use benchmarks/fake_openai.py,
+  which answers after --latency-ms whatever the audio: only the upload and
+  the request overhead are measured
+- "local" needs `pip install faster-whisper`; the model (WHISPER_MODEL,
+  base.en by default) is downloaded to WHISPER_MODEL_DIR on first use
+
+Recordings are WAV files given with --audio. Without them, silent clips are
+generated, which only make sense with --fake: Whisper skips silence.
+
+Usage:
+    python benchmarks/transcription_latency.py --audio turn1.wav turn2.wav
+    python benchmarks/transcription_latency.py --fake --engines openai
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import wave
+from time import perf_counter
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCHMARKS_DIR, "..")
+
+SAMPLE_RATE = 16000
+GENERATED_SECONDS = (2, 5, 10)
+
+
+def audio_seconds(path: str) -> float:
+    with wave.open(path, "rb") as recording:
+        return recording.getnframes() / recording.getframerate()
+
+
+def silent_clips(directory: str) -> list:
+    """
+    Writes 16kHz mono WAV clips of silence, for runs against the fake server
+    """
+    paths = []
+    for seconds in GENERATED_SECONDS:
+        path = os.path.join(directory, f"silence_{seconds}s.wav")
+        with wave.open(path, "wb") as clip:
+            clip.setnchannels(1)
+            clip.setsampwidth(2)
+            clip.setframerate(SAMPLE_RATE)
+            clip.writeframes(b"\0\0" * SAMPLE_RATE * seconds)
+        paths.append(path)
+    return paths
+
+
+def run_probe(config: dict):
+    """
+    Runs in the fresh process started by run_engine
+    """
+    if config["fake"]:
+        from fake_openai import start_server
+
+        _, base_url = start_server(latency_ms=config["latency_ms"])
+        os.environ["OPENAI_API_BASE"] = base_url
+        os.environ["OPENAI_API_KEY"] = "fake-key"
+    openai_key = os.environ.get("OPENAI_API_KEY")
+    if config["engine"] == "openai" and not openai_key:
+        print(json.dumps({"skipped": "OPENAI_API_KEY is not set"}))
+        return
+
+    from transcription import get_transcriber
+
+    start = perf_counter()
+    try:
+        transcriber = get_transcriber()
+    except Exception as e:
+        # faster-whisper not installed, or the model could not be downloaded
+        reason = str(e).splitlines()[0] if str(e) else ""
+        print(json.dumps({"skipped": f"{type(e).__name__}: {reason}"}))
+        return
+    load_seconds = perf_counter() - start
+
+    latencies = []
+    total_ms = 0.0
+    total_audio_seconds = 0.0
+    for path in config["audio"]:
+        with open(path, "rb") as recording:
+            audio = recording.read()
+        filename = os.path.basename(path)
+        transcriber.transcribe(audio, filename, openai_key)
+        for _ in range(config["repeat"]):
+            start = perf_counter()
+            transcriber.transcribe(audio, filename, openai_key)
+            latency_ms = (perf_counter() - start) * 1000
+            latencies.append(latency_ms)
+            total_ms += latency_ms
+            total_audio_seconds += audio_seconds(path)
+
+    latencies.sort()
+    print(
+        json.dumps(
+            {
+                "load_seconds": load_seconds,
+                "p50_ms": latencies[len(latencies) // 2],
+                "ms_per_audio_second": total_ms / total_audio_seconds,
+                "real_time_factor": total_ms / 1000 / total_audio_seconds,
+            }
+        )
+    )
+
+
+def run_engine(engine: str, audio: list, args) -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [
+            os.path.join(ROOT, "lambdas/shared/python"),
+            os.path.join(ROOT, "lambdas/update"),
+            os.path.join(ROOT, "lambdas/transcribe"),
+            BENCHMARKS_DIR,
+        ]
+    )
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    env["METRICS_ENABLED"] = "false"
+    env["WARM_UP_ON_INIT"] = "false"
+    env["TRANSCRIBE_ENGINE"] = engine
+    env.setdefault("WHISPER_MODEL_DIR", os.path.join(tempfile.gettempdir(), "whisper"))
+    config = {
+        "engine": engine,
+        "audio": audio,
+        "repeat": args.repeat,
+        "fake": args.fake and engine == "openai",
+        "latency_ms": args.latency_ms,
+    }
+    stdout = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--probe", json.dumps(config)],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+        cwd=BENCHMARKS_DIR,
+    ).stdout
+    return json.loads(stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--audio", nargs="+", help="WAV recordings")
+    parser.add_argument("--engines", nargs="+", default=["openai", "local"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--fake", action="store_true", help="fake OpenAI server")
+    parser.add_argument(
+        "--latency-ms", type=float, default=300, help="latency of the fake server"
+    )
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        run_probe(json.loads(args.probe))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        audio = [os.path.abspath(path) for path in args.audio or []]
+        if not audio:
+            audio = silent_clips(directory)
+        total_seconds = sum(audio_seconds(path) for path in audio)
+        print(f"{len(audio)} recordings, {total_seconds:.1f}s of audio")
+
+        print(
+            f"{'engine':>8} {'load s':>7} {'p50 ms':>8} "
+            f"{'ms/audio s':>11} {'RTF':>6}"
+        )
+        for engine in args.engines:
+            result = run_engine(engine, audio, args)
+            if "skipped" in result:
+                print(f"{engine:>8} skipped: {result['skipped']}")
+                continue
+            print(
+                f"{engine:>8} {result['load_seconds']:>7.1f} "
+                f"{result['p50_ms']:>8.0f} {result['ms_per_audio_second']:>11.0f} "
+                f"{result['real_time_factor']:>6.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
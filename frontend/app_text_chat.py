@@ -4,7 +4,6 @@ from streamlit_chat import message
 from utils import (
     begin_conversation,
     generate_response,
-    get_filled_form,
     reformat_filled_form,
     clear_state,
     LAST_MESSAGE,
@@ -50,8 +49,7 @@ with container:
         )
         st.session_state["past"].append(user_input)
         if is_finished:
-            filled_form = get_filled_form(st.session_state["conversation_id"])
-            filled_form = reformat_filled_form(filled_form)
+            filled_form = reformat_filled_form(output)
 
             message_and_form = LAST_MESSAGE + filled_form
             st.session_state["generated"].append(message_and_form)
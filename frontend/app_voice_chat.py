@@ -1,20 +1,19 @@
+import hashlib
 import logging
 import streamlit as st
 from streamlit_chat import message
-import openai
 from audiorecorder import audiorecorder
-from time import gmtime, strftime
 
 from utils import (
-    show_audio_player,
     begin_conversation,
+    generate_audio_response,
     generate_response,
-    get_filled_form,
     reformat_filled_form,
     clear_state,
     LAST_MESSAGE,
     set_titles_and_headers,
 )
+from voice import prewarm_prompts, show_audio_player, synthesize_async
 
 
 # Create logger
@@ -22,13 +21,9 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
-AUDIOS_DIR = "user_audios/"
-
-
 # Setting page title and headers
 set_titles_and_headers()
 
-
 # Initialise session state variables
 if "generated" not in st.session_state:
     st.session_state["generated"] = []
@@ -38,6 +33,9 @@ if "messages" not in st.session_state:
     st.session_state["messages"] = []
 if "audio_filenames" not in st.session_state:
     st.session_state["audio_filenames"] = []
+if "sent_recordings" not in st.session_state:
+    # the recorder keeps its audio between reruns, each one is sent once
+    st.session_state["sent_recordings"] = set()
 
 
 # container for chat history
@@ -49,6 +47,9 @@ if "conversation_id" not in st.session_state:
     conversation_id = begin_conversation(" ")
     st.session_state["conversation_id"] = conversation_id
 
+# the closing message and the questions of the form are synthesized once
+prewarm_prompts(LAST_MESSAGE, *st.session_state.get("form_questions", []))
+
 
 with container:
     with st.form(key="my_form", clear_on_submit=True):
@@ -57,45 +58,39 @@ with container:
 
         audio = audiorecorder("Click to record", "Recording...")
 
+        recording = None
         if len(audio) > 0:
+            audio_bytes = audio.tobytes()
             # To play audio in frontend:
-            st.audio(audio.tobytes())
-
-            audio_filename = (
-                AUDIOS_DIR
-                + st.session_state["conversation_id"]
-                + strftime("%Y-%m-%d_%H:%M:%S", gmtime())
-                + ".mp3"
+            st.audio(audio_bytes)
+            recording_key = hashlib.sha256(audio_bytes).hexdigest()
+            if recording_key not in st.session_state["sent_recordings"]:
+                recording = audio_bytes
+
+    speech = None
+    if submit_button and (recording is not None or user_input):
+        if recording is not None:
+            # transcribed and answered by the service in one request
+            st.session_state["sent_recordings"].add(recording_key)
+            user_input, is_finished, output = generate_audio_response(
+                recording, st.session_state["conversation_id"]
+            )
+            logger.info(f"user_input: {user_input}")
+        else:
+            is_finished, output = generate_response(
+                user_input, st.session_state["conversation_id"]
             )
-
-            # To save audio to a file:
-            wav_file = open(audio_filename, "wb")
-            wav_file.write(audio.tobytes())
-
-            # transcribe
-            audio_file = open(audio_filename, "rb")
-            transcript = openai.Audio.transcribe("whisper-1", audio_file)
-            logger.info("transcript", transcript)
-
-            user_input = transcript["text"]
-            logger.info("user_input", user_input)
-
-    if submit_button and user_input:
-        is_finished, output = generate_response(
-            user_input, st.session_state["conversation_id"]
-        )
         st.session_state["past"].append(user_input)
         if is_finished:
-            filled_form = get_filled_form(st.session_state["conversation_id"])
-            filled_form = reformat_filled_form(filled_form)
+            filled_form = reformat_filled_form(output)
 
-            show_audio_player(LAST_MESSAGE)
+            speech = synthesize_async(LAST_MESSAGE)
             message_and_form = LAST_MESSAGE + filled_form
             st.session_state["generated"].append(message_and_form)
 
         else:
             st.session_state["generated"].append(output)
-            show_audio_player(output)
+            speech = synthesize_async(output)
 
 if st.session_state["generated"]:
     with response_container:
@@ -103,6 +98,11 @@ if st.session_state["generated"]:
             message(st.session_state["past"][i], is_user=True, key=str(i) + "_user")
             message(st.session_state["generated"][i], key=str(i))
 
+# the chat history is rendered while the question is synthesized
+if speech is not None:
+    with container:
+        show_audio_player(speech)
+
 if st.button("Submit new form"):
     clear_state()
     st.experimental_rerun()
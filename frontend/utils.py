@@ -1,12 +1,11 @@
 import json
 import logging
+import threading
 import requests
 import streamlit as st
 import os
-import openai
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
-from io import BytesIO
-from gtts import gTTS, gTTSError
 
 
 # Create logger
@@ -17,47 +16,184 @@ logger.setLevel(logging.INFO)
 HEADERS = {"Content-Type": "application/json"}
 LAST_MESSAGE = "Thank you for your time! Your form is filled successfully!\n\n"
 
+# seconds to connect, and to wait for the model to answer a turn
+CONNECT_TIMEOUT_SECONDS = 3.05
+READ_TIMEOUT_SECONDS = 60
+# kept-alive connections to the API, per session thread
+POOL_MAXSIZE = 4
 
-def setup_endpoint_and_api_key() -> str:
+
+class ServiceError(Exception):
+    """
+    Raised when the service answers a turn with an error status
+    """
+
+
+class ApiClient:
+    """
+    Client of the forms API, shared by every session of the app.
+
+    Each thread gets its own requests.Session (sessions are not thread-safe),
+    so the connection to the API is kept alive between turns instead of
+    opening a new TLS connection for every request.
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.timeout = (CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS)
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update(HEADERS)
+            self._local.session = session
+        return session
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.session.post(
+            f"{self.endpoint}{path}", timeout=self.timeout, **kwargs
+        )
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.session.get(
+            f"{self.endpoint}{path}", timeout=self.timeout, **kwargs
+        )
+
+
+@st.cache_resource
+def get_api_client() -> ApiClient:
+    """
+    Reads frontend/.env once and creates the client, cached for the lifetime
+    of the streamlit server
+    """
     load_dotenv("frontend/.env")
-    endpoint = os.environ["AWS_API_LINK"]
+    return ApiClient(os.environ["AWS_API_LINK"])
+
+
+def check_response(response: requests.Response):
+    """
+    Raises ServiceError with the body of an error response
+    """
+    if not response.ok:
+        logger.error(f"status: {response.status_code}, body: {response.text}")
+        raise ServiceError(f"{response.status_code}: {response.text}")
 
-    openai.api_key = os.environ["OPENAI_API_KEY"]
-    return endpoint
 
+def turn_headers(turn_index: int) -> dict:
+    """
+    Headers of a reply; the turn index lets the service recognize a retry
+    of the same reply and return the stored answer
+    """
+    if turn_index is None:
+        return HEADERS
+    return dict(HEADERS, **{"X-Turn-Index": str(turn_index)})
 
-def send_response(conversation_id: str, user_reply: str) -> dict:
+
+def send_response(
+    conversation_id: str, user_reply: str, turn_index: int = None
+) -> dict:
     """
     Response looks like this:
         {
         'next_question': 'Question',
         'is_finished': bool
         }
+    and the last one also has 'filled_form'
 
     :param conversation_id:
     :param user_reply:
     :return:
     """
-    endpoint = setup_endpoint_and_api_key()
-    url = f"{endpoint}form/{conversation_id}"
-
     data_json = get_user_prompt_data_json(user_reply)
 
-    response = requests.post(url, headers=HEADERS, data=data_json)
+    response = get_api_client().post(
+        f"form/{conversation_id}",
+        headers=turn_headers(turn_index),
+        data=data_json,
+        params={"include_form": "true"},
+    )
     logger.info("response")
     logger.info(response)
+    check_response(response)
     return response.json()
 
 
-def begin_conversation(user_reply: str) -> str:
-    """Returns conversation_id for a new chat"""
-    endpoint = setup_endpoint_and_api_key()
-    url = f"{endpoint}form"
+def send_audio(conversation_id: str, audio: bytes, turn_index: int = None) -> dict:
+    """
+    Same as send_response, with a WAV recording of the reply transcribed by
+    the service. The response also has 'transcript'
+    """
+    headers = dict(turn_headers(turn_index), **{"Content-Type": "audio/wav"})
+
+    response = get_api_client().post(
+        f"form/{conversation_id}/audio",
+        headers=headers,
+        data=audio,
+        params={"include_form": "true"},
+    )
+    logger.info("response")
+    logger.info(response)
+    check_response(response)
+    return response.json()
 
+
+def parse_sse(lines):
+    """
+    Yields (event, data) pairs from the lines of a server-sent events body
+    """
+    event = "message"
+    data = []
+    for line in lines:
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event = "message"
+            data = []
+        elif line.startswith("event:"):
+            event = line[len("event:") :].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:") :].strip())
+    if data:
+        yield event, json.loads("\n".join(data))
+
+
+def send_response_stream(conversation_id: str, user_reply: str, turn_index: int = None):
+    """
+    Same as send_response, but asks for server-sent events.
+    Yields ("token", {"text": str}) pieces of the next question, ("reset", {})
+    when the pieces so far are to be dropped, and finally
+    ("result", {"next_question": ..., "is_finished": bool})
+    """
     data_json = get_user_prompt_data_json(user_reply)
+    headers = dict(turn_headers(turn_index), Accept="text/event-stream")
 
-    response = requests.post(url, headers=HEADERS, data=data_json)
+    with get_api_client().post(
+        f"form/{conversation_id}",
+        headers=headers,
+        data=data_json,
+        params={"stream": "true", "include_form": "true"},
+        stream=True,
+    ) as response:
+        logger.info("response")
+        logger.info(response)
+        check_response(response)
+        yield from parse_sse(response.iter_lines(decode_unicode=True))
+
+
+def begin_conversation(user_reply: str) -> str:
+    """Returns conversation_id for a new chat,
+    and keeps the standard questions of the form in the session"""
+    data_json = get_user_prompt_data_json(user_reply)
+
+    response = get_api_client().post("form", data=data_json)
     conversation_id = response.json()["conversation_id"]
+    st.session_state["form_questions"] = response.json().get("questions", [])
     logger.info(f"conversation_id: {conversation_id}")
 
     return conversation_id
@@ -89,11 +225,58 @@ def get_user_prompt_data_json(user_reply: str) -> dict:
     return data_json
 
 
-def generate_response(prompt: str, conversation_id: str) -> (str, bool):
-    """Generates new question given an user prompt"""
+def generate_response(
+    prompt: str, conversation_id: str, stream: bool = False
+) -> (bool, object):
+    """Generates new question given an user prompt.
+    With stream=True the question is rendered while it is being generated,
+    which only helps behind a front door that streams the lambda response
+    (the HTTP API buffers it).
+    When the form is finished, returns the filled form instead of a question"""
+    turn_index = next_turn_index()
     st.session_state["messages"].append({"role": "user", "content": prompt})
 
-    raw_response = send_response(conversation_id, prompt)
+    try:
+        if stream:
+            raw_response = render_response_stream(conversation_id, prompt, turn_index)
+        else:
+            raw_response = send_response(conversation_id, prompt, turn_index)
+    except ServiceError as e:
+        # the reply is sent again with the same turn index
+        st.session_state["messages"].pop()
+        return False, service_error_message(e)
+    return read_turn(raw_response, conversation_id)
+
+
+def generate_audio_response(audio: bytes, conversation_id: str) -> (str, bool, object):
+    """Same as generate_response for a recorded reply,
+    also returns what the service transcribed"""
+    try:
+        raw_response = send_audio(conversation_id, audio, next_turn_index())
+    except ServiceError as e:
+        return "", False, service_error_message(e)
+    transcript = raw_response["transcript"]
+    st.session_state["messages"].append({"role": "user", "content": transcript})
+
+    is_finished, output = read_turn(raw_response, conversation_id)
+    return transcript, is_finished, output
+
+
+def service_error_message(error: ServiceError) -> str:
+    """Text shown in the chat instead of the next question"""
+    st.error(f"The service could not answer: {error}")
+    return "Sorry, something went wrong. Please send your answer again."
+
+
+def next_turn_index() -> int:
+    return sum(
+        1 for message in st.session_state["messages"] if message["role"] == "user"
+    )
+
+
+def read_turn(raw_response: dict, conversation_id: str) -> (bool, object):
+    """Stores the answer of the service, returns (is_finished, question or
+    filled form)"""
     logger.info("raw_response")
     logger.info(raw_response)
     question = raw_response["next_question"]
@@ -101,39 +284,53 @@ def generate_response(prompt: str, conversation_id: str) -> (str, bool):
 
     st.session_state["messages"].append({"role": "assistant", "content": question})
 
+    if is_finished:
+        # returned inline by the update endpoint, one request less
+        filled_form = raw_response.get("filled_form")
+        if filled_form is None:
+            filled_form = get_filled_form(conversation_id)
+        return is_finished, filled_form
     return is_finished, question
 
 
-def get_filled_form(conversation_id: str) -> str:
+def render_response_stream(
+    conversation_id: str, prompt: str, turn_index: int = None
+) -> dict:
+    """Shows the next question piece by piece and returns the final result"""
+    placeholder = st.empty()
+    text = ""
+    raw_response = None
+    for event, data in send_response_stream(conversation_id, prompt, turn_index):
+        if event == "token":
+            text += data["text"]
+            placeholder.markdown(text)
+        elif event == "reset":
+            # the answer was discarded, the next one is streamed after
+            text = ""
+            placeholder.empty()
+        elif event == "result":
+            raw_response = data
+    # the full question is shown in the chat history
+    placeholder.empty()
+    if raw_response is None:
+        raise ServiceError("the response ended before the result")
+    return raw_response
+
+
+def get_filled_form(conversation_id: str) -> dict:
     """Retrieves the filled form crom the DynamoDB"""
-    endpoint = setup_endpoint_and_api_key()
-    url = f"{endpoint}form/{conversation_id}"
-
-    response = requests.get(url, headers=HEADERS)
+    response = get_api_client().get(f"form/{conversation_id}")
     logger.info("response.json()", response.json())
     logger.info("filled_form_response")
     logger.info(response)
     return response.json()
 
 
-def reformat_filled_form(form: str) -> str:
-    form = json.loads(form)
-    result = "\n".join([key + " = " + value for key, value in form.items()])
+def reformat_filled_form(form: dict) -> str:
+    result = "\n".join([f"{key} = {value}" for key, value in form.items()])
     return result
 
 
-def show_audio_player(ai_content: str) -> None:
-    """Shows audio player in chatbox
-    if activated, it says ai_content"""
-    sound_file = BytesIO()
-    try:
-        tts = gTTS(text=ai_content, lang="en", tld="ca")
-        tts.write_to_fp(sound_file)
-        st.audio(sound_file)
-    except gTTSError as err:
-        st.error(err)
-
-
 # Setting page title and headers
 def set_titles_and_headers():
     st.set_page_config(page_title="Insurance bot", page_icon="🕵️‍♀️")
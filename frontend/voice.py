@@ -0,0 +1,141 @@
+"""
+Speech of the voice chat, without temporary files.
+
+Recordings are transcribed by the service (POST /form/{conversation_id}/audio),
+and questions are synthesized in a worker pool while the page renders. Synthesized speech is cached by a hash
+of its text, in memory (LRU) and on disk, so the closing message and the
+standard questions of the form, synthesized once at startup, are replayed
+at once.
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+
+import streamlit as st
+from gtts import gTTS, gTTSError
+
+# Create logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+TTS_LANG = "en"
+TTS_TLD = "ca"
+
+TTS_CACHE_DIR = os.environ.get(
+    "TTS_CACHE_DIR", os.path.join(os.path.dirname(__file__), ".tts_cache")
+)
+# synthesized prompts kept in memory, a few KB each
+TTS_CACHE_SIZE = 256
+VOICE_WORKERS = 4
+
+
+class SpeechCache:
+    """
+    MP3 bytes by hash of the text, in memory and on disk
+    """
+
+    def __init__(self, directory: str = TTS_CACHE_DIR, size: int = TTS_CACHE_SIZE):
+        self.directory = directory
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(f"{TTS_LANG}|{TTS_TLD}|{text}".encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def get(self, key: str) -> bytes:
+        with self._lock:
+            audio = self._items.get(key)
+            if audio is not None:
+                self._items.move_to_end(key)
+                return audio
+        try:
+            with open(self.path(key), "rb") as audio_file:
+                audio = audio_file.read()
+        except FileNotFoundError:
+            return None
+        self._put_in_memory(key, audio)
+        return audio
+
+    def put(self, key: str, audio: bytes):
+        self._put_in_memory(key, audio)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # written aside and renamed, so a reader never sees half a file
+            partial_path = f"{self.path(key)}.{threading.get_ident()}.part"
+            with open(partial_path, "wb") as audio_file:
+                audio_file.write(audio)
+            os.replace(partial_path, self.path(key))
+        except OSError as e:
+            logger.warning(f"Could not store synthesized speech on disk: {e}")
+
+    def _put_in_memory(self, key: str, audio: bytes):
+        with self._lock:
+            self._items[key] = audio
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+
+@st.cache_resource
+def get_speech_cache() -> SpeechCache:
+    return SpeechCache()
+
+
+@st.cache_resource
+def get_voice_executor() -> ThreadPoolExecutor:
+    """
+    Worker pool shared by every session, for speech
+    """
+    return ThreadPoolExecutor(VOICE_WORKERS, thread_name_prefix="voice")
+
+
+def synthesize(text: str, cache: SpeechCache) -> bytes:
+    """
+    Function to get the speech of a text as MP3 bytes, from the cache if
+    it was synthesized before. Runs in the worker pool.
+    """
+    key = cache.key(text)
+    audio = cache.get(key)
+    if audio is not None:
+        return audio
+
+    sound_file = BytesIO()
+    gTTS(text=text, lang=TTS_LANG, tld=TTS_TLD).write_to_fp(sound_file)
+    audio = sound_file.getvalue()
+    cache.put(key, audio)
+    return audio
+
+
+def synthesize_async(text: str) -> Future:
+    # streamlit caches are read here, worker threads have no script context
+    return get_voice_executor().submit(synthesize, text, get_speech_cache())
+
+
+@st.cache_resource
+def prewarm_prompts(*texts: str) -> list:
+    """
+    Synthesizes the standard prompts, e.g. the questions returned by
+    POST /form, once per streamlit server, in the background, so they are
+    cached before they are first asked
+    """
+    prompts = list(texts)
+    logger.info(f"Synthesizing {len(prompts)} standard prompts")
+    return [synthesize_async(text) for text in prompts]
+
+
+def show_audio_player(speech: Future) -> None:
+    """Shows audio player in chatbox
+    once the speech synthesized in the worker pool is ready"""
+    try:
+        st.audio(speech.result(), format="audio/mp3")
+    except gTTSError as err:
+        st.error(err)
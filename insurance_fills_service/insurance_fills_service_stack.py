@@ -12,7 +12,7 @@ from aws_cdk import (
 import aws_cdk.aws_apigatewayv2_alpha as _apigw
 import aws_cdk.aws_apigatewayv2_integrations_alpha as _integrations
 
-# from aws_cdk.aws_apigatewayv2_authorizers_alpha import HttpIamAuthorizer
+from aws_cdk.aws_apigatewayv2_authorizers_alpha import HttpIamAuthorizer
 
 from os.path import dirname
 
@@ -31,6 +31,18 @@ class InsuranceFillsServiceStack(Stack):
             self, "insurance_secret", "insurance_fills_secrets"
         )
 
+        # HMAC key of the conversation_ids handed out by POST /form
+        conversation_id_secret = sm.Secret(
+            self,
+            "ConversationIdSecret",
+            generate_secret_string=sm.SecretStringGenerator(
+                secret_string_template="{}",
+                generate_string_key="key",
+                exclude_punctuation=True,
+                password_length=64,
+            ),
+        )
+
         UsersStack(self, f"users-{stage}", stage)
 
         # Create the HTTP API with CORS
@@ -46,13 +58,19 @@ class InsuranceFillsServiceStack(Stack):
             # default_authorizer=authorizer,
         )
 
-        # table to store conversation_id and conversation
+        # routes returning many filled forms are for the underwriting jobs,
+        # signed with the credentials of the API-caller user (SigV4)
+        reporting_authorizer = HttpIamAuthorizer()
+
+        # table to store conversation_id and conversation,
+        # abandoned conversations expire
         conversations_table = dynamodb.Table(
             self,
             "ConversationsTable",
             partition_key=dynamodb.Attribute(
                 name="conversation_id", type=dynamodb.AttributeType.STRING
             ),
+            time_to_live_attribute="expires_at",
         )
 
         # table to store final filled forms
@@ -64,6 +82,67 @@ class InsuranceFillsServiceStack(Stack):
             ),
         )
 
+        # forms by creation time and by type of insurance, for reporting.
+        # CloudFormation adds one index per stack update to an existing
+        # table, so ByInsuranceType is only added with
+        # `cdk deploy -c insurance_type_index=true`, after ByCreateDay is live.
+        insurance_type_index = (
+            str(self.node.try_get_context("insurance_type_index")).lower() == "true"
+        )
+        filled_forms_table.add_global_secondary_index(
+            index_name="ByCreateDay",
+            partition_key=dynamodb.Attribute(
+                name="create_day", type=dynamodb.AttributeType.STRING
+            ),
+            sort_key=dynamodb.Attribute(
+                name="create_time", type=dynamodb.AttributeType.STRING
+            ),
+        )
+        if insurance_type_index:
+            filled_forms_table.add_global_secondary_index(
+                index_name="ByInsuranceType",
+                partition_key=dynamodb.Attribute(
+                    name="type_of_insurance", type=dynamodb.AttributeType.STRING
+                ),
+                sort_key=dynamodb.Attribute(
+                    name="create_time", type=dynamodb.AttributeType.STRING
+                ),
+            )
+
+        # results of POST /form/{conversation_id} kept for retried requests
+        idempotency_table = dynamodb.Table(
+            self,
+            "IdempotencyTable",
+            partition_key=dynamodb.Attribute(
+                name="idempotency_key", type=dynamodb.AttributeType.STRING
+            ),
+            time_to_live_attribute="expires_at",
+        )
+
+        # OpenAI requests and tokens per minute counted by every container
+        rate_limit_table = dynamodb.Table(
+            self,
+            "RateLimitTable",
+            partition_key=dynamodb.Attribute(
+                name="limiter_key", type=dynamodb.AttributeType.STRING
+            ),
+            time_to_live_attribute="expires_at",
+        )
+
+        # code shared by all lambdas: cached AWS clients and secrets
+        shared_layer = lambda_.LayerVersion(
+            self,
+            "SharedLayer",
+            code=lambda_.Code.from_asset(os.path.join(DIRNAME, "lambdas/shared")),
+            compatible_runtimes=[lambda_.Runtime.PYTHON_3_9],
+        )
+
+        # per-stage timings written as CloudWatch embedded metrics
+        metrics_environment = {
+            "METRICS_ENABLED": "true",
+            "METRICS_NAMESPACE": "InsuranceFillsService",
+        }
+
         # POST create forms lambda
         lambda_create_form = lambda_.Function(
             self,
@@ -71,10 +150,21 @@ class InsuranceFillsServiceStack(Stack):
             runtime=lambda_.Runtime.PYTHON_3_9,
             code=lambda_.Code.from_asset(os.path.join(DIRNAME, "lambdas/create_get")),
             handler="create_get_lambda.lambda_create_form",
+            layers=[shared_layer],
             timeout=Duration.seconds(30),
-            environment={"CONVERSATION_TABLE_NAME": conversations_table.table_name},
+            environment={
+                # the conversation is created by its first turn; stored here
+                # when SYSTEM_SETUP_PROMPT has no version in SYSTEM_PROMPTS
+                "CONVERSATION_ID_SECRET_NAME": conversation_id_secret.secret_name,
+                "CONVERSATION_TABLE_NAME": conversations_table.table_name,
+                "CONVERSATION_TTL_SECONDS": "604800",
+                **metrics_environment,
+            },
         )
 
+        conversation_id_secret.grant_read(lambda_create_form)
+        conversations_table.grant_write_data(lambda_create_form)
+
         # Add a route to POST /form
         http_api.add_routes(
             path="/form",
@@ -83,23 +173,46 @@ class InsuranceFillsServiceStack(Stack):
                 "LambdaProxyIntegration", handler=lambda_create_form
             ),
         )
-        conversations_table.grant_write_data(lambda_create_form)
+
+        # answering a turn, as text or as audio
+        update_environment = {
+            "CONVERSATION_TABLE_NAME": conversations_table.table_name,
+            "FILLED_FORMS_TABLE_NAME": filled_forms_table.table_name,
+            "CONVERSATION_ID_SECRET_NAME": conversation_id_secret.secret_name,
+            "CONVERSATION_TTL_SECONDS": "604800",
+            # small model for follow-up questions, strong one for the form
+            "FOLLOW_UP_MODEL": "gpt-3.5-turbo-0613",
+            "EXTRACTION_MODEL": "gpt-4-0613",
+            # add "azure" with AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_DEPLOYMENTS
+            # to hedge slow OpenAI requests
+            "OPENAI_PROVIDERS": "openai",
+            "HEDGE_PERCENTILE": "0.95",
+            "PROMPT_TOKEN_BUDGET": "3000",
+            "KEEP_LAST_MESSAGES": "12",
+            "IDEMPOTENCY_TABLE_NAME": idempotency_table.table_name,
+            "IDEMPOTENCY_TTL_SECONDS": "86400",
+            "RATE_LIMIT_TABLE_NAME": rate_limit_table.table_name,
+            # limits of the OpenAI account for each model, requests:tokens
+            "OPENAI_RATE_LIMITS": (
+                "gpt-4-0613=500:10000,gpt-3.5-turbo-0613=3500:90000"
+            ),
+            **metrics_environment,
+        }
 
         # POST create forms lambda
         lambda_update = lambda_.Function(
             self,
             "InsuranceFunctionUpdate",
             runtime=lambda_.Runtime.FROM_IMAGE,
-            code=lambda_.Code.from_asset_image("lambdas/update"),
+            # built from lambdas/ so the image can include the shared code
+            code=lambda_.Code.from_asset_image("lambdas", file="update/Dockerfile"),
             handler=lambda_.Handler.FROM_IMAGE,
             timeout=Duration.seconds(30),
-            environment={
-                "CONVERSATION_TABLE_NAME": conversations_table.table_name,
-                "FILLED_FORMS_TABLE_NAME": filled_forms_table.table_name,
-            },
+            environment=update_environment,
         )
 
         secret.grant_read(lambda_update)
+        conversation_id_secret.grant_read(lambda_update)
 
         # Add a route to POST /form/{conversation_id}
         http_api.add_routes(
@@ -112,6 +225,48 @@ class InsuranceFillsServiceStack(Stack):
 
         conversations_table.grant_read_write_data(lambda_update)
         filled_forms_table.grant_read_write_data(lambda_update)
+        idempotency_table.grant_read_write_data(lambda_update)
+        rate_limit_table.grant_read_write_data(lambda_update)
+
+        # POST audio lambda: transcribes the recording and answers the turn
+        # in the same invocation. `cdk deploy -c transcribe_engine=local`
+        # runs faster-whisper in the container instead of the OpenAI API.
+        transcribe_engine = self.node.try_get_context("transcribe_engine") or "openai"
+        lambda_transcribe = lambda_.Function(
+            self,
+            "InsuranceFunctionTranscribe",
+            runtime=lambda_.Runtime.FROM_IMAGE,
+            code=lambda_.Code.from_asset_image(
+                "lambdas",
+                file="transcribe/Dockerfile",
+                build_args={"TRANSCRIBE_ENGINE": transcribe_engine},
+            ),
+            handler=lambda_.Handler.FROM_IMAGE,
+            timeout=Duration.seconds(30),
+            # CPU grows with memory, which the local model needs
+            memory_size=3008 if transcribe_engine == "local" else 512,
+            environment={
+                **update_environment,
+                "TRANSCRIBE_ENGINE": transcribe_engine,
+            },
+        )
+
+        secret.grant_read(lambda_transcribe)
+        conversation_id_secret.grant_read(lambda_transcribe)
+
+        # Add a route to POST /form/{conversation_id}/audio
+        http_api.add_routes(
+            path="/form/{conversation_id}/audio",
+            methods=[_apigw.HttpMethod.POST],
+            integration=_integrations.HttpLambdaIntegration(
+                "LambdaProxyIntegration", handler=lambda_transcribe
+            ),
+        )
+
+        conversations_table.grant_read_write_data(lambda_transcribe)
+        filled_forms_table.grant_read_write_data(lambda_transcribe)
+        idempotency_table.grant_read_write_data(lambda_transcribe)
+        rate_limit_table.grant_read_write_data(lambda_transcribe)
 
         # GET form lambda
         lambda_get_form = lambda_.Function(
@@ -121,9 +276,11 @@ class InsuranceFillsServiceStack(Stack):
             runtime=lambda_.Runtime.PYTHON_3_9,
             code=lambda_.Code.from_asset(os.path.join(DIRNAME, "lambdas/create_get")),
             handler="create_get_lambda.lambda_get_form",
+            layers=[shared_layer],
             timeout=Duration.seconds(30),
             environment={
                 "FILLED_FORMS_TABLE_NAME": filled_forms_table.table_name,
+                **metrics_environment,
             },
         )
 
@@ -138,6 +295,89 @@ class InsuranceFillsServiceStack(Stack):
 
         filled_forms_table.grant_read_data(lambda_get_form)
 
+        # POST batch get forms lambda
+        lambda_batch_get_forms = lambda_.Function(
+            self,
+            "InsuranceFunctionBatchGet",
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            code=lambda_.Code.from_asset(os.path.join(DIRNAME, "lambdas/create_get")),
+            handler="create_get_lambda.lambda_batch_get_forms",
+            layers=[shared_layer],
+            timeout=Duration.seconds(30),
+            environment={
+                "FILLED_FORMS_TABLE_NAME": filled_forms_table.table_name,
+                "MAX_BATCH_CONVERSATION_IDS": "100",
+                **metrics_environment,
+            },
+        )
+
+        # Add a route to POST /forms/batch
+        http_api.add_routes(
+            path="/forms/batch",
+            methods=[_apigw.HttpMethod.POST],
+            integration=_integrations.HttpLambdaIntegration(
+                "LambdaProxyIntegration", handler=lambda_batch_get_forms
+            ),
+            authorizer=reporting_authorizer,
+        )
+
+        filled_forms_table.grant_read_data(lambda_batch_get_forms)
+
+        # GET export forms lambda
+        lambda_export_forms = lambda_.Function(
+            self,
+            "InsuranceFunctionExport",
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            code=lambda_.Code.from_asset(os.path.join(DIRNAME, "lambdas/create_get")),
+            handler="create_get_lambda.lambda_export_forms",
+            layers=[shared_layer],
+            timeout=Duration.seconds(30),
+            environment={
+                "FILLED_FORMS_TABLE_NAME": filled_forms_table.table_name,
+                **metrics_environment,
+            },
+        )
+
+        # Add a route to GET /forms/export
+        http_api.add_routes(
+            path="/forms/export",
+            methods=[_apigw.HttpMethod.GET],
+            integration=_integrations.HttpLambdaIntegration(
+                "LambdaProxyIntegration", handler=lambda_export_forms
+            ),
+            authorizer=reporting_authorizer,
+        )
+
+        filled_forms_table.grant_read_data(lambda_export_forms)
+
+        # GET query forms lambda
+        lambda_query_forms = lambda_.Function(
+            self,
+            "InsuranceFunctionQuery",
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            code=lambda_.Code.from_asset(os.path.join(DIRNAME, "lambdas/create_get")),
+            handler="create_get_lambda.lambda_query_forms",
+            layers=[shared_layer],
+            timeout=Duration.seconds(30),
+            environment={
+                "FILLED_FORMS_TABLE_NAME": filled_forms_table.table_name,
+                "INSURANCE_TYPE_INDEX_ENABLED": str(insurance_type_index).lower(),
+                **metrics_environment,
+            },
+        )
+
+        # Add a route to GET /forms
+        http_api.add_routes(
+            path="/forms",
+            methods=[_apigw.HttpMethod.GET],
+            integration=_integrations.HttpLambdaIntegration(
+                "LambdaProxyIntegration", handler=lambda_query_forms
+            ),
+            authorizer=reporting_authorizer,
+        )
+
+        filled_forms_table.grant_read_data(lambda_query_forms)
+
         # Outputs
         CfnOutput(
             self,
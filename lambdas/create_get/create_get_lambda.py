@@ -1,44 +1,72 @@
+import hashlib
 import json
 import os
-import random
-import string
 import logging
 from http import HTTPStatus
-import boto3
-from decimal import Decimal
 
+from aws_resources import (
+    CACHE_STATS,
+    WARM_UP_ON_INIT,
+    get_dynamodb_table,
+    log_cache_stats,
+    warm_up,
+)
 from constants import SYSTEM_SETUP_PROMPT
+from conversation_codec import SYSTEM_PROMPT_VERSIONS, encode_messages
+from conversation_ids import (
+    conversation_id_secret,
+    expiry_time,
+    get_random_id,
+    new_conversation_id,
+    signed_ids_enabled,
+)
+from filled_forms import (
+    DecimalEncoder,
+    QUERY_DEFAULT_LIMIT,
+    InvalidCursor,
+    InvalidQuery,
+    UnprocessedKeysError,
+    batch_get_forms,
+    export_page,
+    query_forms,
+    to_ndjson,
+)
+from form_schema import FIELD_QUESTIONS
+from lru import LRUCache
+from tracing import add_count, end_trace, set_property, span, start_trace
+
+# Recently read filled forms, by (conversation_id, fields)
+FILLED_FORMS_CACHE_SIZE = 256
+
+# Most conversation_ids accepted by POST /forms/batch
+MAX_BATCH_CONVERSATION_IDS = int(os.environ.get("MAX_BATCH_CONVERSATION_IDS", "100"))
 
 # Create logger
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Version of the system prompt new conversations start with, None when
+# SYSTEM_SETUP_PROMPT has no version in conversation_codec.SYSTEM_PROMPTS
+SYSTEM_SETUP_PROMPT_VERSION = SYSTEM_PROMPT_VERSIONS.get(SYSTEM_SETUP_PROMPT)
+if SYSTEM_SETUP_PROMPT_VERSION is None:
+    logger.warning(
+        "SYSTEM_SETUP_PROMPT is not in SYSTEM_PROMPTS, add it as a new version; "
+        "conversations are created eagerly with the full prompt until then"
+    )
 
-class DecimalEncoder(json.JSONEncoder):
-    """
-    Encoder for int values that are stored in DynamoDB as Decimal
-    """
-
-    def default(self, o):
-        if isinstance(o, Decimal):
-            return str(o)
-        return super(DecimalEncoder, self).default(o)
+if WARM_UP_ON_INIT:
+    # the table of the handler is the only one in its environment
+    warm_up(
+        [
+            os.environ[name]
+            for name in ("CONVERSATION_TABLE_NAME", "FILLED_FORMS_TABLE_NAME")
+            if name in os.environ
+        ],
+        secret_caches=[conversation_id_secret] if conversation_id_secret else [],
+    )
 
 
-def get_random_id() -> str:
-    """
-    Function to generate a random string of 10 lowercase alphabets
-    """
-    return "".join(random.choices(string.ascii_lowercase, k=10))
-
-
-def get_dynamodb_table(table_name: str) -> object:
-    """
-    Function to get the DynamoDB table object
-    """
-    dynamodb = boto3.resource("dynamodb")
-    table = dynamodb.Table(table_name)
-    return table
+_filled_forms = LRUCache(FILLED_FORMS_CACHE_SIZE)
 
 
 def save_to_dynamodb_table(table_name: str, data_to_add: dict):
@@ -46,29 +74,56 @@ def save_to_dynamodb_table(table_name: str, data_to_add: dict):
     Function to save a dictionary to DynamoDB table
     """
     table = get_dynamodb_table(table_name)
-    table.put_item(Item=data_to_add)
+    with span("dynamodb_put_item"):
+        table.put_item(Item=data_to_add)
     logger.info(f"Successful put to the table: {table_name}")
     logger.debug(f"Added data: {data_to_add}")
 
 
 def lambda_create_form(event, context):
     """
-    Lambda function to create form
+    Lambda function to create form.
+
+    With CONVERSATION_ID_SECRET_NAME the conversation_id is signed and
+    nothing is stored: the conversation is created by its first turn, so
+    conversations that are never answered cost no write.
     """
     logger.info("lambda_create_form Handler started")
+    start_trace("lambda_create_form")
     try:
         conversation = [{"role": "system", "content": SYSTEM_SETUP_PROMPT}]
         logger.debug(f"conversation: {conversation}")
 
-        random_id = get_random_id()
-        data_to_add_to_db = {"conversation_id": random_id, "conversation": conversation}
-        table_name = os.environ["CONVERSATION_TABLE_NAME"]
+        if signed_ids_enabled() and SYSTEM_SETUP_PROMPT_VERSION is not None:
+            with span("sign_conversation_id"):
+                conversation_id = new_conversation_id(SYSTEM_SETUP_PROMPT_VERSION)
+            add_count("conversation_deferred")
+        else:
+            conversation_id = get_random_id()
+            # a versioned system prompt is stored as a reference to its version
+            data_to_add_to_db = {
+                "conversation_id": conversation_id,
+                "conversation": encode_messages(conversation),
+                "expires_at": expiry_time(),
+            }
+            table_name = os.environ["CONVERSATION_TABLE_NAME"]
+            save_to_dynamodb_table(table_name, data_to_add_to_db)
 
-        save_to_dynamodb_table(table_name, data_to_add_to_db)
+        set_property("conversation_id", conversation_id)
 
+        with span("serialize_response"):
+            # the standard questions, for clients that prepare them, e.g. speech
+            body = json.dumps(
+                {
+                    "conversation_id": conversation_id,
+                    "conversation": conversation,
+                    "questions": list(FIELD_QUESTIONS.values()),
+                },
+                indent=2,
+            )
         response = {
             "statusCode": HTTPStatus.OK.value,
-            "body": json.dumps(data_to_add_to_db, indent=2),
+            "body": body,
             "headers": {"content-type": "application/json"},
         }
     except Exception as e:
@@ -77,34 +132,287 @@ def lambda_create_form(event, context):
             "body": f"Exception={e}",
             "headers": {"content-type": "text/plain"},
         }
+    set_property("status_code", response["statusCode"])
+    end_trace()
+    log_cache_stats()
     return response
 
 
+def requested_fields(event: dict) -> tuple:
+    """
+    Function to read the `fields=a,b` query parameter, None for all fields
+    """
+    query = event.get("queryStringParameters") or {}
+    fields = [field.strip() for field in query.get("fields", "").split(",")]
+    fields = tuple(sorted(field for field in fields if field))
+    return fields or None
+
+
+def project(form: dict, fields: tuple) -> dict:
+    return {field: form[field] for field in fields if field in form}
+
+
+def read_filled_form(table_name: str, conversation_id: str, fields: tuple) -> dict:
+    """
+    Function to get a filled form, or only some of its fields, through the
+    LRU cache. Filled forms never change, so cached ones never go stale.
+    """
+    form = _filled_forms.get((conversation_id, None))
+    if form is not None:
+        CACHE_STATS["form_hit"] += 1
+        return form if fields is None else project(form, fields)
+    if fields is not None:
+        form = _filled_forms.get((conversation_id, fields))
+        if form is not None:
+            CACHE_STATS["form_hit"] += 1
+            return form
+
+    CACHE_STATS["form_miss"] += 1
+    params = {"Key": {"conversation_id": conversation_id}}
+    if fields is not None:
+        names = {f"#f{index}": field for index, field in enumerate(fields)}
+        params["ProjectionExpression"] = ", ".join(names)
+        params["ExpressionAttributeNames"] = names
+    with span("dynamodb_get_item"):
+        form = get_dynamodb_table(table_name).get_item(**params).get("Item")
+
+    # a form that is not filled yet may be written later
+    if form is not None:
+        _filled_forms.put((conversation_id, fields), form)
+    return form
+
+
+def etag_of(body: str) -> str:
+    return '"' + hashlib.sha256(body.encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Function to check an If-None-Match header against the ETag of a body
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
 def lambda_get_form(event, context) -> dict:
     """
-    Lambda function to get form
+    Lambda function to get form.
+
+    The body is the filled form as JSON, or {} if it is not filled yet.
+    `?fields=first_name,age` returns only these fields. A filled form never
+    changes, so it is returned with an ETag and an immutable Cache-Control,
+    and `If-None-Match` with that ETag gets a 304 without a body.
     """
     logger.info("lambda_get_form Handler started")
+    start_trace("lambda_get_form")
     try:
         forms_table_name = os.environ["FILLED_FORMS_TABLE_NAME"]
-        forms_table = get_dynamodb_table(forms_table_name)
-
         conversation_id = event.get("pathParameters")["conversation_id"]
-        response = forms_table.get_item(Key={"conversation_id": conversation_id})
-        filled_form = response.get("Item", {})
-        json_filled_form = json.dumps(filled_form, cls=DecimalEncoder)
-        logger.debug("json_filled_form")
-        logger.debug(json_filled_form)
+        set_property("conversation_id", conversation_id)
+        fields = requested_fields(event)
+
+        filled_form = read_filled_form(forms_table_name, conversation_id, fields)
+        with span("serialize_response"):
+            body = json.dumps(filled_form or {}, cls=DecimalEncoder, indent=2)
+        logger.debug(f"filled_form: {body}")
+
+        if filled_form is None:
+            response = {
+                "statusCode": HTTPStatus.OK.value,
+                "body": body,
+                "headers": {
+                    "content-type": "application/json",
+                    "cache-control": "no-store",
+                },
+            }
+        else:
+            etag = etag_of(body)
+            headers = {
+                "content-type": "application/json",
+                "etag": etag,
+                # forms hold personal data, only the client may cache them
+                "cache-control": "private, max-age=31536000, immutable",
+            }
+            request_headers = {
+                name.lower(): value
+                for name, value in (event.get("headers") or {}).items()
+            }
+            if etag_matches(request_headers.get("if-none-match"), etag):
+                response = {
+                    "statusCode": HTTPStatus.NOT_MODIFIED.value,
+                    "body": "",
+                    "headers": headers,
+                }
+            else:
+                response = {
+                    "statusCode": HTTPStatus.OK.value,
+                    "body": body,
+                    "headers": headers,
+                }
+    except Exception as e:
+        response = {
+            "statusCode": HTTPStatus.INTERNAL_SERVER_ERROR.value,
+            "body": f"Exception={e}",
+            "headers": {"content-type": "text/plain"},
+        }
+    set_property("status_code", response["statusCode"])
+    end_trace()
+    log_cache_stats()
+    return response
+
 
+def bad_request(message: str) -> dict:
+    return {
+        "statusCode": HTTPStatus.BAD_REQUEST.value,
+        "body": message,
+        "headers": {"content-type": "text/plain"},
+    }
+
+
+def is_list_of_strings(value) -> bool:
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+def lambda_batch_get_forms(event, context) -> dict:
+    """
+    Lambda function to get many forms.
+
+    The body is {"conversation_ids": [...], "fields": [...]}, fields being
+    optional. The response is {"forms": [...], "missing": [...]} with the
+    ids of forms that are not filled.
+    """
+    logger.info("lambda_batch_get_forms Handler started")
+    start_trace("lambda_batch_get_forms")
+    try:
+        forms_table_name = os.environ["FILLED_FORMS_TABLE_NAME"]
+        request = json.loads(event.get("body") or "{}")
+        conversation_ids = request.get("conversation_ids")
+        fields = request.get("fields")
+        if not is_list_of_strings(conversation_ids) or not conversation_ids:
+            response = bad_request(
+                "conversation_ids must be a non empty list of strings"
+            )
+        elif fields is not None and not is_list_of_strings(fields):
+            response = bad_request("fields must be a list of strings")
+        elif len(conversation_ids) > MAX_BATCH_CONVERSATION_IDS:
+            response = bad_request(
+                f"At most {MAX_BATCH_CONVERSATION_IDS} conversation_ids are allowed"
+            )
+        else:
+            set_property("batch_size", len(conversation_ids))
+            forms = batch_get_forms(forms_table_name, conversation_ids, fields)
+            result = {
+                "forms": [forms[id_] for id_ in conversation_ids if id_ in forms],
+                "missing": [id_ for id_ in conversation_ids if id_ not in forms],
+            }
+            with span("serialize_response"):
+                body = json.dumps(result, cls=DecimalEncoder)
+            response = {
+                "statusCode": HTTPStatus.OK.value,
+                "body": body,
+                "headers": {"content-type": "application/json"},
+            }
+    except UnprocessedKeysError as e:
+        response = {
+            "statusCode": HTTPStatus.SERVICE_UNAVAILABLE.value,
+            "body": f"Table is throttled, retry later: {e}",
+            "headers": {"content-type": "text/plain", "retry-after": "1"},
+        }
+    except Exception as e:
+        response = {
+            "statusCode": HTTPStatus.INTERNAL_SERVER_ERROR.value,
+            "body": f"Exception={e}",
+            "headers": {"content-type": "text/plain"},
+        }
+    set_property("status_code", response["statusCode"])
+    end_trace()
+    log_cache_stats()
+    return response
+
+
+def lambda_export_forms(event, context) -> dict:
+    """
+    Lambda function to export all forms.
+
+    Returns one page of forms as NDJSON, read by a parallel segmented scan.
+    The `x-next-cursor` header is passed back as `?cursor=` for the next
+    page, it is missing after the last page.
+    """
+    logger.info("lambda_export_forms Handler started")
+    start_trace("lambda_export_forms")
+    try:
+        forms_table_name = os.environ["FILLED_FORMS_TABLE_NAME"]
+        query = event.get("queryStringParameters") or {}
+        forms, next_cursor = export_page(forms_table_name, query.get("cursor"))
+        set_property("page_size", len(forms))
+        with span("serialize_response"):
+            body = to_ndjson(forms)
+        headers = {"content-type": "application/x-ndjson"}
+        if next_cursor is not None:
+            headers["x-next-cursor"] = next_cursor
+        response = {
+            "statusCode": HTTPStatus.OK.value,
+            "body": body,
+            "headers": headers,
+        }
+    except InvalidCursor:
+        response = bad_request("Invalid cursor")
+    except Exception as e:
+        response = {
+            "statusCode": HTTPStatus.INTERNAL_SERVER_ERROR.value,
+            "body": f"Exception={e}",
+            "headers": {"content-type": "text/plain"},
+        }
+    set_property("status_code", response["statusCode"])
+    end_trace()
+    log_cache_stats()
+    return response
+
+
+def lambda_query_forms(event, context) -> dict:
+    """
+    Lambda function to find forms by creation time and type of insurance.
+
+    Query parameters: `since` and `until` (dates or times, UTC), `type`,
+    `limit` and `cursor`. At least one of `since` or `type` is required, so
+    every request is served by an index instead of a scan. The response is
+    {"forms": [...], "next_cursor": ...}; the next page is requested with the
+    same parameters and `cursor`.
+    """
+    logger.info("lambda_query_forms Handler started")
+    start_trace("lambda_query_forms")
+    try:
+        forms_table_name = os.environ["FILLED_FORMS_TABLE_NAME"]
+        query = event.get("queryStringParameters") or {}
+        forms, next_cursor = query_forms(
+            forms_table_name,
+            since=query.get("since"),
+            until=query.get("until"),
+            insurance_type=query.get("type"),
+            limit=int(query.get("limit", QUERY_DEFAULT_LIMIT)),
+            cursor=query.get("cursor"),
+        )
+        set_property("page_size", len(forms))
+        with span("serialize_response"):
+            body = json.dumps(
+                {"forms": forms, "next_cursor": next_cursor}, cls=DecimalEncoder
+            )
         response = {
             "statusCode": HTTPStatus.OK.value,
-            "body": json.dumps(json_filled_form, indent=2),
+            "body": body,
             "headers": {"content-type": "application/json"},
         }
+    except (InvalidQuery, InvalidCursor, ValueError) as e:
+        response = bad_request(f"Invalid query: {e}")
     except Exception as e:
         response = {
             "statusCode": HTTPStatus.INTERNAL_SERVER_ERROR.value,
             "body": f"Exception={e}",
             "headers": {"content-type": "text/plain"},
         }
+    set_property("status_code", response["statusCode"])
+    end_trace()
+    log_cache_stats()
     return response
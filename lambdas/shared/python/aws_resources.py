@@ -0,0 +1,229 @@
+"""
+AWS clients, resources and secrets shared by the Lambda handlers.
+
+Everything here lives at module level, so it is created once per container
+and reused by every warm invocation.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+import boto3
+
+from tracing import span
+
+# Region of the Secrets Manager secret
+REGION_NAME = "us-east-1"
+
+# Secret Manager configuration
+SECRET_NAME = "insurance_fills_secrets"
+SECRET_TTL_SECONDS = int(os.environ.get("SECRET_TTL_SECONDS", "300"))
+# Refresh in the background when the cached secret is this close to expiring
+SECRET_REFRESH_MARGIN_SECONDS = int(
+    os.environ.get("SECRET_REFRESH_MARGIN_SECONDS", "60")
+)
+
+# Create clients and fetch the secret during the Lambda init phase
+WARM_UP_ON_INIT = os.environ.get("WARM_UP_ON_INIT", "true") == "true"
+
+# Create logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Cache hits and misses since the container started
+CACHE_STATS = Counter()
+
+_lock = threading.Lock()
+_clients = {}
+_resources = {}
+_tables = {}
+
+
+def get_client(service_name: str, region_name: str = None) -> object:
+    """
+    Function to get a boto3 client, created once per container
+    """
+    key = (service_name, region_name)
+    client = _clients.get(key)
+    if client is not None:
+        CACHE_STATS["client_hit"] += 1
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            CACHE_STATS["client_miss"] += 1
+            client = boto3.client(service_name, region_name=region_name)
+            _clients[key] = client
+        else:
+            CACHE_STATS["client_hit"] += 1
+    return client
+
+
+def get_resource(service_name: str) -> object:
+    """
+    Function to get a boto3 resource, created once per container
+    """
+    resource = _resources.get(service_name)
+    if resource is not None:
+        CACHE_STATS["resource_hit"] += 1
+        return resource
+
+    with _lock:
+        resource = _resources.get(service_name)
+        if resource is None:
+            CACHE_STATS["resource_miss"] += 1
+            resource = boto3.resource(service_name)
+            _resources[service_name] = resource
+        else:
+            CACHE_STATS["resource_hit"] += 1
+    return resource
+
+
+def get_dynamodb_table(table_name: str) -> object:
+    """
+    Function to get the DynamoDB table object
+    """
+    table = _tables.get(table_name)
+    if table is not None:
+        CACHE_STATS["table_hit"] += 1
+        return table
+
+    CACHE_STATS["table_miss"] += 1
+    table = get_resource("dynamodb").Table(table_name)
+    _tables[table_name] = table
+    return table
+
+
+class SecretCache:
+    """
+    Caches a JSON secret from AWS Secrets Manager.
+
+    A fresh value is returned from memory. A value close to expiry is still
+    returned, and a background thread fetches the new one. An expired or
+    invalidated value is fetched synchronously.
+    """
+
+    def __init__(
+        self,
+        secret_name: str,
+        ttl_seconds: int = SECRET_TTL_SECONDS,
+        refresh_margin_seconds: int = SECRET_REFRESH_MARGIN_SECONDS,
+    ):
+        self.secret_name = secret_name
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self._value = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _age(self) -> float:
+        return time.monotonic() - self._fetched_at
+
+    def _fetch(self) -> dict:
+        client = get_client("secretsmanager", region_name=REGION_NAME)
+        get_secret_value_response = client.get_secret_value(SecretId=self.secret_name)
+
+        # Decrypts secret using the associated KMS key.
+        secret = json.loads(get_secret_value_response["SecretString"])
+
+        with self._lock:
+            self._value = secret
+            self._fetched_at = time.monotonic()
+        return secret
+
+    def _refresh_in_background(self):
+        try:
+            self._fetch()
+            CACHE_STATS["secret_refresh"] += 1
+        except Exception as e:
+            logger.warning(f"Background refresh of {self.secret_name} failed: {e}")
+        finally:
+            self._refreshing = False
+
+    def get(self) -> dict:
+        """
+        Returns the secret, fetching it only when the cached value is expired
+        """
+        value = self._value
+        age = self._age()
+
+        if value is None or age >= self.ttl_seconds:
+            CACHE_STATS["secret_miss"] += 1
+            return self._fetch()
+
+        CACHE_STATS["secret_hit"] += 1
+        if age >= self.ttl_seconds - self.refresh_margin_seconds:
+            with self._lock:
+                start_refresh = not self._refreshing
+                self._refreshing = True
+            if start_refresh:
+                threading.Thread(
+                    target=self._refresh_in_background, daemon=True
+                ).start()
+        return value
+
+    def set(self, value: dict):
+        """
+        Stores a known value, e.g. for local runs without Secrets Manager
+        """
+        with self._lock:
+            self._value = value
+            self._fetched_at = time.monotonic()
+
+    def invalidate(self):
+        """
+        Drops the cached value, e.g. after the secret was rejected
+        """
+        CACHE_STATS["secret_invalidate"] += 1
+        with self._lock:
+            self._value = None
+            self._fetched_at = 0.0
+
+
+secret_cache = SecretCache(SECRET_NAME)
+
+
+def get_secret() -> dict:
+    """
+    Retrieves the secret from AWS Secrets Manager.
+    """
+    with span("get_secret"):
+        return secret_cache.get()
+
+
+def warm_up(
+    table_names: list = (),
+    client_names: list = (),
+    secret: bool = False,
+    secret_caches: list = (),
+):
+    """
+    Function to create the clients, connect to DynamoDB and fetch the secret
+    (and the other secrets of `secret_caches`) during the Lambda init phase,
+    which runs before the first request.
+    Failures are only logged, the first invocation tries again.
+    """
+    try:
+        for table_name in table_names:
+            table = get_dynamodb_table(table_name)
+            table.meta.client.describe_table(TableName=table_name)
+        for client_name in client_names:
+            get_client(client_name)
+        if secret:
+            secret_cache.get()
+        for other_secret_cache in secret_caches:
+            other_secret_cache.get()
+    except Exception as e:
+        logger.warning(f"Warm up failed: {e}")
+
+
+def log_cache_stats():
+    """
+    Logs cache hits and misses collected since the container started
+    """
+    logger.info(f"Cache stats: {dict(CACHE_STATS)}")
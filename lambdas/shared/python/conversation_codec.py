@@ -0,0 +1,111 @@
+"""
+Compact encoding of the messages stored in the ConversationsTable.
+
+A message {"role": str, "content": str} is stored as the list
+[role code, content], and the system prompt as [0, prompt version]: the
+prompt text is in SYSTEM_PROMPTS, not in every conversation. Messages with
+other keys or roles, and those written before this encoding, are stored as
+plain maps; both forms are read.
+
+Once the encoded conversation is larger than COMPRESS_THRESHOLD_BYTES it is
+stored zlib compressed in the binary attribute `conversation_archive`, and
+messages appended later without the history follow it in `conversation`.
+"""
+import json
+import os
+import zlib
+
+ROLE_CODES = {"system": 0, "user": 1, "assistant": 2, "function": 3}
+ROLES = {code: role for role, code in ROLE_CODES.items()}
+
+# System prompts by version, as written: stored conversations refer to them,
+# so a version never changes. When form_schema.build_system_prompt() changes,
+# add its new text under the next version.
+SYSTEM_PROMPTS = {
+    1: (
+        "You are a polite and formal AI assistant helping a user fill "
+        "an insurance application. Fill these fields:\n"
+        "1) first_name: What is your first name?\n"
+        "2) last_name: What is your last name?\n"
+        "3) type_of_insurance: What is the type of insurance you need?\n"
+        "4) phone_number: What is your phone number?\n"
+        "5) age: What is your age?\n"
+        "Ask one question at a time. Only ask for the phone number; if it is "
+        "given in a wrong format, ask again explaining that 10 digits, or 11 "
+        "starting with +1, are expected. Age must be a number of years.\n"
+        "Call save_users_questionnaire once every field is answered, "
+        "otherwise call ask_follow_up_question."
+    ),
+}
+SYSTEM_PROMPT_VERSIONS = {prompt: version for version, prompt in SYSTEM_PROMPTS.items()}
+
+# one write unit: smaller conversations stay readable lists
+COMPRESS_THRESHOLD_BYTES = int(
+    os.environ.get("CONVERSATION_COMPRESS_THRESHOLD_BYTES", "1024")
+)
+COMPRESSION_LEVEL = 6
+
+
+def encode_message(message: dict):
+    """
+    Function to encode one message, unusual messages are kept as they are
+    """
+    role = message.get("role")
+    content = message.get("content")
+    if set(message) != {"role", "content"} or role not in ROLE_CODES:
+        return message
+    if not isinstance(content, str):
+        return message
+    if role == "system" and content in SYSTEM_PROMPT_VERSIONS:
+        return [ROLE_CODES[role], SYSTEM_PROMPT_VERSIONS[content]]
+    return [ROLE_CODES[role], content]
+
+
+def decode_message(value) -> dict:
+    """
+    Function to decode one stored message, in either form
+    """
+    if isinstance(value, dict):
+        return value
+    code, content = value
+    role = ROLES[int(code)]
+    if role == "system" and not isinstance(content, str):
+        # numbers come back from DynamoDB as Decimal
+        content = SYSTEM_PROMPTS[int(content)]
+    return {"role": role, "content": content}
+
+
+def encode_messages(messages: list) -> list:
+    return [encode_message(message) for message in messages]
+
+
+def decode_messages(values: list) -> list:
+    return [decode_message(value) for value in values]
+
+
+def encoded_size(encoded: list) -> int:
+    """
+    Function to estimate the stored size of encoded messages
+    """
+    return len(json.dumps(encoded, separators=(",", ":"), ensure_ascii=False))
+
+
+def compress_messages(messages: list) -> bytes:
+    payload = json.dumps(encode_messages(messages), separators=(",", ":"))
+    return zlib.compress(payload.encode("utf-8"), COMPRESSION_LEVEL)
+
+
+def decompress_messages(data) -> list:
+    # boto3 returns binary attributes as Binary
+    data = getattr(data, "value", data)
+    return decode_messages(json.loads(zlib.decompress(data).decode("utf-8")))
+
+
+def decode_conversation(item: dict) -> list:
+    """
+    Function to read the messages of a ConversationsTable item
+    """
+    messages = []
+    if "conversation_archive" in item:
+        messages = decompress_messages(item["conversation_archive"])
+    return messages + decode_messages(item.get("conversation", []))
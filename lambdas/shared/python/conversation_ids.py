@@ -0,0 +1,111 @@
+"""
+Signed conversation ids, handed out by POST /form without writing the
+ConversationsTable.
+
+An id reads `<nonce>.<prompt version>.<issued at>.<signature>`: ten random
+lowercase letters, the version of the system prompt the conversation starts
+with (conversation_codec.SYSTEM_PROMPTS), the issue time in seconds as base
+36, and a truncated HMAC-SHA256 of the rest. The key is the "key" of the
+secret CONVERSATION_ID_SECRET_NAME. The item is written by the first turn;
+until then the id alone describes the conversation. Ids older than
+CONVERSATION_TTL_SECONDS are rejected, like the items that expire then.
+
+Without CONVERSATION_ID_SECRET_NAME, conversations are created eagerly.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import random
+import string
+import time
+
+from aws_resources import SecretCache
+from conversation_codec import SYSTEM_PROMPTS
+from tracing import span
+
+CONVERSATION_ID_SECRET_NAME = os.environ.get("CONVERSATION_ID_SECRET_NAME")
+CONVERSATION_ID_SECRET_KEY = "key"
+
+# Conversations not touched for a week are deleted by the table TTL
+CONVERSATION_TTL_SECONDS = int(os.environ.get("CONVERSATION_TTL_SECONDS", "604800"))
+
+# 128 bits of HMAC-SHA256, 22 characters of URL-safe base64
+SIGNATURE_BYTES = 16
+
+conversation_id_secret = (
+    SecretCache(CONVERSATION_ID_SECRET_NAME) if CONVERSATION_ID_SECRET_NAME else None
+)
+
+
+class InvalidConversationId(Exception):
+    """
+    Raised when a conversation_id was not signed by this service, or expired
+    """
+
+
+def signed_ids_enabled() -> bool:
+    return conversation_id_secret is not None
+
+
+def get_random_id() -> str:
+    """
+    Function to generate a random string of 10 lowercase alphabets
+    """
+    return "".join(random.choices(string.ascii_lowercase, k=10))
+
+
+def to_base36(number: int) -> str:
+    digits = string.digits + string.ascii_lowercase
+    encoded = ""
+    while True:
+        number, digit = divmod(number, 36)
+        encoded = digits[digit] + encoded
+        if number == 0:
+            return encoded
+
+
+def expiry_time(now: float = None) -> int:
+    """
+    Function to get the `expires_at` of a conversation written now
+    """
+    return int(now if now is not None else time.time()) + CONVERSATION_TTL_SECONDS
+
+
+def sign(payload: str) -> str:
+    with span("get_secret"):
+        key = conversation_id_secret.get()[CONVERSATION_ID_SECRET_KEY]
+    digest = hmac.new(key.encode(), payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:SIGNATURE_BYTES]).decode().rstrip("=")
+
+
+def new_conversation_id(prompt_version: int, now: float = None) -> str:
+    """
+    Function to create a signed conversation_id, nothing is stored
+    """
+    issued_at = int(now if now is not None else time.time())
+    payload = f"{get_random_id()}.{prompt_version}.{to_base36(issued_at)}"
+    return f"{payload}.{sign(payload)}"
+
+
+def read_conversation_id(conversation_id: str, now: float = None) -> int:
+    """
+    Function to check a conversation_id that is not stored yet.
+    Returns the version of its system prompt.
+    """
+    if not signed_ids_enabled():
+        raise InvalidConversationId(conversation_id)
+    parts = conversation_id.split(".")
+    if len(parts) != 4:
+        raise InvalidConversationId(conversation_id)
+    payload, signature = conversation_id.rsplit(".", 1)
+    if not hmac.compare_digest(sign(payload), signature):
+        raise InvalidConversationId(conversation_id)
+
+    _, prompt_version, issued_at = parts[:3]
+    now = now if now is not None else time.time()
+    if int(issued_at, 36) + CONVERSATION_TTL_SECONDS < now:
+        raise InvalidConversationId(conversation_id)
+    if int(prompt_version) not in SYSTEM_PROMPTS:
+        raise InvalidConversationId(conversation_id)
+    return int(prompt_version)
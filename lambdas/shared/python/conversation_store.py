@@ -0,0 +1,332 @@
+"""
+Append-only storage of conversations in the ConversationsTable.
+
+Items look like this:
+    {
+    "conversation_id": str,
+    "conversation": [[role code, content], ...],
+    "conversation_archive": bytes,
+    "version": int,
+    "token_usage": [{"model": str, "prompt_tokens": int, "completion_tokens": int}],
+    "prompt_tokens_total": int,
+    "completion_tokens_total": int,
+    "answers": {field: value},
+    "pending_field": str,
+    "expires_at": int
+    }
+
+`answers` and `pending_field` track the form: the answers validated so far
+and the field the last question asked about. Messages are stored in the
+compact form of conversation_codec, and once the conversation is large,
+compressed in `conversation_archive`; callers only see {"role", "content"} maps.
+
+New messages are appended with `list_append` in a single UpdateItem, so a
+turn never rewrites the whole transcript until it is compressed. A
+compressed transcript is written again by every turn, which costs no more
+write units than an append: UpdateItem is billed on the larger of the item
+before and after. `version` is increased by every
+append and lets callers detect concurrent turns. Items written before
+`version` existed are treated as version 0.
+
+A conversation with a signed conversation_id (conversation_ids) is only
+stored by its first turn, which writes the system prompt with the first
+messages and fails if another request created the item first. `expires_at`
+is the TTL of the table: it is moved forward by every turn and removed
+once the form is filled, so only abandoned conversations expire.
+"""
+import logging
+
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+
+from aws_resources import get_client, get_dynamodb_table
+from conversation_codec import (
+    COMPRESS_THRESHOLD_BYTES,
+    SYSTEM_PROMPTS,
+    compress_messages,
+    decode_conversation,
+    encode_messages,
+    encoded_size,
+)
+from conversation_ids import InvalidConversationId, read_conversation_id
+from tracing import span
+
+# Create logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class ConversationNotFound(Exception):
+    """
+    Raised when the conversation_id does not exist
+    """
+
+
+class ConversationVersionConflict(Exception):
+    """
+    Raised when the conversation was changed by another request
+    """
+
+
+# Attributes describing the state of the form
+STATE_ATTRIBUTES = ("answers", "pending_field", "escalate")
+
+
+def load_conversation(table_name: str, conversation_id: str) -> (list, int, dict):
+    """
+    Function to read the ordered conversation history, its version
+    and the state of the form
+    """
+    table = get_dynamodb_table(table_name)
+    with span("dynamodb_get_item"):
+        response = table.get_item(
+            Key={"conversation_id": conversation_id}, ConsistentRead=True
+        )
+    item = response.get("Item")
+    if item is None:
+        raise ConversationNotFound(conversation_id)
+
+    state = {key: item[key] for key in STATE_ATTRIBUTES if key in item}
+    return decode_conversation(item), int(item.get("version", 0)), state
+
+
+def start_conversation(conversation_id: str) -> list:
+    """
+    Function to get the history of a signed conversation_id that is not
+    stored yet: the system prompt it was created with
+    """
+    try:
+        prompt_version = read_conversation_id(conversation_id)
+    except InvalidConversationId as e:
+        raise ConversationNotFound(conversation_id) from e
+    return [{"role": "system", "content": SYSTEM_PROMPTS[prompt_version]}]
+
+
+def load_or_start_conversation(
+    table_name: str, conversation_id: str
+) -> (list, int, dict, bool):
+    """
+    Function to read a conversation like load_conversation, or start the one
+    of a signed conversation_id. The last value is True when the conversation
+    is not stored yet and has to be created by the first append.
+    """
+    try:
+        return load_conversation(table_name, conversation_id) + (False,)
+    except ConversationNotFound:
+        history = start_conversation(conversation_id)
+    logger.info(f"Starting the conversation {conversation_id}")
+    return history, 0, {}, True
+
+
+def append_update_params(
+    conversation_id: str,
+    messages: list,
+    expected_version: int = None,
+    usage: dict = None,
+    state: dict = None,
+    history: list = None,
+    create: bool = False,
+) -> dict:
+    """
+    Function to build UpdateItem parameters appending messages to a conversation,
+    the token counts of the model response if there was one, and the new state
+    of the form (attributes set to None are removed).
+    With the stored history and its version, a conversation larger than
+    COMPRESS_THRESHOLD_BYTES is written compressed instead.
+    With `create`, the item must not exist yet and history is written too.
+    """
+    condition = "attribute_exists(conversation_id)"
+    if create:
+        condition = "attribute_not_exists(conversation_id)"
+        messages = history + messages
+        history = []
+    encoded = encode_messages(messages)
+    values = {":empty": [], ":zero": 0, ":one": 1}
+    set_clauses = ["version = if_not_exists(version, :zero) + :one"]
+    compress = (
+        history is not None
+        and expected_version is not None
+        and encoded_size(encode_messages(history) + encoded) >= COMPRESS_THRESHOLD_BYTES
+    )
+    if compress:
+        # the version condition guarantees that history is the stored one
+        values[":archive"] = compress_messages(history + messages)
+        set_clauses.append("conversation_archive = :archive")
+        set_clauses.append("conversation = :empty")
+    else:
+        values[":new"] = encoded
+        set_clauses.append(
+            "conversation = list_append(if_not_exists(conversation, :empty), :new)"
+        )
+    add_clauses = []
+    remove_clauses = []
+
+    if usage is not None:
+        values[":usage"] = [usage]
+        values[":prompt_tokens"] = usage["prompt_tokens"]
+        values[":completion_tokens"] = usage["completion_tokens"]
+        set_clauses.append(
+            "token_usage = list_append(if_not_exists(token_usage, :empty), :usage)"
+        )
+        add_clauses.append("prompt_tokens_total :prompt_tokens")
+        add_clauses.append("completion_tokens_total :completion_tokens")
+
+    for key, value in (state or {}).items():
+        if value is None:
+            remove_clauses.append(key)
+        else:
+            values[f":{key}"] = value
+            set_clauses.append(f"{key} = :{key}")
+
+    update_expression = "SET " + ", ".join(set_clauses)
+    if add_clauses:
+        update_expression += " ADD " + ", ".join(add_clauses)
+    if remove_clauses:
+        update_expression += " REMOVE " + ", ".join(remove_clauses)
+
+    if expected_version is not None and not create:
+        values[":expected"] = expected_version
+        if expected_version == 0:
+            condition += " AND (attribute_not_exists(version) OR version = :expected)"
+        else:
+            condition += " AND version = :expected"
+
+    return {
+        "Key": {"conversation_id": conversation_id},
+        "UpdateExpression": update_expression,
+        "ConditionExpression": condition,
+        "ExpressionAttributeValues": values,
+    }
+
+
+def append_messages(
+    table_name: str,
+    conversation_id: str,
+    messages: list,
+    expected_version: int = None,
+    usage: dict = None,
+    state: dict = None,
+    history: list = None,
+    create: bool = False,
+) -> (list, int):
+    """
+    Function to append messages to a conversation without rewriting it.
+    Returns the updated conversation and its new version.
+    """
+    table = get_dynamodb_table(table_name)
+    params = append_update_params(
+        conversation_id, messages, expected_version, usage, state, history, create
+    )
+
+    try:
+        with span("dynamodb_update_item"):
+            response = table.update_item(ReturnValues="ALL_NEW", **params)
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        if expected_version is None:
+            raise ConversationNotFound(conversation_id) from e
+        raise ConversationVersionConflict(conversation_id) from e
+
+    item = response["Attributes"]
+    logger.info(f"Appended {len(messages)} messages in the table: {table_name}")
+    return decode_conversation(item), int(item["version"])
+
+
+def backfill_versions(table_name: str) -> int:
+    """
+    Function to add `version` to conversations written before it existed.
+    Returns the number of migrated items.
+    """
+    table = get_dynamodb_table(table_name)
+    scan_kwargs = {
+        "ProjectionExpression": "conversation_id",
+        "FilterExpression": "attribute_not_exists(version)",
+    }
+    migrated = 0
+
+    while True:
+        response = table.scan(**scan_kwargs)
+        for item in response.get("Items", []):
+            try:
+                table.update_item(
+                    Key={"conversation_id": item["conversation_id"]},
+                    UpdateExpression="SET version = :zero",
+                    ConditionExpression="attribute_not_exists(version)",
+                    ExpressionAttributeValues={":zero": 0},
+                )
+                migrated += 1
+            except ClientError as e:
+                # the item was appended to while we were scanning
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+
+        if "LastEvaluatedKey" not in response:
+            break
+        scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    logger.info(f"Migrated {migrated} conversations in the table: {table_name}")
+    return migrated
+
+
+def transaction_cancelled_by_condition(error: ClientError) -> bool:
+    """
+    Function to check whether a transaction failed on one of its conditions
+    """
+    reasons = error.response.get("CancellationReasons", [])
+    return any(reason.get("Code") == "ConditionalCheckFailed" for reason in reasons)
+
+
+def append_messages_and_save_form(
+    table_name: str,
+    conversation_id: str,
+    messages: list,
+    expected_version: int,
+    forms_table_name: str,
+    filled_form: dict,
+    usage: dict = None,
+    state: dict = None,
+    history: list = None,
+    create: bool = False,
+):
+    """
+    Function to append the last messages and store the filled form in one
+    TransactWriteItems call, so a form is never saved for a lost turn
+    """
+    serializer = TypeSerializer()
+    update = append_update_params(
+        conversation_id, messages, expected_version, usage, state, history, create
+    )
+
+    try:
+        with span("dynamodb_transact_write_items"):
+            get_client("dynamodb").transact_write_items(
+                TransactItems=[
+                    {
+                        "Update": {
+                            "TableName": table_name,
+                            "Key": serializer.serialize(update["Key"])["M"],
+                            "UpdateExpression": update["UpdateExpression"],
+                            "ConditionExpression": update["ConditionExpression"],
+                            "ExpressionAttributeValues": serializer.serialize(
+                                update["ExpressionAttributeValues"]
+                            )["M"],
+                        }
+                    },
+                    {
+                        "Put": {
+                            "TableName": forms_table_name,
+                            "Item": serializer.serialize(filled_form)["M"],
+                            "ConditionExpression": "attribute_not_exists(conversation_id)",
+                        }
+                    },
+                ]
+            )
+    except ClientError as e:
+        error_code = e.response["Error"]["Code"]
+        if error_code == "TransactionCanceledException":
+            if transaction_cancelled_by_condition(e):
+                raise ConversationVersionConflict(conversation_id) from e
+        raise
+
+    logger.info(f"Stored the turn and the filled form in: {forms_table_name}")
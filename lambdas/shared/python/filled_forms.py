@@ -0,0 +1,408 @@
+"""
+Bulk reads of FilledFormsTable: many forms by id with BatchGetItem, the
+whole table as pages of a parallel segmented Scan, and forms by creation
+time or type of insurance from the global secondary indexes.
+
+The low-level DynamoDB client is used because, unlike boto3 resources, it
+can be shared by the threads scanning the segments.
+"""
+import base64
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from time import gmtime, strftime
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+from aws_resources import get_client
+from form_schema import INSURANCE_TYPES, parse_type_of_insurance
+from tracing import add_count, span
+
+# Most keys DynamoDB accepts in one BatchGetItem call
+BATCH_GET_LIMIT = 100
+BATCH_GET_MAX_ATTEMPTS = 8
+BATCH_GET_BASE_DELAY_SECONDS = 0.05
+
+EXPORT_SEGMENTS = 4
+# Items read from each segment for one page of the export
+EXPORT_SEGMENT_PAGE_SIZE = 250
+
+# Global secondary indexes of FilledFormsTable
+CREATE_DAY_INDEX = "ByCreateDay"
+INSURANCE_TYPE_INDEX = "ByInsuranceType"
+# ByInsuranceType is deployed after ByCreateDay; until then a type is
+# filtered from the forms of the ByCreateDay query
+INSURANCE_TYPE_INDEX_ENABLED = (
+    os.environ.get("INSURANCE_TYPE_INDEX_ENABLED", "false").lower() == "true"
+)
+# Attributes of the keys returned by a scan of the table and by the indexes
+TABLE_KEY = ("conversation_id",)
+CREATE_DAY_INDEX_KEY = ("conversation_id", "create_day", "create_time")
+INSURANCE_TYPE_INDEX_KEY = ("conversation_id", "type_of_insurance", "create_time")
+# Format of `create_time`, sortable as a string
+CREATE_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+QUERY_DEFAULT_LIMIT = 100
+QUERY_MAX_LIMIT = 1000
+QUERY_MAX_DAYS = 366
+
+# Create logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+class DecimalEncoder(json.JSONEncoder):
+    """
+    Encoder for numbers that are stored in DynamoDB as Decimal, written as
+    the int or float they were, like in the response of the last turn
+    """
+
+    def default(self, o):
+        if isinstance(o, Decimal):
+            return int(o) if o == o.to_integral_value() else float(o)
+        return super(DecimalEncoder, self).default(o)
+
+
+class UnprocessedKeysError(Exception):
+    """
+    Raised when DynamoDB keeps returning unprocessed keys
+    """
+
+
+class InvalidQuery(Exception):
+    """
+    Raised for query parameters that cannot be served from an index
+    """
+
+
+class InvalidCursor(Exception):
+    """
+    Raised when an export cursor was not returned by export_page
+    """
+
+
+def _deserialize(item: dict) -> dict:
+    return {name: _deserializer.deserialize(value) for name, value in item.items()}
+
+
+def _projection(fields: list) -> dict:
+    if not fields:
+        return {}
+    names = {f"#f{index}": field for index, field in enumerate(fields)}
+    return {
+        "ProjectionExpression": ", ".join(names),
+        "ExpressionAttributeNames": names,
+    }
+
+
+def batch_get_forms(table_name: str, conversation_ids: list, fields: list = None):
+    """
+    Function to read many forms with BatchGetItem, retrying unprocessed keys
+    with exponential backoff. Returns the forms found, by conversation_id.
+    """
+    if fields and "conversation_id" not in fields:
+        fields = ["conversation_id"] + list(fields)
+    client = get_client("dynamodb")
+    unique_ids = list(dict.fromkeys(conversation_ids))
+    forms = {}
+    for start in range(0, len(unique_ids), BATCH_GET_LIMIT):
+        keys = [
+            {"conversation_id": _serializer.serialize(conversation_id)}
+            for conversation_id in unique_ids[start : start + BATCH_GET_LIMIT]
+        ]
+        request = {table_name: dict(Keys=keys, **_projection(fields))}
+        for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+            with span("dynamodb_batch_get_item"):
+                response = client.batch_get_item(RequestItems=request)
+            for item in response["Responses"].get(table_name, []):
+                form = _deserialize(item)
+                forms[form["conversation_id"]] = form
+            request = response.get("UnprocessedKeys") or {}
+            if not request:
+                break
+            add_count("unprocessed_keys_retry")
+            delay = BATCH_GET_BASE_DELAY_SECONDS * 2**attempt
+            time.sleep(random.uniform(0, delay))
+        else:
+            raise UnprocessedKeysError(
+                f"{len(request[table_name]['Keys'])} keys still unprocessed"
+            )
+    return forms
+
+
+def encode_cursor(cursor: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+
+def is_start_key(key, attribute_names: tuple) -> bool:
+    """
+    Function to check that a key from a cursor is a DynamoDB key of
+    string attributes, with the attributes returned for the table or index
+    """
+    return (
+        isinstance(key, dict)
+        and sorted(key) == sorted(attribute_names)
+        and all(
+            isinstance(value, dict)
+            and list(value) == ["S"]
+            and isinstance(value["S"], str)
+            for value in key.values()
+        )
+    )
+
+
+def decode_cursor(token: str) -> dict:
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+        segments = cursor["segments"]
+        if not isinstance(segments, int) or segments < 1 or not cursor["keys"]:
+            raise ValueError("no segment left")
+        for segment, key in cursor["keys"].items():
+            if not 0 <= int(segment) < segments:
+                raise ValueError(f"unknown segment {segment}")
+            if not is_start_key(key, TABLE_KEY):
+                raise ValueError(f"invalid key of segment {segment}")
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise InvalidCursor(token) from e
+    return cursor
+
+
+def decode_query_cursor(token: str, attribute_names: tuple) -> dict:
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+        if not isinstance(cursor, dict):
+            raise ValueError("not an object")
+        if "key" in cursor and not is_start_key(cursor["key"], attribute_names):
+            raise ValueError("invalid key")
+        if "day" in cursor:
+            datetime.strptime(cursor["day"], "%Y-%m-%d")
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(token) from e
+    return cursor
+
+
+def is_invalid_start_key(error: ClientError, start_key: dict) -> bool:
+    """
+    Function to check if DynamoDB rejected the key of a cursor
+    """
+    return bool(start_key) and error.response["Error"]["Code"] == "ValidationException"
+
+
+def _scan_segment_page(
+    table_name: str, segment: int, total_segments: int, start_key: dict, limit: int
+) -> (list, dict):
+    params = {
+        "TableName": table_name,
+        "Segment": segment,
+        "TotalSegments": total_segments,
+        "Limit": limit,
+    }
+    if start_key:
+        params["ExclusiveStartKey"] = start_key
+    try:
+        response = get_client("dynamodb").scan(**params)
+    except ClientError as e:
+        if is_invalid_start_key(e, start_key):
+            raise InvalidCursor(str(start_key)) from e
+        raise
+    items = [_deserialize(item) for item in response.get("Items", [])]
+    return items, response.get("LastEvaluatedKey")
+
+
+def export_page(
+    table_name: str,
+    cursor: str = None,
+    total_segments: int = EXPORT_SEGMENTS,
+    segment_page_size: int = EXPORT_SEGMENT_PAGE_SIZE,
+) -> (list, str):
+    """
+    Function to read the next page of the whole table. The segments are
+    scanned in parallel, one page of each. Returns the forms and the cursor
+    of the next page, None after the last page.
+    """
+    if cursor is None:
+        state = {"segments": total_segments, "keys": {}}
+        pending = list(range(total_segments))
+    else:
+        state = decode_cursor(cursor)
+        pending = [int(segment) for segment in state["keys"]]
+
+    def scan(segment: int):
+        start_key = state["keys"].get(str(segment))
+        return _scan_segment_page(
+            table_name, segment, state["segments"], start_key, segment_page_size
+        )
+
+    with span("dynamodb_scan"), ThreadPoolExecutor(len(pending) or 1) as executor:
+        pages = list(executor.map(scan, pending))
+
+    forms = []
+    next_keys = {}
+    for segment, (items, last_key) in zip(pending, pages):
+        forms.extend(items)
+        if last_key:
+            next_keys[str(segment)] = last_key
+    if not next_keys:
+        return forms, None
+    return forms, encode_cursor({"segments": state["segments"], "keys": next_keys})
+
+
+def to_ndjson(forms: list) -> str:
+    return "".join(json.dumps(form, cls=DecimalEncoder) + "\n" for form in forms)
+
+
+def _time_bound(value: str, end_of_day: bool) -> str:
+    """
+    Function to turn `YYYY-MM-DD`, `YYYY-MM-DD HH:MM:SS` or the ISO form
+    with `T` into the format of `create_time`
+    """
+    value = value.strip().replace("T", " ").rstrip("Z")
+    for time_format in (CREATE_TIME_FORMAT, "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            parsed = datetime.strptime(value, time_format)
+        except ValueError:
+            continue
+        if time_format == "%Y-%m-%d" and end_of_day:
+            parsed = parsed.replace(hour=23, minute=59, second=59)
+        return parsed.strftime(CREATE_TIME_FORMAT)
+    raise InvalidQuery(f"Unknown time format: {value}")
+
+
+def _query_page(params: dict, limit: int, start_key: dict) -> (list, dict):
+    if start_key:
+        params = dict(params, ExclusiveStartKey=start_key)
+    try:
+        with span("dynamodb_query"):
+            response = get_client("dynamodb").query(Limit=limit, **params)
+    except ClientError as e:
+        if is_invalid_start_key(e, start_key):
+            raise InvalidCursor(str(start_key)) from e
+        raise
+    items = [_deserialize(item) for item in response.get("Items", [])]
+    return items, response.get("LastEvaluatedKey")
+
+
+def query_forms(
+    table_name: str,
+    since: str = None,
+    until: str = None,
+    insurance_type: str = None,
+    limit: int = QUERY_DEFAULT_LIMIT,
+    cursor: str = None,
+) -> (list, str):
+    """
+    Function to get the forms created in a time range and/or of a type of
+    insurance, oldest first, from the ByCreateDay or ByInsuranceType index.
+    Returns at most `limit` forms and the cursor of the next page.
+    """
+    if since is None and insurance_type is None:
+        raise InvalidQuery("since or type is required")
+    if since is None and not INSURANCE_TYPE_INDEX_ENABLED:
+        raise InvalidQuery("since is required")
+    if insurance_type is not None:
+        # stored as in INSURANCE_TYPES, e.g. "Home" for "home insurance"
+        stored_type = parse_type_of_insurance(insurance_type)
+        if stored_type is None:
+            raise InvalidQuery(f"type must be one of {', '.join(INSURANCE_TYPES)}")
+        insurance_type = stored_type
+    limit = max(1, min(limit, QUERY_MAX_LIMIT))
+    until = (
+        _time_bound(until, True) if until else strftime(CREATE_TIME_FORMAT, gmtime())
+    )
+    since = _time_bound(since, False) if since else None
+    use_type_index = insurance_type is not None and INSURANCE_TYPE_INDEX_ENABLED
+    key_names = INSURANCE_TYPE_INDEX_KEY if use_type_index else CREATE_DAY_INDEX_KEY
+    state = decode_query_cursor(cursor, key_names) if cursor else {}
+
+    if use_type_index:
+        condition = "type_of_insurance = :type"
+        values = {
+            ":type": _serializer.serialize(insurance_type),
+            ":until": _serializer.serialize(until),
+        }
+        if since is None:
+            condition += " AND create_time <= :until"
+        else:
+            condition += " AND create_time BETWEEN :since AND :until"
+            values[":since"] = _serializer.serialize(since)
+        params = {
+            "TableName": table_name,
+            "IndexName": INSURANCE_TYPE_INDEX,
+            "KeyConditionExpression": condition,
+            "ExpressionAttributeValues": values,
+        }
+        forms, last_key = _query_page(params, limit, state.get("key"))
+        next_cursor = encode_cursor({"key": last_key}) if last_key else None
+        return forms, next_cursor
+
+    # one query per day bucket, from the day of `since` to the day of `until`
+    day = datetime.strptime(state.get("day", since[:10]), "%Y-%m-%d")
+    last_day = datetime.strptime(until[:10], "%Y-%m-%d")
+    if (last_day - day).days > QUERY_MAX_DAYS:
+        raise InvalidQuery(f"At most {QUERY_MAX_DAYS} days can be queried")
+    start_key = state.get("key")
+    forms = []
+    while day <= last_day and len(forms) < limit:
+        params = {
+            "TableName": table_name,
+            "IndexName": CREATE_DAY_INDEX,
+            "KeyConditionExpression": "create_day = :day AND create_time BETWEEN :since AND :until",
+            "ExpressionAttributeValues": {
+                ":day": _serializer.serialize(day.strftime("%Y-%m-%d")),
+                ":since": _serializer.serialize(since),
+                ":until": _serializer.serialize(until),
+            },
+        }
+        if insurance_type is not None:
+            params["FilterExpression"] = "type_of_insurance = :type"
+            params["ExpressionAttributeValues"][":type"] = _serializer.serialize(
+                insurance_type
+            )
+        items, start_key = _query_page(params, limit - len(forms), start_key)
+        forms.extend(items)
+        if start_key is None:
+            day += timedelta(days=1)
+
+    if day > last_day:
+        return forms, None
+    next_state = {"day": day.strftime("%Y-%m-%d")}
+    if start_key is not None:
+        next_state["key"] = start_key
+    return forms, encode_cursor(next_state)
+
+
+def backfill_create_day(table_name: str) -> int:
+    """
+    Function to add `create_day` to forms stored before the ByCreateDay
+    index existed. Returns the number of updated forms.
+    """
+    client = get_client("dynamodb")
+    updated = 0
+    params = {
+        "TableName": table_name,
+        "FilterExpression": "attribute_not_exists(create_day) AND attribute_exists(create_time)",
+        "ProjectionExpression": "conversation_id, create_time",
+    }
+    while True:
+        response = client.scan(**params)
+        for item in response.get("Items", []):
+            client.update_item(
+                TableName=table_name,
+                Key={"conversation_id": item["conversation_id"]},
+                UpdateExpression="SET create_day = :day",
+                ExpressionAttributeValues={
+                    ":day": {"S": item["create_time"]["S"][:10]}
+                },
+            )
+            updated += 1
+        if "LastEvaluatedKey" not in response:
+            return updated
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
@@ -0,0 +1,227 @@
+"""
+Single definition of the insurance questionnaire.
+
+The system prompt, the OpenAI function schemas, the validation of filled
+forms and the local fast path are all generated from FORM_FIELDS, so adding
+or changing a field only happens here.
+"""
+import re
+from dataclasses import dataclass
+from decimal import Decimal
+
+INSURANCE_TYPES = ("Auto", "Home", "Condo", "Tenant", "Farm", "Commercial", "Life")
+
+TRAILING_PUNCTUATION = ".!,; "
+
+
+@dataclass(frozen=True)
+class FormField:
+    name: str
+    question: str
+    type: str
+    description: str = None
+    pattern: str = None
+    enum: tuple = None
+    minimum: int = None
+    maximum: int = None
+
+    def json_schema(self) -> dict:
+        """
+        JSON schema of the field for the OpenAI function parameters
+        """
+        schema = {"type": self.type}
+        if self.description is not None:
+            schema["description"] = self.description
+        if self.pattern is not None:
+            schema["pattern"] = self.pattern
+        if self.enum is not None:
+            schema["enum"] = list(self.enum)
+        if self.minimum is not None:
+            schema["minimum"] = self.minimum
+        if self.maximum is not None:
+            schema["maximum"] = self.maximum
+        return schema
+
+    def parse(self, value):
+        """
+        Returns the normalized value, None if it is not a valid answer
+        """
+        return FIELD_PARSERS[self.name](str(value).strip().rstrip(TRAILING_PUNCTUATION))
+
+
+NAME_PATTERN = r"^[A-Za-z][A-Za-z'\- ]*$"
+
+FORM_FIELDS = (
+    FormField(
+        name="first_name",
+        question="What is your first name?",
+        type="string",
+        pattern=NAME_PATTERN,
+    ),
+    FormField(
+        name="last_name",
+        question="What is your last name?",
+        type="string",
+        pattern=NAME_PATTERN,
+    ),
+    FormField(
+        name="type_of_insurance",
+        question="What is the type of insurance you need?",
+        type="string",
+        enum=INSURANCE_TYPES,
+    ),
+    FormField(
+        name="phone_number",
+        question="What is your phone number?",
+        type="integer",
+        description="10 digit phone number without the +1 country code",
+        minimum=10**9,
+        maximum=10**10 - 1,
+    ),
+    FormField(
+        name="age",
+        question="What is your age?",
+        type="integer",
+        description="Age in full years",
+        minimum=1,
+        maximum=120,
+    ),
+)
+
+FIELDS_BY_NAME = {field.name: field for field in FORM_FIELDS}
+FIELD_QUESTIONS = {field.name: field.question for field in FORM_FIELDS}
+
+
+def parse_name(reply: str):
+    if re.match(NAME_PATTERN, reply):
+        return reply
+    return None
+
+
+def parse_type_of_insurance(reply: str):
+    reply = reply.lower()
+    if reply.endswith(" insurance"):
+        reply = reply[: -len(" insurance")]
+    for insurance_type in INSURANCE_TYPES:
+        if reply == insurance_type.lower():
+            return insurance_type
+    return None
+
+
+def parse_phone_number(reply: str):
+    if not re.match(r"^\+?[\d\s\-\.\(\)]+$", reply):
+        return None
+    digits = re.sub(r"\D", "", reply)
+    if len(digits) == 10 and not reply.startswith("+"):
+        return int(digits)
+    if len(digits) == 11 and reply.startswith("+1"):
+        return int(digits[1:])
+    return None
+
+
+def parse_age(reply: str):
+    if not re.match(r"^\d{1,3}$", reply):
+        return None
+    age = int(reply)
+    field = FIELDS_BY_NAME["age"]
+    if field.minimum <= age <= field.maximum:
+        return age
+    return None
+
+
+FIELD_PARSERS = {
+    "first_name": parse_name,
+    "last_name": parse_name,
+    "type_of_insurance": parse_type_of_insurance,
+    "phone_number": parse_phone_number,
+    "age": parse_age,
+}
+
+
+def build_system_prompt() -> str:
+    """
+    Function to build the system prompt from the form fields
+    """
+    questions = "\n".join(
+        f"{number}) {field.name}: {field.question}"
+        for number, field in enumerate(FORM_FIELDS, start=1)
+    )
+    return (
+        "You are a polite and formal AI assistant helping a user fill "
+        "an insurance application. Fill these fields:\n"
+        f"{questions}\n"
+        "Ask one question at a time. Only ask for the phone number; if it is "
+        "given in a wrong format, ask again explaining that 10 digits, or 11 "
+        "starting with +1, are expected. Age must be a number of years.\n"
+        "Call save_users_questionnaire once every field is answered, "
+        "otherwise call ask_follow_up_question."
+    )
+
+
+def build_functions() -> list:
+    """
+    Function to build the OpenAI function definitions from the form fields
+    """
+    properties = {field.name: field.json_schema() for field in FORM_FIELDS}
+    # answers are validated again on save, types are enough while collecting
+    answer_types = {field.name: {"type": field.type} for field in FORM_FIELDS}
+    return [
+        {
+            "name": "save_users_questionnaire",
+            "description": "Store the questionnaire once every field is answered",
+            "parameters": {
+                "type": "object",
+                "properties": properties,
+                "required": list(FIELDS_BY_NAME),
+                "additionalProperties": False,
+            },
+        },
+        {
+            "name": "ask_follow_up_question",
+            "description": "Ask the user the next question",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "next_question": {"type": "string"},
+                    "pending_field": {"type": "string", "enum": list(FIELDS_BY_NAME)},
+                    "collected_answers": {
+                        "type": "object",
+                        "properties": answer_types,
+                        "description": "Answers given so far",
+                    },
+                },
+                "required": ["next_question", "pending_field"],
+            },
+        },
+    ]
+
+
+def parse_field(name: str, value):
+    """
+    Function to get the normalized value of a field, None if it is not valid
+    """
+    return FIELDS_BY_NAME[name].parse(value)
+
+
+def plain_value(value):
+    """
+    Function to convert a number read from DynamoDB back to int
+    """
+    return int(value) if isinstance(value, Decimal) else value
+
+
+def validate_form(form: dict) -> (dict, list):
+    """
+    Function to validate a filled form.
+    Returns the normalized form and the names of missing or invalid fields.
+    """
+    cleaned = {}
+    errors = []
+    for field in FORM_FIELDS:
+        value = form.get(field.name)
+        parsed = None if value is None else field.parse(plain_value(value))
+        if parsed is None:
+            errors.append(field.name)
+        else:
+            cleaned[field.name] = parsed
+    return cleaned, errors
@@ -0,0 +1,100 @@
+"""
+Results of `POST /form/{conversation_id}` kept for replays.
+
+A request is identified by its `Idempotency-Key` header or, when the client
+sends the index of the turn in `X-Turn-Index`, by a hash of the
+conversation_id, the turn index and the body. The result of the turn is
+stored under that key in a DynamoDB table with a TTL, and in an LRU cache of
+the warm container. Requests with neither header are never deduplicated:
+the same answer can legitimately be sent twice, e.g. the same last name.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+from aws_resources import CACHE_STATS, get_dynamodb_table
+from lru import LRUCache
+from tracing import add_count, span
+
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_CACHE_SIZE = 512
+
+IDEMPOTENCY_KEY_HEADER = "idempotency-key"
+TURN_INDEX_HEADER = "x-turn-index"
+
+# Create logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_results = LRUCache(IDEMPOTENCY_CACHE_SIZE, ttl_seconds=IDEMPOTENCY_TTL_SECONDS)
+
+
+def idempotency_key(conversation_id: str, headers: dict, body: str) -> str:
+    """
+    Function to get the key of a request, None if it cannot be replayed
+    """
+    headers = {name.lower(): value for name, value in (headers or {}).items()}
+    if headers.get(IDEMPOTENCY_KEY_HEADER):
+        return f"{conversation_id}#{headers[IDEMPOTENCY_KEY_HEADER]}"
+    if headers.get(TURN_INDEX_HEADER):
+        digest = hashlib.sha256(
+            "\n".join([conversation_id, headers[TURN_INDEX_HEADER], body]).encode()
+        ).hexdigest()
+        return f"{conversation_id}#{digest}"
+    return None
+
+
+def get_result(table_name: str, key: str) -> dict:
+    """
+    Function to get the stored result of a request, None if there is none.
+    The table only saves work, so when it cannot be read the turn is run.
+    """
+    result = _results.get(key)
+    if result is not None:
+        CACHE_STATS["idempotency_hit"] += 1
+        return result
+
+    try:
+        with span("dynamodb_get_idempotency"):
+            item = (
+                get_dynamodb_table(table_name)
+                .get_item(Key={"idempotency_key": key}, ConsistentRead=True)
+                .get("Item")
+            )
+    except ClientError as e:
+        logger.warning(f"Could not read the result of {key}: {e}")
+        add_count("idempotency_read_failed")
+        return None
+    # expired items are deleted by DynamoDB up to a few days late
+    if item is None or item["expires_at"] < time.time():
+        CACHE_STATS["idempotency_miss"] += 1
+        return None
+
+    CACHE_STATS["idempotency_hit"] += 1
+    result = json.loads(item["result"])
+    _results.put(key, result)
+    return result
+
+
+def save_result(table_name: str, key: str, result: dict):
+    """
+    Function to store the result of a request for its replays.
+    The turn is already stored, so a failure here is only logged.
+    """
+    _results.put(key, result)
+    try:
+        with span("dynamodb_put_idempotency"):
+            get_dynamodb_table(table_name).put_item(
+                Item={
+                    "idempotency_key": key,
+                    # as JSON, so numbers do not come back as Decimal
+                    "result": json.dumps(result),
+                    "expires_at": int(time.time()) + IDEMPOTENCY_TTL_SECONDS,
+                }
+            )
+    except Exception as e:
+        logger.warning(f"Could not store the result of {key}: {e}")
@@ -0,0 +1,48 @@
+"""
+Small in-memory LRU cache kept by a warm container between invocations
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Keeps the most recently used `maxsize` values, each for at most
+    `ttl_seconds` when it is given
+    """
+
+    def __init__(self, maxsize: int = 256, ttl_seconds: float = None):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            value, stored_at = item
+            if self.ttl_seconds is not None and (
+                time.monotonic() - stored_at >= self.ttl_seconds
+            ):
+                del self._items[key]
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (value, time.monotonic())
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._items.pop(key, None)
+        return default if item is None else item[0]
+
+    def __len__(self) -> int:
+        return len(self._items)
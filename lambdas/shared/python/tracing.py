@@ -0,0 +1,174 @@
+"""
+Per-stage timings and metrics of a Lambda invocation.
+
+A handler starts a trace, code anywhere below it wraps stages in `span()`
+and adds counts and properties, and the handler ends the trace. The timings
+are logged and written as one CloudWatch Embedded Metric Format (EMF) line,
+which CloudWatch turns into metrics without any API call.
+
+With METRICS_ENABLED=false every call is a no-op.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true") == "true"
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "InsuranceFillsService")
+
+# Create logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_current = threading.local()
+_cold_start = True
+_noop_span = nullcontext()
+
+
+class StageTimer:
+    """
+    Collects how long each stage of a request took, in milliseconds
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self._started = perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (perf_counter() - start) * 1000
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed_ms
+
+    def total_ms(self) -> float:
+        return (perf_counter() - self._started) * 1000
+
+    def log(self, handler_name: str):
+        stages = ", ".join(f"{name}={ms:.1f}ms" for name, ms in self.timings.items())
+        logger.info(f"{handler_name} timings: total={self.total_ms():.1f}ms, {stages}")
+
+
+class Trace(StageTimer):
+    """
+    Timings, counts and properties of one invocation of a handler
+    """
+
+    def __init__(self, handler_name: str, cold_start: bool):
+        super().__init__()
+        self.handler_name = handler_name
+        self.cold_start = cold_start
+        self.counts = {}
+        self.properties = {}
+
+    def add_count(self, name: str, value: int = 1) -> int:
+        self.counts[name] = self.counts.get(name, 0) + value
+        return self.counts[name]
+
+    def set_property(self, name: str, value):
+        self.properties[name] = value
+
+    def emf_record(self) -> dict:
+        """
+        The invocation as an EMF record: stage timings in milliseconds and
+        counts are metrics, properties are searchable in Logs Insights
+        """
+        metrics = [{"Name": "total", "Unit": "Milliseconds"}]
+        metrics += [{"Name": name, "Unit": "Milliseconds"} for name in self.timings]
+        metrics += [{"Name": name, "Unit": "Count"} for name in self.counts]
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": METRICS_NAMESPACE,
+                        "Dimensions": [["Handler"], ["Handler", "ColdStart"]],
+                        "Metrics": metrics,
+                    }
+                ],
+            },
+            "Handler": self.handler_name,
+            "ColdStart": str(self.cold_start).lower(),
+            "total": round(self.total_ms(), 3),
+        }
+        record.update(self.properties)
+        record.update({name: round(ms, 3) for name, ms in self.timings.items()})
+        record.update(self.counts)
+        return record
+
+
+class NoopTrace:
+    """
+    Stands in for Trace when metrics are disabled
+    """
+
+    def stage(self, name: str):
+        return _noop_span
+
+    def add_count(self, name: str, value: int = 1) -> int:
+        return 0
+
+    def set_property(self, name: str, value):
+        pass
+
+
+_noop_trace = NoopTrace()
+
+
+def start_trace(handler_name: str):
+    """
+    Function to start the trace of an invocation in the current thread
+    """
+    global _cold_start
+    if not METRICS_ENABLED:
+        return _noop_trace
+    trace = Trace(handler_name, _cold_start)
+    _cold_start = False
+    _current.trace = trace
+    return trace
+
+
+def current_trace():
+    """
+    Function to get the trace of the current invocation, a no-op if none
+    """
+    return getattr(_current, "trace", None) or _noop_trace
+
+
+def span(name: str):
+    """
+    Context manager timing a stage of the current invocation
+    """
+    return current_trace().stage(name)
+
+
+def add_count(name: str, value: int = 1) -> int:
+    """
+    Function to count an event in the current invocation
+    """
+    return current_trace().add_count(name, value)
+
+
+def set_property(name: str, value):
+    """
+    Function to attach a value to the record of the current invocation
+    """
+    current_trace().set_property(name, value)
+
+
+def end_trace():
+    """
+    Function to log the timings and write the EMF record of the invocation
+    """
+    trace = getattr(_current, "trace", None)
+    if trace is None:
+        return
+    _current.trace = None
+    trace.log(trace.handler_name)
+    # EMF records must be the whole log line, so they go to stdout directly
+    print(json.dumps(trace.emf_record(), default=str), flush=True)
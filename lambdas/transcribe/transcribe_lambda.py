@@ -0,0 +1,188 @@
+import base64
+import hashlib
+import json
+import logging
+import math
+from http import HTTPStatus
+
+from aws_resources import WARM_UP_ON_INIT, get_secret, secret_cache
+from idempotency import IDEMPOTENCY_KEY_HEADER, TURN_INDEX_HEADER
+from openai_client import (
+    OpenAIAuthenticationError,
+    OpenAIRateLimitError,
+    set_deadline,
+)
+from streaming import format_sse
+from tracing import add_count, end_trace, set_property, span, start_trace
+from transcription import get_transcriber
+from update_lambda import SECRET_KEY_OPENAI_KEY, lambda_update
+
+# Lambda takes at most 6MB of request, the audio arrives base64 encoded
+MAX_AUDIO_BYTES = 4 * 1024 * 1024
+
+# file name given to the engine, which tells the format from its extension
+AUDIO_FILENAMES = {
+    "audio/wav": "recording.wav",
+    "audio/x-wav": "recording.wav",
+    "audio/wave": "recording.wav",
+    "audio/mpeg": "recording.mp3",
+    "audio/mp4": "recording.m4a",
+    "audio/webm": "recording.webm",
+    "audio/ogg": "recording.ogg",
+}
+DEFAULT_AUDIO_FILENAME = "recording.wav"
+
+# Create logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class InvalidAudio(Exception):
+    """
+    Raised when the request has no audio, or too much of it
+    """
+
+    def __init__(self, message: str, status: HTTPStatus = HTTPStatus.BAD_REQUEST):
+        super().__init__(message)
+        self.status = status
+
+
+if WARM_UP_ON_INIT:
+    # a local model is loaded during the init phase, not by the first request
+    get_transcriber()
+
+
+def read_audio(event: dict) -> (bytes, str):
+    """
+    Function to read the audio of the request body and its file name
+    """
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        audio = base64.b64decode(body)
+    else:
+        audio = body.encode("latin-1")
+    if not audio:
+        raise InvalidAudio("The request has no audio")
+    if len(audio) > MAX_AUDIO_BYTES:
+        raise InvalidAudio(
+            f"The audio is larger than {MAX_AUDIO_BYTES} bytes",
+            HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+        )
+
+    headers = {
+        name.lower(): value for name, value in (event.get("headers") or {}).items()
+    }
+    content_type = headers.get("content-type", "").split(";")[0].strip()
+    return audio, AUDIO_FILENAMES.get(content_type, DEFAULT_AUDIO_FILENAME)
+
+
+def transcribe_audio(audio: bytes, filename: str) -> str:
+    """
+    Function to transcribe the audio with the engine of the container,
+    reloading the OpenAI key once if OpenAI rejects it
+    """
+    transcriber = get_transcriber()
+    if not transcriber.uses_openai_key:
+        return transcriber.transcribe(audio, filename)
+    try:
+        return transcriber.transcribe(
+            audio, filename, get_secret()[SECRET_KEY_OPENAI_KEY]
+        )
+    except OpenAIAuthenticationError:
+        # The key may have been rotated since it was cached
+        logger.info("OpenAI rejected the cached key, reloading the secret")
+        secret_cache.invalidate()
+        return transcriber.transcribe(
+            audio, filename, get_secret()[SECRET_KEY_OPENAI_KEY]
+        )
+
+
+def update_event(event: dict, audio: bytes, transcript: str) -> dict:
+    """
+    Function to build the lambda_update event of the transcribed turn
+    """
+    headers = {
+        name.lower(): value for name, value in (event.get("headers") or {}).items()
+    }
+    if headers.get(TURN_INDEX_HEADER) and not headers.get(IDEMPOTENCY_KEY_HEADER):
+        # a retry transcribed differently must still replay the first result
+        turn_index = headers[TURN_INDEX_HEADER]
+        digest = hashlib.sha256(audio).hexdigest()
+        headers[IDEMPOTENCY_KEY_HEADER] = f"audio-{turn_index}-{digest}"
+    return {
+        "pathParameters": event.get("pathParameters"),
+        "queryStringParameters": event.get("queryStringParameters"),
+        "headers": headers,
+        "body": json.dumps([{"role": "user", "content": transcript}]),
+    }
+
+
+def with_transcript(response: dict, transcript: str) -> dict:
+    """
+    Function to add the transcript to a successful lambda_update response
+    """
+    if response["statusCode"] != HTTPStatus.OK.value:
+        return response
+    if response["headers"]["content-type"] == "text/event-stream":
+        body = format_sse("transcript", {"text": transcript}) + response["body"]
+    else:
+        body = json.dumps(
+            dict(json.loads(response["body"]), transcript=transcript), indent=2
+        )
+    return dict(response, body=body)
+
+
+def lambda_transcribe(event, context) -> dict:
+    """
+    Lambda function to answer a turn given as audio.
+
+    The body is the recording (`Content-Type: audio/wav`, `audio/mpeg`, ...).
+    It is transcribed by the engine of the container, and the transcript is
+    answered as the user message of POST /form/{conversation_id}: the
+    response is the same, with the transcript added ("transcript" in JSON,
+    a first `transcript` event when streaming).
+    """
+    logger.info("lambda_transcribe Handler started")
+    set_deadline(context)
+    start_trace("lambda_transcribe")
+    try:
+        conversation_id = event.get("pathParameters")["conversation_id"]
+        set_property("conversation_id", conversation_id)
+        audio, filename = read_audio(event)
+        add_count("audio_bytes", len(audio))
+        with span(f"transcribe_{get_transcriber().name}"):
+            transcript = transcribe_audio(audio, filename)
+        logger.debug(f"transcript: {transcript}")
+        if not transcript:
+            raise InvalidAudio(
+                "No speech found in the audio", HTTPStatus.UNPROCESSABLE_ENTITY
+            )
+    except InvalidAudio as e:
+        response = {
+            "statusCode": e.status.value,
+            "body": str(e),
+            "headers": {"content-type": "text/plain"},
+        }
+    except OpenAIRateLimitError as e:
+        response = {
+            "statusCode": HTTPStatus.SERVICE_UNAVAILABLE.value,
+            "body": f"OpenAI rate limit reached: {e}",
+            "headers": {
+                "content-type": "text/plain",
+                "retry-after": str(math.ceil(e.retry_after or 1)),
+            },
+        }
+    except Exception as e:
+        response = {
+            "statusCode": HTTPStatus.INTERNAL_SERVER_ERROR.value,
+            "body": f"Exception={e}",
+            "headers": {"content-type": "text/plain"},
+        }
+    else:
+        # the turn itself is traced by lambda_update
+        end_trace()
+        response = lambda_update(update_event(event, audio, transcript), context)
+        return with_transcript(response, transcript)
+    set_property("status_code", response["statusCode"])
+    end_trace()
+    return response
@@ -0,0 +1,103 @@
+"""
+Speech to text engines of the transcription lambda.
+
+TRANSCRIBE_ENGINE selects the engine:
+- "openai": the OpenAI audio transcriptions API (whisper-1)
+- "local": a faster-whisper (CTranslate2) model on the CPU of the container,
+  loaded once per container and baked into the image at build time
+"""
+import logging
+import os
+from io import BytesIO
+
+from openai_client import get_session, raise_for_openai_status, request_timeout
+from providers import OPENAI_API_BASE
+
+TRANSCRIBE_ENGINE = os.environ.get("TRANSCRIBE_ENGINE", "openai")
+TRANSCRIBE_MODEL = os.environ.get("TRANSCRIBE_MODEL", "whisper-1")
+# the questionnaire is in English, which also skips language detection
+TRANSCRIBE_LANGUAGE = "en"
+
+# faster-whisper model, in the image under WHISPER_MODEL_DIR
+WHISPER_MODEL = os.environ.get("WHISPER_MODEL", "base.en")
+WHISPER_MODEL_DIR = os.environ.get("WHISPER_MODEL_DIR", "/opt/whisper")
+# int8 weights: about 4x less memory than float32 and faster on CPU
+WHISPER_COMPUTE_TYPE = os.environ.get("WHISPER_COMPUTE_TYPE", "int8")
+
+# Create logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class OpenAITranscriber:
+    """
+    OpenAI audio transcriptions API
+    """
+
+    name = "openai"
+    uses_openai_key = True
+
+    def transcribe(self, audio: bytes, filename: str, openai_key: str = None) -> str:
+        response = get_session().post(
+            f"{OPENAI_API_BASE}/audio/transcriptions",
+            headers={"Authorization": "Bearer " + openai_key},
+            files={"file": (filename, audio)},
+            data={
+                "model": TRANSCRIBE_MODEL,
+                "language": TRANSCRIBE_LANGUAGE,
+                "response_format": "json",
+            },
+            timeout=request_timeout(),
+        )
+        raise_for_openai_status(response.status_code, response.headers, response.text)
+        return response.json()["text"].strip()
+
+
+class LocalWhisperTranscriber:
+    """
+    faster-whisper on the CPU, the model is loaded when the engine is created
+    """
+
+    name = "local"
+    uses_openai_key = False
+
+    def __init__(self, model_name: str = WHISPER_MODEL):
+        # only installed in images built with TRANSCRIBE_ENGINE=local
+        from faster_whisper import WhisperModel
+
+        self.model = WhisperModel(
+            model_name,
+            device="cpu",
+            compute_type=WHISPER_COMPUTE_TYPE,
+            download_root=WHISPER_MODEL_DIR,
+            cpu_threads=os.cpu_count() or 1,
+        )
+
+    def transcribe(self, audio: bytes, filename: str, openai_key: str = None) -> str:
+        # greedy decoding, and silence skipped by the voice activity filter
+        segments, _ = self.model.transcribe(
+            BytesIO(audio),
+            language=TRANSCRIBE_LANGUAGE,
+            beam_size=1,
+            vad_filter=True,
+        )
+        return " ".join(segment.text.strip() for segment in segments).strip()
+
+
+TRANSCRIBER_CLASSES = {
+    transcriber_class.name: transcriber_class
+    for transcriber_class in (OpenAITranscriber, LocalWhisperTranscriber)
+}
+
+_transcriber = None
+
+
+def get_transcriber():
+    """
+    Function to get the engine of TRANSCRIBE_ENGINE, created once per container
+    """
+    global _transcriber
+    if _transcriber is None:
+        logger.info(f"Loading the {TRANSCRIBE_ENGINE} transcription engine")
+        _transcriber = TRANSCRIBER_CLASSES[TRANSCRIBE_ENGINE]()
+    return _transcriber
@@ -0,0 +1,248 @@
+"""
+Offline filling of forms from free-text claims, e.g. emails or call
+transcripts, instead of the turn-by-turn chat of lambda_update.
+
+Every record of a JSONL file, {"id": ..., "text": ...}, is sent to the model
+once with the functions of the chat. A complete and valid form is stored in
+FilledFormsTable under `claim#<id of the record>`, apart from the
+conversation_ids of the chat, with BatchWriteItem. Otherwise
+the record is reported with the follow-up question the model would ask.
+
+At most `concurrency` records are sent to OpenAI at a time. A 429 that
+outlasts the retries of chat_completion_request pauses every worker for the
+delay OpenAI asked for, then the record is tried again.
+
+The report is also the checkpoint: a record is appended to it once its form
+is stored, and records reported as filled or needing a follow-up question
+are skipped when the same report is used again. Failed records are retried.
+"""
+import asyncio
+import json
+import logging
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, perf_counter
+
+from aws_resources import get_dynamodb_table
+from form_schema import build_system_prompt
+from openai_client import OpenAIRateLimitError, set_deadline
+from update_lambda import ask_model, check_filled_form, form_item, merge_model_state
+
+DEFAULT_CONCURRENCY = 8
+# Most items DynamoDB accepts in one BatchWriteItem call
+WRITE_BATCH_SIZE = 25
+# Attempts of a record that keeps being rate limited
+MAX_RECORD_ATTEMPTS = 5
+# Pause when a 429 does not say how long to wait, multiplied by the attempt
+RATE_LIMIT_PAUSE_SECONDS = 5
+
+SYSTEM_PROMPT = build_system_prompt() + (
+    "\nThe user message is a complete email or call transcript, not a chat: "
+    "take every answer from it, and if one is missing or invalid call "
+    "ask_follow_up_question for it."
+)
+
+# Prefix of the FilledFormsTable keys of claims, conversation_ids of the chat
+# never contain "#"
+CLAIM_KEY_PREFIX = "claim#"
+
+# Statuses of records that are not processed again
+FINAL_STATUSES = ("filled", "follow_up")
+
+# Create logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class RateLimitGate:
+    """
+    Holds every worker back while OpenAI asks to slow down
+    """
+
+    def __init__(self):
+        self._resume_at = 0.0
+
+    def pause(self, seconds: float):
+        self._resume_at = max(self._resume_at, monotonic() + seconds)
+
+    async def wait(self):
+        delay = self._resume_at - monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._resume_at - monotonic()
+
+
+def read_records(path: str) -> list:
+    """
+    Function to read the claims of a JSONL file
+    """
+    with open(path) as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    for record in records:
+        if "id" not in record or not record.get("text"):
+            raise ValueError(f"Record without id or text: {record}")
+    return records
+
+
+def load_checkpoint(report_path: str) -> set:
+    """
+    Function to get the ids of the records already processed
+    """
+    if not os.path.exists(report_path):
+        return set()
+    done = set()
+    with open(report_path) as file:
+        for line in file:
+            row = json.loads(line)
+            if row["status"] in FINAL_STATUSES:
+                done.add(row["id"])
+    return done
+
+
+def extract_form(text: str) -> dict:
+    """
+    Function to fill the form from one claim with a single model call
+    """
+    chat_history = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": text},
+    ]
+    is_finished, value, usage, model_state = ask_model(chat_history, None)
+    state = merge_model_state({}, model_state)
+    if is_finished:
+        is_finished, value, state = check_filled_form(value, state)
+    if is_finished:
+        return {"status": "filled", "form": value, "usage": usage}
+    return {
+        "status": "follow_up",
+        "next_question": value,
+        "pending_field": state["pending_field"],
+        "collected_answers": state["answers"],
+        "usage": usage,
+    }
+
+
+def claim_key(record_id: str) -> str:
+    """
+    Function to get the FilledFormsTable key of the form of a claim
+    """
+    return f"{CLAIM_KEY_PREFIX}{record_id}"
+
+
+def write_forms(table_name: str, items: list):
+    """
+    Function to store forms with BatchWriteItem, retrying unprocessed items
+    """
+    table = get_dynamodb_table(table_name)
+    with table.batch_writer(overwrite_by_pkeys=["conversation_id"]) as writer:
+        for item in items:
+            writer.put_item(Item=item)
+
+
+class BatchProcessor:
+    """
+    Fills the forms of many claims concurrently and reports the result
+    of each one
+    """
+
+    def __init__(
+        self,
+        forms_table_name: str,
+        report_path: str,
+        concurrency: int = DEFAULT_CONCURRENCY,
+    ):
+        self.forms_table_name = forms_table_name
+        self.report_path = report_path
+        self.concurrency = concurrency
+        self.counts = Counter()
+        self.follow_up_ids = []
+        self._gate = RateLimitGate()
+        self._pending = []
+        self._report = None
+
+    def run(self, records: list) -> dict:
+        """
+        Processes the records not in the report yet, returns a summary
+        """
+        # no Lambda deadline, requests get the default timeouts
+        set_deadline(None)
+        done = load_checkpoint(self.report_path)
+        todo = [record for record in records if str(record["id"]) not in done]
+        self.counts["skipped"] = len(records) - len(todo)
+        logger.info(f"{len(todo)} records to process, {len(done)} already done")
+
+        start = perf_counter()
+        with open(self.report_path, "a") as self._report:
+            asyncio.run(self._process_all(todo))
+        elapsed = perf_counter() - start
+
+        processed = len(todo)
+        return {
+            "processed": processed,
+            "seconds": round(elapsed, 2),
+            "records_per_minute": round(processed / elapsed * 60, 1) if elapsed else 0,
+            "follow_up_ids": self.follow_up_ids,
+            **self.counts,
+        }
+
+    async def _process_all(self, records: list):
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(self.concurrency)
+        )
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(self._process(record, semaphore) for record in records))
+        await self._flush()
+
+    async def _process(self, record: dict, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            result = await self._extract(record)
+        await self._save(record, result)
+
+    async def _extract(self, record: dict) -> dict:
+        for attempt in range(1, MAX_RECORD_ATTEMPTS + 1):
+            await self._gate.wait()
+            try:
+                return await asyncio.to_thread(extract_form, record["text"])
+            except OpenAIRateLimitError as e:
+                self.counts["rate_limited"] += 1
+                pause = e.retry_after or RATE_LIMIT_PAUSE_SECONDS * attempt
+                logger.info(f"Rate limited, pausing every worker for {pause:.2f}s")
+                self._gate.pause(pause)
+            except Exception as e:
+                logger.warning(f"Record {record['id']} failed: {e!r}")
+                return {"status": "failed", "error": repr(e)}
+        return {"status": "failed", "error": "Rate limited on every attempt"}
+
+    async def _save(self, record: dict, result: dict):
+        record_id = str(record["id"])
+        usage = result.pop("usage", None) or {}
+        self.counts[result["status"]] += 1
+        self.counts["prompt_tokens"] += usage.get("prompt_tokens", 0)
+        self.counts["completion_tokens"] += usage.get("completion_tokens", 0)
+
+        row = {"id": record_id, **result}
+        if result["status"] != "filled":
+            if result["status"] == "follow_up":
+                self.follow_up_ids.append(record_id)
+            self._write_rows([row])
+            return
+
+        # checkpointed only once the form is stored
+        row["form"] = form_item(result["form"], claim_key(record_id))
+        self._pending.append(row)
+        if len(self._pending) >= WRITE_BATCH_SIZE:
+            await self._flush()
+
+    async def _flush(self):
+        rows, self._pending = self._pending, []
+        if not rows:
+            return
+        items = [row["form"] for row in rows]
+        await asyncio.to_thread(write_forms, self.forms_table_name, items)
+        self._write_rows(rows)
+
+    def _write_rows(self, rows: list):
+        for row in rows:
+            self._report.write(json.dumps(row, default=str) + "\n")
+        self._report.flush()
@@ -0,0 +1,153 @@
+"""
+Typed chat completion responses, parsed once, and the turn they describe.
+
+Function call arguments that are not valid JSON are repaired when the damage
+is only around the values (code fences, text around the object, trailing
+commas). Anything else, e.g. an object cut off by the token limit, would
+give a wrong question or answer, so the response is malformed and the
+caller can ask again.
+"""
+import json
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from tracing import add_count
+
+SAVE_FUNCTION = "save_users_questionnaire"
+FOLLOW_UP_FUNCTION = "ask_follow_up_question"
+
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+class MalformedModelOutput(Exception):
+    """
+    Raised when a response is neither a question nor a valid function call
+    """
+
+
+@dataclass(frozen=True)
+class FunctionCall:
+    name: str
+    arguments: str
+
+
+@dataclass(frozen=True)
+class ChatResult:
+    """
+    One chat completion, from a plain or a streamed response
+    """
+
+    model: str
+    content: Optional[str]
+    function_call: Optional[FunctionCall]
+    finish_reason: Optional[str]
+    prompt_tokens: int
+    completion_tokens: int
+
+    @classmethod
+    def from_message(
+        cls,
+        message: dict,
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        finish_reason: str = None,
+    ) -> "ChatResult":
+        function_call = message.get("function_call")
+        if function_call is not None:
+            function_call = FunctionCall(
+                function_call.get("name"), function_call.get("arguments") or ""
+            )
+        return cls(
+            model,
+            message.get("content"),
+            function_call,
+            finish_reason,
+            prompt_tokens,
+            completion_tokens,
+        )
+
+    @classmethod
+    def from_json(cls, body: dict, model: str) -> "ChatResult":
+        """
+        Builds the result of the JSON body of a chat completions response
+        """
+        try:
+            choice = body["choices"][0]
+            message = choice["message"]
+        except (KeyError, IndexError, TypeError) as e:
+            add_count("malformed_response")
+            raise MalformedModelOutput(f"No message in the response: {body}") from e
+        usage = body.get("usage") or {}
+        return cls.from_message(
+            message,
+            body.get("model", model),
+            usage.get("prompt_tokens", 0),
+            usage.get("completion_tokens", 0),
+            choice.get("finish_reason"),
+        )
+
+    def turn(self) -> (bool, object, dict):
+        """
+        Returns (is_finished, filled form or next question, form state)
+        """
+        if self.content is not None and self.function_call is None:
+            return False, self.content, {}
+        if self.function_call is None:
+            add_count("unexpected_model_output")
+            raise MalformedModelOutput("Neither content nor function call")
+
+        arguments = parse_arguments(self.function_call.arguments)
+        if self.function_call.name == SAVE_FUNCTION:
+            return True, arguments, {}
+        if self.function_call.name == FOLLOW_UP_FUNCTION:
+            next_question = arguments.get("next_question")
+            if not isinstance(next_question, str) or not next_question:
+                add_count("unexpected_model_output")
+                raise MalformedModelOutput("Follow-up question without a question")
+            state = {
+                "pending_field": arguments.get("pending_field"),
+                "collected_answers": arguments.get("collected_answers"),
+            }
+            return False, next_question, state
+
+        add_count("unexpected_model_output")
+        raise MalformedModelOutput(f"Unknown function: {self.function_call.name}")
+
+
+def repair_json(text: str) -> dict:
+    """
+    Function to read JSON arguments wrapped in text or with trailing commas,
+    None if they cannot be repaired
+    """
+    text = CODE_FENCE.sub("", text.strip())
+    start = text.find("{")
+    end = text.rfind("}")
+    if start < 0 or end < start:
+        return None
+    try:
+        value = json.loads(TRAILING_COMMA.sub(r"\1", text[start : end + 1]))
+    except json.JSONDecodeError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def parse_arguments(arguments: str) -> dict:
+    """
+    Function to read the arguments of a function call, repaired if needed
+    """
+    try:
+        value = json.loads(arguments)
+        if isinstance(value, dict):
+            return value
+    except json.JSONDecodeError:
+        pass
+
+    add_count("malformed_function_call")
+    value = repair_json(arguments)
+    if value is None:
+        raise MalformedModelOutput(f"Invalid function call arguments: {arguments}")
+    add_count("malformed_function_call_repaired")
+    return value
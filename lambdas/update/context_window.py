@@ -0,0 +1,141 @@
+"""
+Keeps the prompt sent to the model within a token budget.
+
+The prompt always starts with the system prompt and ends with the most
+recent messages. Older messages that do not fit are replaced by one short
+system message listing the questions and answers collected in them.
+"""
+import json
+import logging
+import os
+
+# Token budget for messages and function definitions of one request
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "3000"))
+# Number of most recent messages that are kept if they fit the budget
+KEEP_LAST_MESSAGES = int(os.environ.get("KEEP_LAST_MESSAGES", "12"))
+# Longest answer quoted in the summary of older messages
+SUMMARY_MAX_CHARS = 200
+# Keep fewer recent messages rather than leave the summary less than this
+MIN_SUMMARY_TOKENS = 100
+
+# Overhead of chat formatting, see the OpenAI cookbook on counting tokens
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+SUMMARY_HEADER = "Answers collected so far (earlier messages are omitted):"
+
+# Create logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_encodings = {}
+
+
+def _encoding(model: str):
+    """
+    Function to get the tiktoken encoding of a model, None without tiktoken
+    """
+    if model not in _encodings:
+        try:
+            import tiktoken
+
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            logger.warning("tiktoken is not installed, estimating token counts")
+            _encodings[model] = None
+    return _encodings[model]
+
+
+def count_text_tokens(text: str, model: str) -> int:
+    """
+    Function to count the tokens of a text
+    """
+    encoding = _encoding(model)
+    if encoding is None:
+        # about 4 characters per token for English text
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+def count_message_tokens(message: dict, model: str) -> int:
+    return TOKENS_PER_MESSAGE + sum(
+        count_text_tokens(value, model)
+        for value in message.values()
+        if isinstance(value, str)
+    )
+
+
+def count_prompt_tokens(messages: list, model: str, functions: list = None) -> int:
+    """
+    Function to count the tokens of a chat completion request
+    """
+    tokens = TOKENS_PER_REPLY
+    tokens += sum(count_message_tokens(message, model) for message in messages)
+    if functions:
+        tokens += count_text_tokens(json.dumps(functions), model)
+    return tokens
+
+
+def summarize_messages(messages: list, model: str, max_tokens: int) -> dict:
+    """
+    Function to replace messages by a system message with the answers in them.
+    The most recent answers are kept when they do not all fit max_tokens.
+    """
+    pairs = []
+    question = None
+    for message in messages:
+        content = (message.get("content") or "")[:SUMMARY_MAX_CHARS]
+        if message["role"] == "assistant":
+            question = content
+        elif message["role"] == "user":
+            pair = f"Q: {question}\nA: {content}" if question else f"A: {content}"
+            pairs.append(pair)
+            question = None
+
+    tokens = count_message_tokens({"content": SUMMARY_HEADER}, model)
+    lines = []
+    for pair in reversed(pairs):
+        tokens += count_text_tokens(pair, model) + 1
+        if tokens > max_tokens:
+            break
+        lines.insert(0, pair)
+    return {"role": "system", "content": "\n".join([SUMMARY_HEADER] + lines)}
+
+
+def fit_to_budget(
+    messages: list,
+    model: str,
+    functions: list = None,
+    budget: int = PROMPT_TOKEN_BUDGET,
+    keep_last: int = KEEP_LAST_MESSAGES,
+) -> list:
+    """
+    Function to get the messages to send so the request fits the budget
+    """
+    if count_prompt_tokens(messages, model, functions) <= budget:
+        return messages
+
+    system = [m for m in messages[:1] if m["role"] == "system"]
+    history = messages[len(system) :]
+    fixed_tokens = count_prompt_tokens(system, model, functions)
+
+    # keep as many recent messages as fit, the summary gets the rest
+    keep = min(keep_last, len(history))
+    while True:
+        recent = history[len(history) - keep :]
+        recent_tokens = sum(count_message_tokens(m, model) for m in recent)
+        summary_budget = budget - fixed_tokens - recent_tokens
+        if summary_budget >= MIN_SUMMARY_TOKENS or keep <= 1:
+            break
+        keep -= 1
+
+    summary = summarize_messages(history[: len(history) - keep], model, summary_budget)
+    tokens = fixed_tokens + recent_tokens + count_message_tokens(summary, model)
+    logger.info(
+        f"Prompt compacted from {len(messages)} to {len(system) + 1 + keep} "
+        f"messages, about {tokens} tokens"
+    )
+    return system + [summary] + recent
@@ -0,0 +1,94 @@
+"""
+Rule-based fast path for replies that can be validated without the model.
+
+The conversation item keeps the answers collected so far and the field the
+last question asked about. When the user reply is a clean answer to that
+field (a single name, an allowed insurance type, a phone number, an integer
+age) it is stored, and the next question comes from a template. Anything
+ambiguous is left to the model.
+"""
+from form_schema import FIELD_QUESTIONS, FIELDS_BY_NAME, parse_field, plain_value
+
+# A reply with several words may be a sentence around the name
+SINGLE_WORD_FIELDS = ("first_name", "last_name")
+
+# Single words that match NAME_PATTERN but are a reply rather than a name,
+# left to the model
+NOT_NAMES = frozenset(
+    (
+        "no nope nah yes yeah yep yup ok okay sure fine hi hello hey why what "
+        "who how when where which huh hmm um uh thanks thank please sorry help "
+        "stop wait skip pass later none nothing idk dunno name insurance"
+    ).split()
+)
+
+
+def parse_clear_answer(field: str, reply: str):
+    """
+    Function to get the value of a field from a reply, None if it is not clear
+    """
+    if field in SINGLE_WORD_FIELDS:
+        if len(reply.split()) != 1:
+            return None
+        value = parse_field(field, reply)
+        if value is None or value.lower() in NOT_NAMES:
+            return None
+        return value
+    return parse_field(field, reply)
+
+
+def next_missing_field(answers: dict):
+    """
+    Function to get the next field without an answer, None if all are filled
+    """
+    for field in FIELD_QUESTIONS:
+        if field not in answers:
+            return field
+    return None
+
+
+def stored_answers(answers: dict) -> dict:
+    """
+    Function to convert answers read from DynamoDB back to plain values
+    """
+    return {field: plain_value(value) for field, value in answers.items()}
+
+
+def merge_model_answers(answers: dict, collected_answers: dict) -> dict:
+    """
+    Function to add the answers reported by the model that pass validation.
+    They replace stored answers, the model sees the corrections of the user.
+    """
+    merged = stored_answers(answers)
+    for field, value in (collected_answers or {}).items():
+        if field in FIELDS_BY_NAME:
+            parsed = parse_field(field, value)
+            if parsed is not None:
+                merged[field] = parsed
+    return merged
+
+
+def try_local_turn(state: dict, additional_conversation: list):
+    """
+    Function to answer a turn without the model.
+    Returns (is_finished, next question or filled form, new state),
+    or None when the reply has to go to the model.
+    """
+    pending_field = state.get("pending_field")
+    if pending_field not in FIELDS_BY_NAME or len(additional_conversation) != 1:
+        return None
+    message = additional_conversation[0]
+    if message.get("role") != "user" or not isinstance(message.get("content"), str):
+        return None
+
+    value = parse_clear_answer(pending_field, message["content"])
+    if value is None:
+        return None
+
+    answers = stored_answers(state.get("answers", {}))
+    answers[pending_field] = value
+    next_field = next_missing_field(answers)
+    new_state = {"answers": answers, "pending_field": next_field}
+    if next_field is None:
+        return True, answers, new_state
+    return False, FIELD_QUESTIONS[next_field], new_state
@@ -0,0 +1,49 @@
+"""
+Choice of the OpenAI model for a turn, and per-model metrics.
+
+Most turns only ask the next question, which a small model does well. The
+strong model is asked when the small one wants to save the form, to confirm
+it, when the small one returns a malformed function call, and on the turns
+after a form failed validation.
+"""
+import os
+
+from openai_client import GPT_MODEL
+from tracing import add_count
+
+# Models of each stage, set per stage in the CDK stack
+FOLLOW_UP_MODEL = os.environ.get("FOLLOW_UP_MODEL", "gpt-3.5-turbo-0613")
+EXTRACTION_MODEL = os.environ.get("EXTRACTION_MODEL", GPT_MODEL)
+
+# USD per 1K prompt and completion tokens
+MODEL_PRICES = {
+    "gpt-4-0613": (0.03, 0.06),
+    "gpt-4-1106-preview": (0.01, 0.03),
+    "gpt-3.5-turbo-0613": (0.0015, 0.002),
+    "gpt-3.5-turbo-1106": (0.001, 0.002),
+}
+
+
+def cost_usd(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """
+    Function to estimate the price of a completion, None for unknown models
+    """
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    prompt_price, completion_price = prices
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+def record_model_call(model: str, prompt_tokens: int, completion_tokens: int):
+    """
+    Function to add the tokens and the cost of a completion to the metrics
+    of its model. Latency is recorded by the `openai_{model}` span.
+    """
+    add_count(f"{model}_calls")
+    add_count(f"{model}_prompt_tokens", prompt_tokens)
+    add_count(f"{model}_completion_tokens", completion_tokens)
+    cost = cost_usd(model, prompt_tokens, completion_tokens)
+    if cost is not None:
+        # counts are integers, the cost is in millionths of a dollar
+        add_count(f"{model}_cost_micro_usd", round(cost * 1_000_000))
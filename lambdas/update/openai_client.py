@@ -0,0 +1,359 @@
+"""
+HTTP client for the OpenAI chat completions API.
+
+One keep-alive session is created per thread of the container (a
+requests.Session is not thread-safe) and reused by every warm invocation and
+every retry. Timeouts are derived from the time the
+Lambda has left, and 429 responses are retried after the delay requested by
+OpenAI in `Retry-After`. Requests first wait for the client-side rate limit
+of rate_limiter.py; a wait longer than the time left fails the request at
+once instead of sleeping past the deadline.
+
+With a second provider in OPENAI_PROVIDERS (see providers.py) each attempt
+is hedged: when the first provider has not answered within its p95 latency
+for the model, or failed, the request is also sent to the second one and
+the first answer is used.
+"""
+import logging
+import os
+import random
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from http import HTTPStatus
+from time import monotonic, perf_counter
+
+import requests
+from requests.adapters import HTTPAdapter
+from tenacity import retry, retry_if_exception_type, stop_after_attempt
+
+from context_window import count_prompt_tokens
+from providers import get_providers
+from rate_limiter import get_rate_limiter
+from tracing import add_count, span
+
+# OpenAI GPT model
+GPT_MODEL = "gpt-4-0613"
+
+# Timeouts in seconds
+CONNECT_TIMEOUT_SECONDS = 3.05
+# Read timeout when the request is not made from a Lambda invocation
+DEFAULT_READ_TIMEOUT_SECONDS = 60
+# Time kept after the OpenAI call to store the turn and respond
+DEADLINE_MARGIN_SECONDS = 2
+# Do not start an attempt with less time than this
+MIN_ATTEMPT_SECONDS = 3
+
+MAX_ATTEMPTS = 3
+POOL_MAXSIZE = 10
+
+# The second provider is asked when the first is slower than this percentile
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "0.95"))
+# Requests of the first provider needed before its percentile is used
+HEDGE_MIN_SAMPLES = 20
+# Hedging delay until then
+HEDGE_DEFAULT_SECONDS = float(os.environ.get("HEDGE_DEFAULT_SECONDS", "10"))
+
+# Create logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class OpenAIAuthenticationError(Exception):
+    """
+    Raised when OpenAI rejects the API key
+    """
+
+
+class OpenAIRateLimitError(Exception):
+    """
+    Raised on 429 responses, with the delay requested by OpenAI if any
+    """
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class OpenAIServerError(Exception):
+    """
+    Raised on 5xx responses
+    """
+
+
+class OpenAIRequestError(Exception):
+    """
+    Raised on other 4xx responses, which the same request would get again
+    """
+
+
+# Errors of an attempt that the next attempt may not get. Authentication
+# and request errors are fatal and raised at once.
+RETRYABLE_ERRORS = (
+    OpenAIRateLimitError,
+    OpenAIServerError,
+    requests.ConnectionError,
+    requests.Timeout,
+)
+
+# requests.Session is not thread-safe: one per thread, e.g. of the hedging
+# executor or of the batch workers
+_sessions = threading.local()
+_deadline = None
+# requests to the providers, so an attempt can wait for the first answer
+_hedge_executor = ThreadPoolExecutor(POOL_MAXSIZE)
+
+
+def get_session() -> requests.Session:
+    """
+    Function to get the keep-alive session of the thread, created once per
+    thread of the container
+    """
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=POOL_MAXSIZE, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _sessions.session = session
+    return session
+
+
+def preconnect():
+    """
+    Function to open the keep-alive connections to the providers before the
+    first request, so the TLS handshakes happen during the init phase.
+    Only the session of the calling thread is warmed, the one that sends
+    the requests when there is a single provider.
+    """
+    for provider in get_providers():
+        try:
+            get_session().head(
+                provider.base_url, timeout=CONNECT_TIMEOUT_SECONDS
+            ).close()
+        except requests.RequestException as e:
+            logger.warning(f"Could not connect to {provider.base_url}: {e}")
+
+
+def set_deadline(context) -> None:
+    """
+    Function to bound OpenAI calls by the time the invocation has left.
+    Without a Lambda context (scripts, batch jobs) there is no deadline.
+    """
+    global _deadline
+    if context is None:
+        _deadline = None
+        return
+    remaining_seconds = context.get_remaining_time_in_millis() / 1000
+    _deadline = monotonic() + remaining_seconds - DEADLINE_MARGIN_SECONDS
+
+
+def remaining_seconds() -> float:
+    """
+    Function to get the time left for OpenAI calls, None if unbounded
+    """
+    if _deadline is None:
+        return None
+    return _deadline - monotonic()
+
+
+def request_timeout() -> (float, float):
+    """
+    Function to get (connect, read) timeouts for the next attempt
+    """
+    remaining = remaining_seconds()
+    if remaining is None:
+        return CONNECT_TIMEOUT_SECONDS, DEFAULT_READ_TIMEOUT_SECONDS
+    remaining = max(remaining, 0.1)
+    return min(CONNECT_TIMEOUT_SECONDS, remaining), remaining
+
+
+def parse_retry_after(headers) -> float:
+    """
+    Function to read the delay requested in `retry-after-ms` or `Retry-After`
+    """
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after") is not None:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def raise_for_openai_status(status_code: int, headers, text: str):
+    """
+    Function to turn every error response into an exception
+    """
+    if status_code == HTTPStatus.UNAUTHORIZED:
+        raise OpenAIAuthenticationError(text)
+    if status_code == HTTPStatus.TOO_MANY_REQUESTS:
+        raise OpenAIRateLimitError(text, parse_retry_after(headers))
+    if status_code >= HTTPStatus.INTERNAL_SERVER_ERROR:
+        raise OpenAIServerError(text)
+    if status_code >= HTTPStatus.BAD_REQUEST:
+        raise OpenAIRequestError(f"{status_code}: {text}")
+
+
+def wait_retry_after(retry_state) -> float:
+    """
+    Waits as long as OpenAI asked for, otherwise random exponential backoff
+    """
+    error = retry_state.outcome.exception()
+    add_count(f"openai_retry_{type(error).__name__}")
+    wait = getattr(error, "retry_after", None)
+    if wait is None:
+        wait = random.uniform(0, min(40, 2**retry_state.attempt_number))
+
+    remaining = remaining_seconds()
+    if remaining is not None:
+        wait = max(0, min(wait, remaining - MIN_ATTEMPT_SECONDS))
+    logger.info(f"Retrying OpenAI request in {wait:.2f}s after: {error!r}")
+    return wait
+
+
+def stop_before_deadline(retry_state) -> bool:
+    """
+    Stops when the requested delay would not leave time for another attempt
+    """
+    remaining = remaining_seconds()
+    if remaining is None:
+        return False
+    error = retry_state.outcome.exception()
+    retry_after = getattr(error, "retry_after", None) or 0
+    return remaining - retry_after < MIN_ATTEMPT_SECONDS
+
+
+def acquire_rate_limit(messages: list, functions: list, model: str):
+    """
+    Function to wait for the client-side rate limit. A wait that does not fit
+    in the time left is raised as a 429, so tenacity sleeps only when there
+    is time for another attempt.
+    """
+    rate_limiter = get_rate_limiter(model)
+    tokens = 0
+    if rate_limiter.tokens_per_minute:
+        tokens = count_prompt_tokens(messages, model, functions)
+    wait = rate_limiter.reserve(tokens)
+    if wait > 0:
+        add_count("openai_client_throttled")
+        raise OpenAIRateLimitError(
+            f"Client-side rate limit of {model} for {wait:.2f}s", wait
+        )
+
+
+def _request_json(messages: list, functions: list, model: str, stream: bool) -> dict:
+    json_data = {"model": model, "messages": messages}
+    if functions is not None:
+        json_data.update({"functions": functions})
+    if stream:
+        json_data.update({"stream": True})
+    return json_data
+
+
+def _post(
+    provider,
+    messages: list,
+    openai_key: str,
+    functions: list,
+    model: str,
+    stream: bool,
+) -> requests.Response:
+    """
+    Function to send the request to one provider and record its latency
+    """
+    start = perf_counter()
+    response = get_session().post(
+        provider.url(model),
+        headers=provider.headers(openai_key),
+        json=_request_json(messages, functions, provider.model(model), stream),
+        stream=stream,
+        timeout=request_timeout(),
+    )
+    if provider is get_providers()[0]:
+        # the client-side limit is the one of the first provider
+        get_rate_limiter(model).observe(
+            response.status_code, response.headers, parse_retry_after(response.headers)
+        )
+    if not response.ok:
+        # release the connection back to the pool before raising
+        text = response.text
+        response.close()
+        raise_for_openai_status(response.status_code, response.headers, text)
+    # time to the first byte, streamed responses are still being read
+    provider.histogram(model).record((perf_counter() - start) * 1000)
+    response.provider = provider.name
+    return response
+
+
+def hedge_delay(provider, model: str) -> float:
+    """
+    Function to get how long to wait for a provider answering `model`
+    before hedging
+    """
+    histogram = provider.histogram(model)
+    if histogram.total < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_SECONDS
+    return histogram.percentile(HEDGE_PERCENTILE) / 1000
+
+
+def _close_response(future):
+    if future.exception() is None:
+        future.result().close()
+
+
+def hedged_post(
+    messages: list, openai_key: str, functions: list, model: str, stream: bool
+) -> requests.Response:
+    """
+    Function to send the request to the first provider, and to the second
+    one as well if the first is slow or fails. Returns the first response;
+    the other one is closed when it arrives.
+    """
+    providers = get_providers()
+    arguments = (messages, openai_key, functions, model, stream)
+    if len(providers) == 1:
+        return _post(providers[0], *arguments)
+
+    futures = [_hedge_executor.submit(_post, providers[0], *arguments)]
+    done, _ = wait(futures, timeout=hedge_delay(providers[0], model))
+    if not done or futures[0].exception() is not None:
+        add_count("openai_hedged" if not done else "openai_failover")
+        futures.append(_hedge_executor.submit(_post, providers[1], *arguments))
+
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                continue
+            for other in pending:
+                other.add_done_callback(_close_response)
+            response = future.result()
+            add_count(f"openai_provider_{response.provider}")
+            return response
+    # the error of the first provider, e.g. a 429 with its Retry-After
+    raise futures[0].exception()
+
+
+@retry(
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    wait=wait_retry_after,
+    stop=stop_after_attempt(MAX_ATTEMPTS) | stop_before_deadline,
+    reraise=True,
+)
+def chat_completion_request(
+    messages: list,
+    openai_key: str,
+    functions: list = None,
+    model: str = GPT_MODEL,
+    stream: bool = False,
+) -> requests.Response:
+    """
+    Sends a request to the OpenAI GPT model for chat completions.
+    With stream=True the response body is read as server-sent events.
+    """
+    acquire_rate_limit(messages, functions, model)
+    attempt = add_count("openai_attempts")
+    with span(f"openai_attempt_{attempt}"):
+        return hedged_post(messages, openai_key, functions, model, stream)
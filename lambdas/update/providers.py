@@ -0,0 +1,193 @@
+"""
+OpenAI compatible chat completion providers and their latency.
+
+OPENAI_PROVIDERS lists the providers in order of preference, e.g.
+"openai,azure". The first one gets every request; openai_client sends the
+same request to the second one when the first has not answered within its
+usual latency, or failed, and takes the first answer (a hedged request).
+
+The latency of each provider is kept in an in-memory histogram of the
+container, which is where the hedging threshold comes from.
+"""
+import bisect
+import logging
+import os
+import threading
+
+from aws_resources import get_secret
+
+# Providers in order of preference: openai, azure or local
+OPENAI_PROVIDERS = [
+    name.strip()
+    for name in os.environ.get("OPENAI_PROVIDERS", "openai").split(",")
+    if name.strip()
+]
+
+# Can point to any OpenAI compatible server, e.g. benchmarks/fake_openai.py
+OPENAI_API_BASE = os.environ.get("OPENAI_API_BASE", "https://api.openai.com/v1")
+
+AZURE_OPENAI_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT", "")
+AZURE_OPENAI_API_VERSION = os.environ.get(
+    "AZURE_OPENAI_API_VERSION", "2023-07-01-preview"
+)
+# Deployment of each model, e.g. "gpt-4-0613=gpt-4,gpt-3.5-turbo-0613=gpt-35-turbo"
+AZURE_OPENAI_DEPLOYMENTS = dict(
+    pair.strip().split("=", 1)
+    for pair in os.environ.get("AZURE_OPENAI_DEPLOYMENTS", "").split(",")
+    if "=" in pair
+)
+# Secret Manager key of the Azure OpenAI key
+SECRET_KEY_AZURE_OPENAI_KEY = "azure_openai_key"
+
+# e.g. vLLM or llama.cpp serving the OpenAI API
+LOCAL_OPENAI_BASE = os.environ.get("LOCAL_OPENAI_BASE", "http://localhost:8000/v1")
+# Model served locally, used whatever model is requested
+LOCAL_OPENAI_MODEL = os.environ.get("LOCAL_OPENAI_MODEL")
+
+# Upper bounds of the histogram buckets in ms, 10ms to about 2 minutes
+HISTOGRAM_BUCKETS_MS = [10 * 1.25**index for index in range(43)]
+
+# Create logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class LatencyHistogram:
+    """
+    Counts of latencies per bucket, since the container started
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency_ms: float):
+        index = bisect.bisect_left(HISTOGRAM_BUCKETS_MS, latency_ms)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += 1
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Upper bound in ms of the bucket of the percentile, None without samples
+        """
+        with self._lock:
+            counts = list(self.counts)
+            total = self.total
+        if total == 0:
+            return None
+        rank = fraction * total
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= rank and count:
+                if index == len(HISTOGRAM_BUCKETS_MS):
+                    return HISTOGRAM_BUCKETS_MS[-1]
+                return HISTOGRAM_BUCKETS_MS[index]
+        return HISTOGRAM_BUCKETS_MS[-1]
+
+
+class Provider:
+    """
+    OpenAI chat completions API
+    """
+
+    name = "openai"
+
+    def __init__(self, base_url: str = OPENAI_API_BASE):
+        self.base_url = base_url
+        # latencies by model: a fast follow-up model must not set the
+        # hedge delay of a slow extraction model
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, model: str) -> LatencyHistogram:
+        histogram = self.histograms.get(model)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(model, LatencyHistogram())
+        return histogram
+
+    def url(self, model: str) -> str:
+        return f"{self.base_url}/chat/completions"
+
+    def model(self, model: str) -> str:
+        return model
+
+    def headers(self, openai_key: str) -> dict:
+        return {
+            "Content-Type": "application/json",
+            "Authorization": "Bearer " + openai_key,
+        }
+
+
+class AzureOpenAIProvider(Provider):
+    """
+    Azure OpenAI, one deployment per model, with its own key in the secret
+    """
+
+    name = "azure"
+
+    def __init__(self, endpoint: str = AZURE_OPENAI_ENDPOINT):
+        super().__init__(endpoint.rstrip("/"))
+
+    def url(self, model: str) -> str:
+        deployment = AZURE_OPENAI_DEPLOYMENTS.get(model, model)
+        return (
+            f"{self.base_url}/openai/deployments/{deployment}/chat/completions"
+            f"?api-version={AZURE_OPENAI_API_VERSION}"
+        )
+
+    def headers(self, openai_key: str) -> dict:
+        return {
+            "Content-Type": "application/json",
+            "api-key": get_secret()[SECRET_KEY_AZURE_OPENAI_KEY],
+        }
+
+
+class LocalProvider(Provider):
+    """
+    OpenAI compatible server without authentication
+    """
+
+    name = "local"
+
+    def __init__(self, base_url: str = LOCAL_OPENAI_BASE):
+        super().__init__(base_url)
+
+    def model(self, model: str) -> str:
+        return LOCAL_OPENAI_MODEL or model
+
+    def headers(self, openai_key: str) -> dict:
+        return {"Content-Type": "application/json"}
+
+
+PROVIDER_CLASSES = {
+    provider_class.name: provider_class
+    for provider_class in (Provider, AzureOpenAIProvider, LocalProvider)
+}
+
+_providers = None
+
+
+def get_providers() -> list:
+    """
+    Function to get the configured providers, created once per container
+    """
+    global _providers
+    if _providers is None:
+        _providers = [PROVIDER_CLASSES[name]() for name in OPENAI_PROVIDERS]
+    return _providers
+
+
+def log_latency_stats():
+    for provider in get_providers():
+        for model, histogram in list(provider.histograms.items()):
+            if histogram.total == 0:
+                continue
+            p50, p95, p99 = (histogram.percentile(q) for q in (0.5, 0.95, 0.99))
+            logger.info(
+                f"{provider.name} {model} latency: p50<={p50:.0f}ms, "
+                f"p95<={p95:.0f}ms, p99<={p99:.0f}ms over {histogram.total} requests"
+            )
@@ -0,0 +1,263 @@
+"""
+Client-side limit of the requests and tokens sent to OpenAI per minute.
+
+OpenAI limits every model separately, so every model has its own limiter:
+its limits, counters and AIMD state. Every container counts its requests in
+the same DynamoDB item per model and minute, so a burst of invocations is
+held back before OpenAI answers with 429s. Without a table the limit is a
+token bucket of the container. The limits are scaled by an AIMD factor:
+halved on every 429 of the model, raised a little on every success.
+
+OpenAI also reports what is left of the account limits in the
+`x-ratelimit-remaining-*` headers; when nothing is left, or after a 429, new
+requests are blocked until the reset time OpenAI gave.
+
+reserve() does not sleep, it returns how long to wait, and the caller
+decides if the invocation has time for that.
+"""
+import logging
+import os
+import re
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from aws_resources import get_dynamodb_table
+from tracing import add_count, span
+
+# Limits of the OpenAI account for each model, 0 for no limit,
+# e.g. "gpt-4-0613=500:10000,gpt-3.5-turbo-0613=3500:90000"
+OPENAI_RATE_LIMITS = {
+    model.strip(): tuple(int(limit) for limit in limits.split(":", 1))
+    for model, limits in (
+        pair.split("=", 1)
+        for pair in os.environ.get("OPENAI_RATE_LIMITS", "").split(",")
+        if "=" in pair
+    )
+}
+# Limits of the models not in OPENAI_RATE_LIMITS
+OPENAI_RPM_LIMIT = int(os.environ.get("OPENAI_RPM_LIMIT", "0"))
+OPENAI_TPM_LIMIT = int(os.environ.get("OPENAI_TPM_LIMIT", "0"))
+# Table with the counters shared by every container, local bucket if not set
+RATE_LIMIT_TABLE_NAME = os.environ.get("RATE_LIMIT_TABLE_NAME")
+
+# Tokens counted for the completion, before it is known
+EXPECTED_COMPLETION_TOKENS = 200
+WINDOW_SECONDS = 60
+
+# AIMD factor applied to the limits
+MIN_FACTOR = 0.1
+DECREASE_FACTOR = 0.5
+INCREASE_STEP = 0.02
+
+# Durations of the reset headers, e.g. "1s", "6m0s" or "20ms"
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+# Items of a minute are deleted by the TTL after this long
+COUNTER_TTL_SECONDS = 3600
+UNLIMITED = 10**12
+
+# Create logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def parse_duration(value: str) -> float:
+    """
+    Function to read the duration of a `x-ratelimit-reset-*` header in seconds
+    """
+    if not value:
+        return None
+    parts = DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+
+class RateLimiter:
+    """
+    Requests and tokens per minute allowed to one OpenAI model, shared by
+    the containers through `table_name` when it is given
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = OPENAI_RPM_LIMIT,
+        tokens_per_minute: int = OPENAI_TPM_LIMIT,
+        table_name: str = RATE_LIMIT_TABLE_NAME,
+        key: str = "openai",
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.table_name = table_name
+        self.key = key
+        self.factor = 1.0
+        self._lock = threading.Lock()
+        self._blocked_until = 0.0
+        # local token buckets
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.requests_per_minute or self.tokens_per_minute)
+
+    def _limits(self) -> (int, int):
+        requests = self.requests_per_minute or UNLIMITED
+        tokens = self.tokens_per_minute or UNLIMITED
+        return max(1, int(requests * self.factor)), max(1, int(tokens * self.factor))
+
+    def reserve(self, tokens: int = 0) -> float:
+        """
+        Function to count a request of `tokens` tokens. Returns 0 when it can
+        be sent, otherwise the seconds to wait before asking again.
+        """
+        now = time.time()
+        with self._lock:
+            if self._blocked_until > now:
+                return self._blocked_until - now
+        if not self.enabled:
+            return 0
+        tokens += EXPECTED_COMPLETION_TOKENS
+        if self.table_name:
+            try:
+                return self._reserve_shared(tokens, now)
+            except Exception as e:
+                # the limiter must not take OpenAI calls down with it
+                logger.warning(f"Could not update the rate limit counters: {e}")
+                return 0
+        return self._reserve_local(tokens)
+
+    def _reserve_local(self, tokens: int) -> float:
+        with self._lock:
+            max_requests, max_tokens = self._limits()
+            now = time.monotonic()
+            elapsed = now - self._refilled_at
+            self._refilled_at = now
+            self._requests = min(
+                max_requests, self._requests + elapsed * max_requests / WINDOW_SECONDS
+            )
+            self._tokens = min(
+                max_tokens, self._tokens + elapsed * max_tokens / WINDOW_SECONDS
+            )
+            tokens = min(tokens, max_tokens)
+            if self._requests >= 1 and self._tokens >= tokens:
+                self._requests -= 1
+                self._tokens -= tokens
+                return 0
+            return max(
+                (1 - self._requests) * WINDOW_SECONDS / max_requests,
+                (tokens - self._tokens) * WINDOW_SECONDS / max_tokens,
+            )
+
+    def _reserve_shared(self, tokens: int, now: float) -> float:
+        window = int(now // WINDOW_SECONDS)
+        max_requests, max_tokens = self._limits()
+        tokens = min(tokens, max_tokens)
+        try:
+            with span("dynamodb_rate_limit"):
+                get_dynamodb_table(self.table_name).update_item(
+                    Key={"limiter_key": f"{self.key}#{window}"},
+                    UpdateExpression=(
+                        "ADD request_count :one, token_count :tokens "
+                        "SET expires_at = :expires_at"
+                    ),
+                    ConditionExpression=(
+                        "(attribute_not_exists(request_count) OR "
+                        "(request_count < :max_requests AND token_count <= :max_tokens))"
+                        " AND (attribute_not_exists(blocked_until) OR "
+                        "blocked_until <= :now)"
+                    ),
+                    ExpressionAttributeValues={
+                        ":one": 1,
+                        ":tokens": tokens,
+                        ":max_requests": max_requests,
+                        ":max_tokens": max_tokens - tokens,
+                        ":now": int(now),
+                        ":expires_at": int(now) + COUNTER_TTL_SECONDS,
+                    },
+                    ReturnValuesOnConditionCheckFailure="ALL_OLD",
+                )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            # the item comes in the low-level format, also from a Table
+            blocked_until = e.response.get("Item", {}).get("blocked_until", {})
+            blocked_until = float(blocked_until.get("N", 0))
+            if blocked_until > now:
+                return blocked_until - now
+            return (window + 1) * WINDOW_SECONDS - now
+        return 0
+
+    def observe(self, status_code: int, headers, retry_after: float = None):
+        """
+        Function to adapt the limits to an OpenAI response
+        """
+        block_seconds = None
+        with self._lock:
+            if status_code == 429:
+                self.factor = max(MIN_FACTOR, self.factor * DECREASE_FACTOR)
+                block_seconds = retry_after
+            elif status_code < 400:
+                self.factor = min(1.0, self.factor + INCREASE_STEP)
+
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is not None and remaining.strip() == "0":
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                block_seconds = max(block_seconds or 0, reset or 0) or None
+        if block_seconds:
+            self.block(block_seconds)
+
+    def block(self, seconds: float):
+        """
+        Function to hold back every request for `seconds`
+        """
+        add_count("openai_rate_limit_block")
+        blocked_until = time.time() + seconds
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, blocked_until)
+        if not self.table_name:
+            return
+        window = int(time.time() // WINDOW_SECONDS)
+        last_window = int(blocked_until // WINDOW_SECONDS)
+        try:
+            for blocked_window in range(window, min(last_window, window + 2) + 1):
+                get_dynamodb_table(self.table_name).update_item(
+                    Key={"limiter_key": f"{self.key}#{blocked_window}"},
+                    UpdateExpression=(
+                        "SET blocked_until = :blocked_until, expires_at = :expires_at"
+                    ),
+                    ExpressionAttributeValues={
+                        ":blocked_until": int(blocked_until) + 1,
+                        ":expires_at": int(blocked_until) + COUNTER_TTL_SECONDS,
+                    },
+                )
+        except Exception as e:
+            logger.warning(f"Could not share the rate limit block: {e}")
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model: str) -> RateLimiter:
+    """
+    Function to get the limiter of a model, created once per container
+    """
+    limiter = _limiters.get(model)
+    if limiter is not None:
+        return limiter
+    with _limiters_lock:
+        limiter = _limiters.get(model)
+        if limiter is None:
+            requests_per_minute, tokens_per_minute = OPENAI_RATE_LIMITS.get(
+                model, (OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT)
+            )
+            limiter = RateLimiter(
+                requests_per_minute, tokens_per_minute, key=f"openai:{model}"
+            )
+            _limiters[model] = limiter
+    return limiter
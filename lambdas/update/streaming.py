@@ -0,0 +1,124 @@
+"""
+Helpers for streamed chat completions: parsing the OpenAI server-sent events,
+merging the deltas, and formatting the events returned to the client.
+"""
+import json
+import re
+
+OPENAI_STREAM_DONE = "[DONE]"
+
+# passed to on_token when the text streamed so far belongs to a discarded
+# answer (malformed, or escalated to another model), sent as a `reset` event
+RESET_STREAM = None
+
+NEXT_QUESTION_START = re.compile(r'"next_question"\s*:\s*"')
+INCOMPLETE_UNICODE_ESCAPE = re.compile(r"\\u[0-9a-fA-F]{0,3}$")
+
+
+def iter_openai_stream(response):
+    """
+    Yields the JSON chunks of a streamed OpenAI chat completion
+    """
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:") :].strip()
+        if data == OPENAI_STREAM_DONE:
+            return
+        yield json.loads(data)
+
+
+def format_sse(event: str, data: dict) -> str:
+    """
+    Formats one server-sent event
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class NextQuestionExtractor:
+    """
+    Extracts the `next_question` string from partial function call arguments,
+    so the question can be shown while the arguments are still streaming
+    """
+
+    def __init__(self):
+        self.emitted = ""
+        self.finished = False
+
+    def feed(self, arguments: str) -> str:
+        """
+        Takes all arguments received so far and returns the new question text
+        """
+        if self.finished:
+            return ""
+        match = NEXT_QUESTION_START.search(arguments)
+        if match is None:
+            return ""
+
+        raw = arguments[match.end() :]
+        end = 0
+        while end < len(raw):
+            if raw[end] == "\\":
+                end += 2
+                continue
+            if raw[end] == '"':
+                self.finished = True
+                break
+            end += 1
+        raw = raw[: min(end, len(raw))]
+
+        # do not decode an escape sequence that is not complete yet
+        if not self.finished:
+            trailing_backslashes = len(raw) - len(raw.rstrip("\\"))
+            if trailing_backslashes % 2:
+                raw = raw[:-1]
+            raw = INCOMPLETE_UNICODE_ESCAPE.sub("", raw)
+
+        text = json.loads(f'"{raw}"')
+        new_text = text[len(self.emitted) :]
+        self.emitted = text
+        return new_text
+
+
+class ChatStreamAccumulator:
+    """
+    Merges the deltas of a streamed chat completion into one message
+    """
+
+    def __init__(self):
+        self.content = None
+        self.function_name = None
+        self.function_arguments = ""
+        self._question = NextQuestionExtractor()
+
+    def add(self, chunk: dict) -> str:
+        """
+        Adds a chunk and returns the text that can be shown to the user
+        """
+        choices = chunk.get("choices") or [{}]
+        delta = choices[0].get("delta", {})
+
+        if delta.get("content"):
+            self.content = (self.content or "") + delta["content"]
+            return delta["content"]
+
+        function_call = delta.get("function_call")
+        if function_call:
+            if function_call.get("name"):
+                self.function_name = function_call["name"]
+            self.function_arguments += function_call.get("arguments", "")
+            if self.function_name == "ask_follow_up_question":
+                return self._question.feed(self.function_arguments)
+        return ""
+
+    def message(self) -> dict:
+        """
+        Returns the merged message in the format of a non-streamed response
+        """
+        message = {"role": "assistant", "content": self.content}
+        if self.function_name is not None:
+            message["function_call"] = {
+                "name": self.function_name,
+                "arguments": self.function_arguments,
+            }
+        return message
@@ -1,213 +1,471 @@
 import json
+import math
 import os
 import logging
 from http import HTTPStatus
-import boto3
-from botocore.exceptions import ClientError
 from time import gmtime, strftime
-import requests
-from tenacity import retry, wait_random_exponential, stop_after_attempt
-
-
-# OpenAI functions
-FUNCTIONS = [
-    {
-        "name": "save_users_questionnaire",
-        "description": "If user responded all questions, store fully filled questionnaire to the database",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "user_answers": {
-                    "type": "object",
-                    "description": "Keys of the dict are questions to the user and "
-                    "values are user's responses in strings to the corresponding questions",
-                },
-            },
-            "required": ["user_answers"],
-        },
-    },
-    {
-        "name": "ask_follow_up_question",
-        "description": "If the user didn't answer all the questions, "
-        "generates an additional question to ask user.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "next_question": {
-                    "type": "string",
-                    "description": "Next question which we will ask user to clarify their response",
-                },
-            },
-            "required": ["next_question"],
-        },
-    },
-]
+
+from aws_resources import (
+    WARM_UP_ON_INIT,
+    get_secret,
+    log_cache_stats,
+    secret_cache,
+    warm_up,
+)
+from chat_result import ChatResult, MalformedModelOutput
+from context_window import count_prompt_tokens, count_text_tokens, fit_to_budget
+from conversation_ids import conversation_id_secret, expiry_time
+from conversation_store import (
+    ConversationNotFound,
+    ConversationVersionConflict,
+    append_messages,
+    append_messages_and_save_form,
+    load_or_start_conversation,
+)
+from form_schema import FIELD_QUESTIONS, build_functions, validate_form
+from idempotency import get_result, idempotency_key, save_result
+from local_extractor import merge_model_answers, try_local_turn
+from model_routing import EXTRACTION_MODEL, FOLLOW_UP_MODEL, record_model_call
+from openai_client import (
+    GPT_MODEL,
+    OpenAIAuthenticationError,
+    OpenAIRateLimitError,
+    chat_completion_request,
+    preconnect,
+    set_deadline,
+)
+from providers import log_latency_stats
+from streaming import (
+    RESET_STREAM,
+    ChatStreamAccumulator,
+    format_sse,
+    iter_openai_stream,
+)
+from tracing import add_count, end_trace, set_property, span, start_trace
+
+
+# OpenAI functions, generated from the form fields
+FUNCTIONS = build_functions()
 
 # Secret Manager configuration
-SECRET_NAME = "insurance_fills_secrets"
 SECRET_KEY_OPENAI_KEY = "open_ai_key"
 
-# OpenAI GPT model
-GPT_MODEL = "gpt-4-0613"
+# Model calls of one turn: follow-up model, extraction model and one re-ask
+MAX_MODEL_CALLS_PER_TURN = 3
+REASK_PROMPT = (
+    "Your last response could not be read. Ask the next question with "
+    "ask_follow_up_question, or call save_users_questionnaire, with valid "
+    "JSON arguments."
+)
 
 # Create logger
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
-def get_secret():
+def warm_up_on_init():
+    """
+    Function to do the setup of the first request during the init phase:
+    AWS clients, the OpenAI key, the tiktoken encoding and the connection
+    to OpenAI
+    """
+    table_names = [
+        os.environ[name]
+        for name in ("CONVERSATION_TABLE_NAME", "FILLED_FORMS_TABLE_NAME")
+        if name in os.environ
+    ]
+    warm_up(
+        table_names,
+        client_names=["dynamodb"],
+        secret=True,
+        # checks the signature of conversations started by their first turn
+        secret_caches=[conversation_id_secret] if conversation_id_secret else [],
+    )
+    count_text_tokens("", GPT_MODEL)
+    preconnect()
+
+
+if WARM_UP_ON_INIT:
+    warm_up_on_init()
+
+
+def update_conversation_in_dynamodb(
+    table_name: str,
+    conversation_id: str,
+    additional_conversation: list,
+    expected_version: int = None,
+    usage: dict = None,
+    state: dict = None,
+    history: list = None,
+    create: bool = False,
+) -> (list, int):
+    """
+    Function to append messages, token counts and form state
+    to a conversation in DynamoDB
+    """
+    chat_history, version = append_messages(
+        table_name,
+        conversation_id,
+        additional_conversation,
+        expected_version,
+        usage,
+        state,
+        history,
+        create,
+    )
+    logger.info(f"Item is stored in the table: {table_name}")
+
+    return chat_history, version
+
+
+def generate_assistant_response(
+    chat_history: list, openai_key, on_token=None, escalate: bool = False
+) -> (bool, str, dict, dict):
     """
-    Retrieves the secret from AWS Secrets Manager.
+    Function to generate assistant response, its token counts and the state
+    of the form reported by the model.
+    If on_token is given, the response is streamed and passed to it in pieces.
+    With escalate, only the extraction model is asked.
     """
-    region_name = "us-east-1"
+    chat = Chat(escalate=escalate)
+    chat.upload_conversation_history(chat_history)
+    if on_token is None:
+        is_finished, next_question = chat.generate_response_for_user(openai_key)
+    else:
+        is_finished, next_question = chat.generate_streamed_response_for_user(
+            openai_key, on_token
+        )
+
+    return is_finished, next_question, chat.usage, chat.form_state
 
-    # Create a Secrets Manager client
-    session = boto3.session.Session()
-    client = session.client(service_name="secretsmanager", region_name=region_name)
 
+def ask_model(
+    chat_history: list, on_token, escalate: bool = False
+) -> (bool, str, dict, dict):
+    """
+    Function to generate assistant response with the cached OpenAI key,
+    reloading the key once if OpenAI rejects it
+    """
     try:
-        get_secret_value_response = client.get_secret_value(SecretId=SECRET_NAME)
-    except ClientError as e:
-        raise e
+        openai_key = get_secret()[SECRET_KEY_OPENAI_KEY]
+        with span("openai"):
+            return generate_assistant_response(
+                chat_history, openai_key, on_token, escalate
+            )
+    except OpenAIAuthenticationError:
+        # The key may have been rotated since it was cached
+        logger.info("OpenAI rejected the cached key, reloading the secret")
+        secret_cache.invalidate()
+        openai_key = get_secret()[SECRET_KEY_OPENAI_KEY]
+        with span("openai"):
+            return generate_assistant_response(
+                chat_history, openai_key, on_token, escalate
+            )
 
-    # Decrypts secret using the associated KMS key.
-    secret = get_secret_value_response["SecretString"]
 
-    return json.loads(secret)
+def merge_model_state(state: dict, model_state: dict) -> dict:
+    """
+    Function to combine the stored form state with the one reported by the
+    model, so the next reply can be checked by the local fast path
+    """
+    answers = merge_model_answers(
+        state.get("answers", {}), model_state.get("collected_answers")
+    )
+    pending_field = model_state.get("pending_field")
+    if pending_field not in FIELD_QUESTIONS or pending_field in answers:
+        pending_field = None
+    # a model turn that did not fail validation goes back to the small model
+    return {"answers": answers, "pending_field": pending_field, "escalate": None}
 
 
-def get_dynamodb_table(table_name: str) -> object:
+def check_filled_form(form: dict, state: dict) -> (bool, dict, dict):
     """
-    Function to get the DynamoDB table object
+    Function to validate the form returned by the model. An invalid form is
+    not saved; the question of the first invalid field is asked instead, and
+    the next turns go to the extraction model.
+    Returns (is_finished, filled form or next question, new state).
     """
-    dynamodb = boto3.resource("dynamodb")
-    table = dynamodb.Table(table_name)
-    return table
+    cleaned, invalid_fields = validate_form(form)
+    if not invalid_fields:
+        return True, cleaned, dict(state, answers=cleaned)
 
+    add_count("form_validation_failed")
+    logger.info(f"Invalid fields in the form from the model: {invalid_fields}")
+    answers = merge_model_answers(state.get("answers", {}), cleaned)
+    pending_field = invalid_fields[0]
+    new_state = {"answers": answers, "pending_field": pending_field, "escalate": True}
+    return False, FIELD_QUESTIONS[pending_field], new_state
 
-def save_to_dynamodb_table(table_name: str, data_to_add: dict):
+
+def form_item(form: dict, conversation_id: str) -> dict:
     """
-    Function to save a dictionary to DynamoDB table
+    Function to build the FilledFormsTable item of a filled form
     """
-    table = get_dynamodb_table(table_name)
+    filled_form = dict(form)
+    filled_form["conversation_id"] = conversation_id
+    created = gmtime()
+    filled_form["create_time"] = strftime("%Y-%m-%d %H:%M:%S", created)
+    # partition key of the ByCreateDay index
+    filled_form["create_day"] = strftime("%Y-%m-%d", created)
+    return filled_form
 
-    table.put_item(Item=data_to_add)
-    logger.info(f"Successful put to the table: {table_name}")
-    logger.debug(f"Added data: {data_to_add}")
 
+def is_stream_requested(event: dict) -> bool:
+    """
+    Function to check if the client asked for server-sent events,
+    with ?stream=true or an `Accept: text/event-stream` header
+    """
+    query = event.get("queryStringParameters") or {}
+    headers = event.get("headers") or {}
+    accept = headers.get("accept", "")
+    return query.get("stream") == "true" or "text/event-stream" in accept
 
-def update_conversation_in_dynamodb(
-    table_name: str, conversation_id: str, additional_conversation: list
-) -> list:
+
+def is_form_requested(event: dict) -> bool:
     """
-    Function to update a conversation in DynamoDB
+    Function to check if the client asked for the filled form in the
+    response of the last turn, with ?include_form=true
     """
-    table = get_dynamodb_table(table_name)
-    response = table.get_item(Key={"conversation_id": conversation_id})
-    chat_history = response.get("Item", {})
-    chat_history["conversation"].extend(additional_conversation)
+    query = event.get("queryStringParameters") or {}
+    return query.get("include_form") == "true"
 
-    table.put_item(Item=chat_history)
-    logger.info(f"Item is stored in the table: {table_name}")
 
-    return chat_history["conversation"]
+def response_result(result: dict, include_form: bool) -> dict:
+    """
+    Function to drop the filled form from the result unless it was asked for
+    """
+    if include_form or "filled_form" not in result:
+        return result
+    return {key: value for key, value in result.items() if key != "filled_form"}
 
 
-def generate_assistant_response(chat_history: list, openai_key) -> (bool, str):
+def run_turn(
+    conversation_id: str, additional_conversation: list, on_token=None
+) -> dict:
     """
-    Function to generate assistant response
+    Function to answer one turn and store it.
+    Returns {"next_question", "is_finished"}, and the stored "filled_form"
+    when the form is finished.
     """
-    chat = Chat()
-    chat.upload_conversation_history(chat_history)
-    is_finished, next_question = chat.generate_response_for_user(openai_key)
+    conversations_table_name = os.environ["CONVERSATION_TABLE_NAME"]
+
+    with span("load_conversation"):
+        stored_history, version, state, is_new = load_or_start_conversation(
+            conversations_table_name, conversation_id
+        )
+    if is_new:
+        add_count("conversation_started")
+    chat_history = stored_history + additional_conversation
+
+    with span("local_extraction"):
+        local_turn = try_local_turn(state, additional_conversation)
+
+    if local_turn is not None:
+        logger.info("Turn answered without the model")
+        add_count("local_turn")
+        is_finished, value, new_state = local_turn
+        usage = None
+        if on_token is not None and not is_finished:
+            on_token(value)
+    else:
+        add_count("model_turn")
+        is_finished, value, usage, model_state = ask_model(
+            chat_history, on_token, escalate=bool(state.get("escalate"))
+        )
+        add_count("prompt_tokens", usage["prompt_tokens"])
+        add_count("completion_tokens", usage["completion_tokens"])
+        new_state = merge_model_state(state, model_state)
+        if is_finished:
+            is_finished, value, new_state = check_filled_form(value, new_state)
+            if not is_finished and on_token is not None:
+                on_token(value)
+
+    logger.debug(f"is_finished: {is_finished}, value: {value}")
+    result = {"next_question": value, "is_finished": is_finished}
+
+    if is_finished:
+        filled_form = form_item(value, conversation_id)
+        forms_table_name = os.environ["FILLED_FORMS_TABLE_NAME"]
+        logger.debug(f"filled_form: {filled_form}")
+        add_count("form_saved")
+        with span("save_turn_and_form"):
+            append_messages_and_save_form(
+                conversations_table_name,
+                conversation_id,
+                additional_conversation,
+                version,
+                forms_table_name,
+                filled_form,
+                usage=usage,
+                # a filled form is kept, only abandoned conversations expire
+                state=dict(new_state, pending_field=None, expires_at=None),
+                history=stored_history,
+                create=is_new,
+            )
+        result["filled_form"] = filled_form
+    else:
+        additional_conversation.append({"role": "assistant", "content": value})
+        with span("save_turn"):
+            update_conversation_in_dynamodb(
+                conversations_table_name,
+                conversation_id,
+                additional_conversation,
+                expected_version=version,
+                usage=usage,
+                state=dict(new_state, expires_at=expiry_time()),
+                history=stored_history,
+                create=is_new,
+            )
+        logger.debug(f"Next question: {value}")
 
-    return is_finished, next_question
+    return result
 
 
 def lambda_update(event, context) -> dict:
     """
-    Lambda function to update form
+    Lambda function to update form.
+
+    The whole turn is one read and one conditional write: the stored history
+    is loaded once, merged with the user messages in memory, and the new
+    messages are appended only after the assistant responded. A finished form
+    is stored in the same transaction as the last messages. The conversation
+    of a conversation_id from POST /form is created by its first turn.
+
+    When streaming is requested the body is a text/event-stream of `token`
+    events with pieces of the question, followed by one `result` event with
+    the usual {"next_question", "is_finished"} payload. A `reset` event
+    drops the text of the tokens before it: that answer was discarded and
+    another model was asked.
+
+    With ?include_form=true the payload of the last turn also has the stored
+    "filled_form", the body of a later GET /form/{conversation_id}.
+
+    A retried request (same Idempotency-Key, or same X-Turn-Index and body)
+    gets the stored result of the first one, without calling OpenAI or
+    writing the conversation again.
+
+    When OpenAI, or the client-side rate limit, would not let the turn finish
+    in time, the response is a 503 with `Retry-After`.
     """
     logger.info("lambda_update_form Handler started")
+    set_deadline(context)
+    start_trace("lambda_update")
+    stream = is_stream_requested(event)
+    include_form = is_form_requested(event)
+    tokens = []
+    on_token = tokens.append if stream else None
     try:
         conversation_id = event.get("pathParameters")["conversation_id"]
         additional_conversation = json.loads(event.get("body"))
-        conversations_table_name = os.environ["CONVERSATION_TABLE_NAME"]
-
-        chat_history = update_conversation_in_dynamodb(
-            conversations_table_name, conversation_id, additional_conversation
-        )
-
-        openai_key = get_secret()[SECRET_KEY_OPENAI_KEY]
-
-        is_finished, value = generate_assistant_response(chat_history, openai_key)
-        logger.debug("is_finished, value")
-        logger.debug(is_finished, value)
-        result = {"next_question": value, "is_finished": is_finished}
+        set_property("conversation_id", conversation_id)
 
+        idempotency_table_name = os.environ.get("IDEMPOTENCY_TABLE_NAME")
+        request_key = None
+        if idempotency_table_name:
+            request_key = idempotency_key(
+                conversation_id, event.get("headers"), event.get("body")
+            )
+        result = None
+        if request_key is not None:
+            result = get_result(idempotency_table_name, request_key)
+
+        if result is not None:
+            logger.info("Replaying the stored result of the request")
+            add_count("idempotent_replay")
+            if on_token is not None and not result["is_finished"]:
+                on_token(result["next_question"])
+        else:
+            try:
+                result = run_turn(conversation_id, additional_conversation, on_token)
+            except ConversationVersionConflict:
+                # a duplicate of this request may have stored the turn first
+                if request_key is not None:
+                    result = get_result(idempotency_table_name, request_key)
+                if result is None:
+                    raise
+                add_count("idempotent_replay")
+            else:
+                if request_key is not None:
+                    save_result(idempotency_table_name, request_key, result)
+
+        with span("serialize_response"):
+            result = response_result(result, include_form)
+            if stream:
+                events = [
+                    format_sse("reset", {})
+                    if token is RESET_STREAM
+                    else format_sse("token", {"text": token})
+                    for token in tokens
+                ]
+                events.append(format_sse("result", result))
+                response = {
+                    "statusCode": HTTPStatus.OK.value,
+                    "body": "".join(events),
+                    "headers": {
+                        "content-type": "text/event-stream",
+                        "cache-control": "no-cache",
+                    },
+                }
+            else:
+                response = {
+                    "statusCode": HTTPStatus.OK.value,
+                    "body": json.dumps(result, indent=2),
+                    "headers": {"content-type": "application/json"},
+                }
+    except ConversationNotFound as e:
+        response = {
+            "statusCode": HTTPStatus.NOT_FOUND.value,
+            "body": f"Conversation not found: {e}",
+            "headers": {"content-type": "text/plain"},
+        }
+    except ConversationVersionConflict as e:
         response = {
-            "statusCode": HTTPStatus.OK.value,
-            "body": json.dumps(result, indent=2),
-            "headers": {"content-type": "application/json"},
+            "statusCode": HTTPStatus.CONFLICT.value,
+            "body": f"Conversation was updated by another request: {e}",
+            "headers": {"content-type": "text/plain"},
+        }
+    except MalformedModelOutput as e:
+        response = {
+            "statusCode": HTTPStatus.BAD_GATEWAY.value,
+            "body": f"The model returned a malformed response: {e}",
+            "headers": {"content-type": "text/plain"},
+        }
+    except OpenAIRateLimitError as e:
+        # nothing was stored, the client can send the same request again
+        response = {
+            "statusCode": HTTPStatus.SERVICE_UNAVAILABLE.value,
+            "body": f"OpenAI rate limit reached: {e}",
+            "headers": {
+                "content-type": "text/plain",
+                "retry-after": str(math.ceil(e.retry_after or 1)),
+            },
         }
-
-        if is_finished:
-            logger.debug("is_finished", is_finished)
-            filled_form = value
-            filled_form["conversation_id"] = conversation_id
-            filled_form["create_time"] = strftime("%Y-%m-%d %H:%M:%S", gmtime())
-            forms_table_name = os.environ["FILLED_FORMS_TABLE_NAME"]
-            logger.debug("filled_form", filled_form)
-            save_to_dynamodb_table(forms_table_name, filled_form)
-        else:
-            additional_conversation = [{"role": "assistant", "content": value}]
-            chat_history = update_conversation_in_dynamodb(
-                conversations_table_name, conversation_id, additional_conversation
-            )
-
-            logger.debug(f"Next question: {value}")
-            logger.debug(f"chat_history updated with next question: {chat_history}")
     except Exception as e:
         response = {
             "statusCode": HTTPStatus.INTERNAL_SERVER_ERROR.value,
             "body": f"Exception={e}",
             "headers": {"content-type": "text/plain"},
         }
+    set_property("status_code", response["statusCode"])
+    end_trace()
+    log_cache_stats()
+    log_latency_stats()
     return response
 
 
-# Functions to work with OpenAI GPT4 model
-@retry(wait=wait_random_exponential(min=1, max=40), stop=stop_after_attempt(3))
-def chat_completion_request(
-    messages: list, openai_key: str, functions: list = None, model: str = GPT_MODEL
-) -> dict:
-    """
-    Sends a request to the OpenAI GPT model for chat completions.
-    """
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": "Bearer " + openai_key,
-    }
-
-    json_data = {"model": model, "messages": messages}
-    if functions is not None:
-        json_data.update({"functions": functions})
-    try:
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=json_data,
-        )
-        return response
-    except Exception as e:
-        print("Unable to generate ChatCompletion response")
-        print(f"Exception: {e}")
-        return e
-
-
 class Chat:
-    def __init__(self):
+    def __init__(self, model: str = None, escalate: bool = False):
         self.conversation_history = []
+        # a given model answers every turn, otherwise the turn is routed
+        self.follow_up_model = model or FOLLOW_UP_MODEL
+        self.extraction_model = model or EXTRACTION_MODEL
+        self.escalate = escalate
+        # model of the last response
+        self.model = self.extraction_model if escalate else self.follow_up_model
+        # token counts of the last response, summed over the models asked
+        self.usage = None
+        # pending_field and collected_answers reported with the last question
+        self.form_state = {}
 
     def _add_prompt(self, role: str, content: str):
         message = {"role": role, "content": content}
@@ -231,52 +489,149 @@ class Chat:
     def upload_conversation_history(self, conversation_history: list):
         self.conversation_history = conversation_history
 
+    def prompt_messages(self, functions: list) -> list:
+        """
+        Conversation history compacted to the prompt token budget
+        """
+        return fit_to_budget(self.conversation_history, self.model, functions)
+
+    def _add_usage(self, model: str, prompt_tokens: int, completion_tokens: int):
+        record_model_call(model, prompt_tokens, completion_tokens)
+        usage = {
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+        }
+        if self.usage is not None:
+            usage["escalated_from"] = self.usage["model"]
+            usage["prompt_tokens"] += self.usage["prompt_tokens"]
+            usage["completion_tokens"] += self.usage["completion_tokens"]
+        self.usage = usage
+
+    def _route(self, complete) -> (bool, object):
+        """
+        Asks the follow-up model, then the extraction model to confirm a
+        filled form or when the follow-up model's answer is malformed. A
+        malformed answer of the extraction model is asked again with the
+        reason. A turn makes at most MAX_MODEL_CALLS_PER_TURN calls.
+        """
+        model = self.follow_up_model
+        if self.escalate or self.follow_up_model == self.extraction_model:
+            model = self.extraction_model
+        correction = None
+        for call in range(1, MAX_MODEL_CALLS_PER_TURN + 1):
+            try:
+                result = complete(model, correction)
+                is_finished, value, form_state = result.turn()
+            except MalformedModelOutput as e:
+                if call == MAX_MODEL_CALLS_PER_TURN:
+                    raise
+                logger.info(f"Malformed response of {model}: {e}")
+                if model == self.extraction_model:
+                    add_count("model_reask")
+                    correction = [{"role": "system", "content": REASK_PROMPT}]
+                else:
+                    add_count("model_escalation_malformed")
+                    model = self.extraction_model
+                continue
+
+            if is_finished and model != self.extraction_model:
+                add_count("model_escalation_confirm_form")
+                logger.info(f"Escalating the turn to {self.extraction_model}")
+                model = self.extraction_model
+                continue
+            self.form_state = form_state
+            if is_finished:
+                logger.info(f"Result questionnaire: {value}")
+            else:
+                logger.info(f"Next question: {value}")
+            return is_finished, value
+
     def generate_response_for_user(
         self, openai_key, functions: list = FUNCTIONS
-    ) -> (bool, str):
-        chat_response = chat_completion_request(
-            self.conversation_history, openai_key, functions=functions
+    ) -> (bool, object):
+        return self._route(
+            lambda model, correction: self._complete(
+                model, openai_key, functions, correction
+            )
         )
 
-        if chat_response is not None:
-            logger.info("chat_response:")
-            logger.info(chat_response)
-            logger.info(chat_response.json())
-
-            response_content = chat_response.json()["choices"][0]["message"]
-
-            message = chat_response.json()["choices"][0]["message"]["content"]
-
-            if message is not None:
-                chat_finished = False
-                return chat_finished, message
-
-            if "function_call" in response_content:
-                if (
-                    response_content["function_call"]["name"]
-                    == "save_users_questionnaire"
-                ):
-                    questionnaire = json.loads(
-                        response_content["function_call"]["arguments"]
-                    )
-                    logger.info("Result questionnaire:")
-                    logger.info(questionnaire)
-
-                    chat_finished = True
-                    return chat_finished, questionnaire
-
-                elif (
-                    response_content["function_call"]["name"]
-                    == "ask_follow_up_question"
-                ):
-                    next_question = json.loads(
-                        response_content["function_call"]["arguments"]
-                    )["next_question"]
-                    logger.info("Next question:")
-                    logger.info(next_question)
-
-                    chat_finished = False
-                    return chat_finished, next_question
+    def generate_streamed_response_for_user(
+        self, openai_key, on_token, functions: list = FUNCTIONS
+    ) -> (bool, object):
+        """
+        Same as generate_response_for_user, but requests streamed completions
+        and calls on_token with the question text as soon as it arrives.
+        The text of a discarded answer is followed by on_token(RESET_STREAM).
+        """
+        sent = []
+
+        def on_attempt_token(text: str):
+            sent.append(text)
+            on_token(text)
+
+        def complete(model: str, correction: list) -> ChatResult:
+            # _route only asks again when the last answer was discarded
+            if sent:
+                on_token(RESET_STREAM)
+                sent.clear()
+            return self._complete_streamed(
+                model, openai_key, on_attempt_token, functions, correction
+            )
 
-        else:
-            print("ChatCompletion request failed. Retrying...")
+        return self._route(complete)
+
+    def _complete(
+        self, model: str, openai_key, functions: list, correction: list = None
+    ) -> ChatResult:
+        self.model = model
+        messages = self.prompt_messages(functions) + (correction or [])
+        with span(f"openai_{model}"):
+            chat_response = chat_completion_request(
+                messages, openai_key, functions=functions, model=model
+            )
+            try:
+                body = chat_response.json()
+            except ValueError as e:
+                add_count("malformed_response")
+                raise MalformedModelOutput(f"Response is not JSON: {e}") from e
+
+        result = ChatResult.from_json(body, model)
+        logger.info(f"chat_response: {result}")
+        self._add_usage(result.model, result.prompt_tokens, result.completion_tokens)
+        return result
+
+    def _complete_streamed(
+        self,
+        model: str,
+        openai_key,
+        on_token,
+        functions: list,
+        correction: list = None,
+    ) -> ChatResult:
+        self.model = model
+        messages = self.prompt_messages(functions) + (correction or [])
+        with span(f"openai_{model}"):
+            chat_response = chat_completion_request(
+                messages, openai_key, functions=functions, model=model, stream=True
+            )
+
+            accumulator = ChatStreamAccumulator()
+            with chat_response:
+                for chunk in iter_openai_stream(chat_response):
+                    text = accumulator.add(chunk)
+                    if text:
+                        on_token(text)
+
+        # streamed responses carry no usage, count the tokens locally
+        message = accumulator.message()
+        completion = message["content"] or accumulator.function_arguments
+        result = ChatResult.from_message(
+            message,
+            model,
+            count_prompt_tokens(messages, model, functions),
+            count_text_tokens(completion, model),
+        )
+        logger.info(f"streamed chat_response: {result}")
+        self._add_usage(model, result.prompt_tokens, result.completion_tokens)
+        return result
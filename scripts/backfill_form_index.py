@@ -0,0 +1,29 @@
+"""
+Adds `create_day` to FilledFormsTable items written before the ByCreateDay
+index, so they can be found by GET /forms?since=...
+
+Usage:
+    python scripts/backfill_form_index.py <filled forms table name>
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lambdas/shared/python"))
+
+from filled_forms import backfill_create_day  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("table_name", help="name of the FilledFormsTable")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    updated = backfill_create_day(args.table_name)
+    print(f"Updated {updated} forms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Exports FilledFormsTable as NDJSON, one form per line, reading the table
+with a parallel segmented scan.
+
+Usage:
+    python scripts/export_forms.py <filled forms table name> --output forms.ndjson
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lambdas/shared/python"))
+
+from filled_forms import EXPORT_SEGMENTS, export_page, to_ndjson  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("table_name", help="name of the FilledFormsTable")
+    parser.add_argument("--output", help="file to write, stdout by default")
+    parser.add_argument("--segments", type=int, default=EXPORT_SEGMENTS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    output = open(args.output, "w") if args.output else sys.stdout
+    exported = 0
+    cursor = None
+    try:
+        while True:
+            forms, cursor = export_page(args.table_name, cursor, args.segments)
+            output.write(to_ndjson(forms))
+            exported += len(forms)
+            if cursor is None:
+                break
+    finally:
+        if args.output:
+            output.close()
+    print(f"Exported {exported} forms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
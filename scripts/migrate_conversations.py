@@ -0,0 +1,31 @@
+"""
+Adds `version` to ConversationsTable items written before append-only storage.
+
+The update lambda already treats a missing `version` as 0, so running this is
+optional; it makes the table uniform for later migrations.
+
+Usage:
+    python scripts/migrate_conversations.py <conversations table name>
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lambdas/shared/python"))
+
+from conversation_store import backfill_versions  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("table_name", help="name of the ConversationsTable")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    migrated = backfill_versions(args.table_name)
+    print(f"Migrated {migrated} conversations")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Fills forms from a JSONL file of free-text claims, e.g. emails or call
+transcripts, one {"id": ..., "text": ...} per line. Filled forms are stored
+in FilledFormsTable under the id of the record; the others are listed in
+the report with the follow-up question to ask.
+
+Running it again with the same report resumes where it stopped.
+
+Usage:
+    python scripts/process_claims.py claims.jsonl <filled forms table name> --report report.jsonl
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+LAMBDAS_DIR = os.path.join(os.path.dirname(__file__), "..", "lambdas")
+sys.path.append(os.path.join(LAMBDAS_DIR, "shared/python"))
+sys.path.append(os.path.join(LAMBDAS_DIR, "update"))
+
+from batch_processing import (  # noqa: E402
+    DEFAULT_CONCURRENCY,
+    BatchProcessor,
+    read_records,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("claims", help="JSONL file of claims")
+    parser.add_argument("table_name", help="name of the FilledFormsTable")
+    parser.add_argument("--report", required=True, help="JSONL report and checkpoint")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    processor = BatchProcessor(args.table_name, args.report, args.concurrency)
+    summary = processor.run(read_records(args.claims))
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
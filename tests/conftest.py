@@ -0,0 +1,12 @@
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+# the lambdas import their modules and the shared layer by name
+for path in ("lambdas/shared/python", "lambdas/update", "lambdas/create_get"):
+    sys.path.insert(0, os.path.join(ROOT, path))
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ["METRICS_ENABLED"] = "false"
+os.environ["WARM_UP_ON_INIT"] = "false"
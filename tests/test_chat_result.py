@@ -0,0 +1,67 @@
+import pytest
+
+from chat_result import ChatResult, MalformedModelOutput, parse_arguments, repair_json
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '```json\n{"age": 30}\n```',
+        'Here are the arguments: {"age": 30} Thanks',
+        '{"age": 30,}',
+        '{"answers": [30, 31,], "age": 30}',
+    ],
+)
+def test_repair_json(text):
+    assert repair_json(text)["age"] == 30
+
+
+@pytest.mark.parametrize(
+    "text", ["", "no object", '{"age": 3', "[1, 2]", '{"a": 1} {"b": 2}']
+)
+def test_repair_json_gives_up(text):
+    assert repair_json(text) is None
+
+
+def test_parse_arguments_rejects_a_truncated_object():
+    assert parse_arguments('{"age": 30}') == {"age": 30}
+    with pytest.raises(MalformedModelOutput):
+        parse_arguments('{"next_question": "What is your')
+
+
+def function_call_result(name: str, arguments: str) -> ChatResult:
+    message = {
+        "role": "assistant",
+        "content": None,
+        "function_call": {"name": name, "arguments": arguments},
+    }
+    return ChatResult.from_message(message, "model", 0, 0)
+
+
+def test_turn_of_a_follow_up_question():
+    result = function_call_result(
+        "ask_follow_up_question",
+        '{"next_question": "Age?", "pending_field": "age", "collected_answers": {"first_name": "Ann"}}',
+    )
+    assert result.turn() == (
+        False,
+        "Age?",
+        {"pending_field": "age", "collected_answers": {"first_name": "Ann"}},
+    )
+
+
+def test_turn_of_a_saved_form():
+    assert function_call_result("save_users_questionnaire", '{"age": 30}').turn() == (
+        True,
+        {"age": 30},
+        {},
+    )
+
+
+def test_turn_without_a_question_is_malformed():
+    with pytest.raises(MalformedModelOutput):
+        function_call_result(
+            "ask_follow_up_question", '{"pending_field": "age"}'
+        ).turn()
+    with pytest.raises(MalformedModelOutput):
+        function_call_result("unknown_function", "{}").turn()
@@ -0,0 +1,66 @@
+from decimal import Decimal
+
+from constants import SYSTEM_SETUP_PROMPT
+from conversation_codec import (
+    SYSTEM_PROMPT_VERSIONS,
+    SYSTEM_PROMPTS,
+    compress_messages,
+    decode_conversation,
+    decode_message,
+    decode_messages,
+    decompress_messages,
+    encode_message,
+    encode_messages,
+)
+
+MESSAGES = [
+    {"role": "system", "content": SYSTEM_PROMPTS[1]},
+    {"role": "user", "content": "I need insurance for my house."},
+    {"role": "assistant", "content": "What is your first name?"},
+]
+
+
+def test_system_prompt_is_stored_as_its_version():
+    assert encode_message(MESSAGES[0]) == [0, 1]
+    assert encode_message(MESSAGES[1]) == [1, "I need insurance for my house."]
+
+
+def test_unknown_and_unusual_messages_are_kept():
+    unknown_prompt = {"role": "system", "content": "Another prompt"}
+    function_call = {
+        "role": "assistant",
+        "content": None,
+        "function_call": {"name": "f"},
+    }
+    assert encode_message(unknown_prompt) == [0, "Another prompt"]
+    assert encode_message(function_call) == function_call
+    assert decode_message(function_call) == function_call
+
+
+def test_round_trip_with_dynamodb_numbers():
+    encoded = encode_messages(MESSAGES)
+    # DynamoDB returns numbers as Decimal
+    stored = [
+        [Decimal(code), Decimal(content) if isinstance(content, int) else content]
+        for code, content in encoded
+    ]
+    assert decode_messages(stored) == MESSAGES
+
+
+def test_compressed_archive_is_followed_by_the_newer_messages():
+    archive = compress_messages(MESSAGES[:2])
+    assert decompress_messages(archive) == MESSAGES[:2]
+    item = {
+        "conversation_archive": archive,
+        "conversation": encode_messages(MESSAGES[2:]),
+    }
+    assert decode_conversation(item) == MESSAGES
+
+
+def test_plain_items_written_before_the_encoding():
+    assert decode_conversation({"conversation": MESSAGES}) == MESSAGES
+
+
+def test_current_system_prompt_has_a_version():
+    # a changed prompt is added under a new version, stored ones keep theirs
+    assert SYSTEM_SETUP_PROMPT in SYSTEM_PROMPT_VERSIONS
@@ -0,0 +1,75 @@
+import pytest
+
+import conversation_ids
+from conversation_ids import (
+    CONVERSATION_TTL_SECONDS,
+    InvalidConversationId,
+    new_conversation_id,
+    read_conversation_id,
+)
+
+NOW = 1_700_000_000
+
+
+class StaticSecret:
+    def __init__(self, key: str):
+        self.value = {"key": key}
+
+    def get(self) -> dict:
+        return self.value
+
+
+@pytest.fixture(autouse=True)
+def secret(monkeypatch):
+    monkeypatch.setattr(
+        conversation_ids, "conversation_id_secret", StaticSecret("k" * 64)
+    )
+
+
+def test_signed_id_carries_the_prompt_version():
+    conversation_id = new_conversation_id(1, now=NOW)
+    assert read_conversation_id(conversation_id, now=NOW + 60) == 1
+
+
+def test_tampered_ids_are_rejected():
+    nonce, version, issued_at, signature = new_conversation_id(1, now=NOW).split(".")
+    tampered = [
+        f"{nonce}.2.{issued_at}.{signature}",
+        f"{'a' * 10}.{version}.{issued_at}.{signature}",
+        f"{nonce}.{version}.{issued_at}.{'A' * len(signature)}",
+        f"{nonce}.{version}.{issued_at}",
+        "abcdefghij",
+    ]
+    for conversation_id in tampered:
+        with pytest.raises(InvalidConversationId):
+            read_conversation_id(conversation_id, now=NOW)
+
+
+def test_ids_signed_with_another_key_are_rejected(monkeypatch):
+    conversation_id = new_conversation_id(1, now=NOW)
+    monkeypatch.setattr(
+        conversation_ids, "conversation_id_secret", StaticSecret("other")
+    )
+    with pytest.raises(InvalidConversationId):
+        read_conversation_id(conversation_id, now=NOW)
+
+
+def test_expired_ids_are_rejected():
+    conversation_id = new_conversation_id(1, now=NOW)
+    assert (
+        read_conversation_id(conversation_id, now=NOW + CONVERSATION_TTL_SECONDS) == 1
+    )
+    with pytest.raises(InvalidConversationId):
+        read_conversation_id(conversation_id, now=NOW + CONVERSATION_TTL_SECONDS + 1)
+
+
+def test_unknown_prompt_version_is_rejected():
+    with pytest.raises(InvalidConversationId):
+        read_conversation_id(new_conversation_id(99, now=NOW), now=NOW)
+
+
+def test_nothing_is_accepted_without_a_secret(monkeypatch):
+    conversation_id = new_conversation_id(1, now=NOW)
+    monkeypatch.setattr(conversation_ids, "conversation_id_secret", None)
+    with pytest.raises(InvalidConversationId):
+        read_conversation_id(conversation_id, now=NOW)
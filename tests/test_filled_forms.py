@@ -0,0 +1,74 @@
+import pytest
+
+from filled_forms import (
+    InvalidCursor,
+    decode_cursor,
+    decode_query_cursor,
+    encode_cursor,
+    CREATE_DAY_INDEX_KEY,
+    INSURANCE_TYPE_INDEX_KEY,
+)
+
+TABLE_START_KEY = {"conversation_id": {"S": "abcdefghij"}}
+DAY_START_KEY = {
+    "conversation_id": {"S": "abcdefghij"},
+    "create_day": {"S": "2024-05-01"},
+    "create_time": {"S": "2024-05-01 10:00:00"},
+}
+
+
+def test_export_cursor_round_trip():
+    cursor = {"segments": 4, "keys": {"0": TABLE_START_KEY, "3": TABLE_START_KEY}}
+    assert decode_cursor(encode_cursor(cursor)) == cursor
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        {"segments": 4, "keys": {}},
+        {"segments": 0, "keys": {"0": TABLE_START_KEY}},
+        {"segments": 4, "keys": {"4": TABLE_START_KEY}},
+        {"segments": 4, "keys": {"x": TABLE_START_KEY}},
+        {"segments": 4, "keys": {"0": {"conversation_id": {"N": "1"}}}},
+        {"segments": 4, "keys": {"0": {"conversation_id": {"S": 1}}}},
+        {"segments": 4, "keys": {"0": {"other": {"S": "a"}}}},
+        {"segments": 4, "keys": {"0": "abcdefghij"}},
+        {"segments": 4, "keys": [TABLE_START_KEY]},
+        {"segments": "4", "keys": {"0": TABLE_START_KEY}},
+        [],
+    ],
+)
+def test_invalid_export_cursors(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(encode_cursor(cursor))
+
+
+def test_export_cursor_that_is_not_base64_json():
+    with pytest.raises(InvalidCursor):
+        decode_cursor("not a cursor")
+
+
+def test_query_cursor_round_trip():
+    cursor = {"day": "2024-05-01", "key": DAY_START_KEY}
+    assert decode_query_cursor(encode_cursor(cursor), CREATE_DAY_INDEX_KEY) == cursor
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        {"day": "yesterday"},
+        {"key": TABLE_START_KEY},
+        {"key": "abc"},
+        ["2024-05-01"],
+    ],
+)
+def test_invalid_query_cursors(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_query_cursor(encode_cursor(cursor), CREATE_DAY_INDEX_KEY)
+
+
+def test_query_cursor_of_another_index():
+    with pytest.raises(InvalidCursor):
+        decode_query_cursor(
+            encode_cursor({"key": DAY_START_KEY}), INSURANCE_TYPE_INDEX_KEY
+        )
@@ -0,0 +1,84 @@
+import pytest
+
+from local_extractor import merge_model_answers, parse_clear_answer, try_local_turn
+from update_lambda import merge_model_state
+
+ANSWERS = {
+    "first_name": "John",
+    "last_name": "Doe",
+    "type_of_insurance": "Home",
+    "phone_number": 5551234567,
+}
+
+
+def user_turn(content: str) -> list:
+    return [{"role": "user", "content": content}]
+
+
+@pytest.mark.parametrize(
+    "field, reply, value",
+    [
+        ("first_name", "Mary-Ann", "Mary-Ann"),
+        ("first_name", "Anna.", "Anna"),
+        ("type_of_insurance", "home insurance", "Home"),
+        ("phone_number", "(555) 123-4567", 5551234567),
+        ("phone_number", "+1 555 123 4567", 5551234567),
+        ("age", "42", 42),
+    ],
+)
+def test_clear_answers(field, reply, value):
+    assert parse_clear_answer(field, reply) == value
+
+
+@pytest.mark.parametrize(
+    "field, reply",
+    [
+        ("first_name", "My name is Ann"),
+        ("first_name", "No"),
+        ("first_name", "Hello!"),
+        ("last_name", "why?"),
+        ("type_of_insurance", "house"),
+        ("phone_number", "555 1234"),
+        ("age", "forty"),
+    ],
+)
+def test_unclear_answers_go_to_the_model(field, reply):
+    assert parse_clear_answer(field, reply) is None
+
+
+def test_local_turn_asks_the_next_missing_field():
+    state = {"answers": {"first_name": "John"}, "pending_field": "last_name"}
+    is_finished, question, new_state = try_local_turn(state, user_turn("Doe"))
+    assert not is_finished
+    assert question == "What is the type of insurance you need?"
+    assert new_state == {
+        "answers": {"first_name": "John", "last_name": "Doe"},
+        "pending_field": "type_of_insurance",
+    }
+
+
+def test_local_turn_leaves_unclear_replies_to_the_model():
+    state = {"answers": {}, "pending_field": "first_name"}
+    assert try_local_turn(state, user_turn("No")) is None
+    assert try_local_turn({"answers": {}}, user_turn("John")) is None
+
+
+def test_invalid_model_answers_are_not_merged():
+    merged = merge_model_answers(ANSWERS, {"age": "old", "favourite_color": "red"})
+    assert merged == ANSWERS
+
+
+def test_correction_through_the_model_is_stored():
+    # the user corrects the first name, the model acknowledges "Jon" and asks the age
+    state = {"answers": dict(ANSWERS), "pending_field": "age"}
+    model_state = {
+        "pending_field": "age",
+        "collected_answers": dict(ANSWERS, first_name="Jon"),
+    }
+    state = merge_model_state(state, model_state)
+    assert state["answers"]["first_name"] == "Jon"
+
+    # the last answer is handled locally and finishes the form
+    is_finished, form, _ = try_local_turn(state, user_turn("30"))
+    assert is_finished
+    assert form == dict(ANSWERS, first_name="Jon", age=30)
@@ -0,0 +1,68 @@
+from streaming import ChatStreamAccumulator, NextQuestionExtractor, format_sse
+
+
+def feed_pieces(arguments: str, size: int) -> str:
+    extractor = NextQuestionExtractor()
+    text = ""
+    for end in range(size, len(arguments) + size, size):
+        text += extractor.feed(arguments[:end])
+    return text
+
+
+def test_question_is_extracted_piece_by_piece():
+    arguments = (
+        '{"next_question": "What is your first name?", "pending_field": "first_name"}'
+    )
+    for size in (1, 3, 7, len(arguments)):
+        assert feed_pieces(arguments, size) == "What is your first name?"
+
+
+def test_escapes_are_decoded_once_complete():
+    arguments = '{"next_question": "Say \\"hi\\" \\u00e9t\\u00e9\\nplease"}'
+    for size in (1, 2, 5):
+        assert feed_pieces(arguments, size) == 'Say "hi" été\nplease'
+
+
+def test_nothing_before_the_question_starts():
+    extractor = NextQuestionExtractor()
+    assert extractor.feed('{"pending_field": "age", "next_q') == ""
+    assert extractor.feed('{"pending_field": "age", "next_question": "Ho') == "Ho"
+
+
+def test_nothing_after_the_question_ends():
+    extractor = NextQuestionExtractor()
+    assert extractor.feed('{"next_question": "Age?"') == "Age?"
+    assert (
+        extractor.feed('{"next_question": "Age?", "collected_answers": {"a": "b"}}')
+        == ""
+    )
+
+
+def test_accumulator_streams_only_follow_up_questions():
+    accumulator = ChatStreamAccumulator()
+    chunks = [
+        {"function_call": {"name": "ask_follow_up_question", "arguments": ""}},
+        {"function_call": {"arguments": '{"next_question": "Your '}},
+        {"function_call": {"arguments": 'age?"}'}},
+    ]
+    shown = [accumulator.add({"choices": [{"delta": delta}]}) for delta in chunks]
+    assert shown == ["", "Your ", "age?"]
+    assert accumulator.message()["function_call"] == {
+        "name": "ask_follow_up_question",
+        "arguments": '{"next_question": "Your age?"}',
+    }
+
+    accumulator = ChatStreamAccumulator()
+    delta = {
+        "function_call": {
+            "name": "save_users_questionnaire",
+            "arguments": '{"next_question": "x"}',
+        }
+    }
+    assert accumulator.add({"choices": [{"delta": delta}]}) == ""
+
+
+def test_format_sse():
+    assert (
+        format_sse("token", {"text": "Hi"}) == 'event: token\ndata: {"text": "Hi"}\n\n'
+    )